@@ -0,0 +1,97 @@
+/*
+    Selects the tasks of an invocation among generated unlocked append blob files, one storage account holding most of
+    them, with the previous selection (sort of all the files by lastEnqueLockTime then the first ones up to the limits)
+    and with FileTaskScheduler. Each run is done in a child process and reports the time, the peak RSS and the tasks of
+    each storage account.
+    Run "npm run build" in src first, usage: node benchmarks/schedulerBenchmark.js [numFiles] [numAccounts]
+ */
+var path = require('path');
+var { execFileSync } = require('child_process');
+
+var producerDir = path.join(__dirname, '../target/appendblob_producer_build/AppendBlobTaskProducer');
+var MAX_FILE_TASK_PER_INVOKE = 8000;
+var MAX_FILE_TASK_PER_STORAGE_ACCOUNT = MAX_FILE_TASK_PER_INVOKE;
+
+function generateFiles(numFiles, numAccounts) {
+    let files = [];
+    let start = Date.parse('2024-03-01T00:00:00.000Z');
+    for (let i = 0; i < numFiles; i++) {
+        // 90% of the files in the noisy account, with the oldest enqueue times
+        let account = i % 10 === 0 ? 1 + ((i / 10) % (numAccounts - 1)) : 0;
+        let time = account === 0 ? start + i * 10 : start + numFiles * 5 + i * 10;
+        let file = {
+            partitionKey: 'sa' + account + '-c' + (i % 7),
+            rowKey: 'sa' + account + '-c' + (i % 7) + '-f' + i,
+            storageName: 'sa' + account,
+            containerName: 'c' + (i % 7),
+            eventdate: new Date(time).toISOString()
+        };
+        if (i % 3 !== 0) {
+            file.lastEnqueLockTime = new Date(time + 1000).toISOString();
+        }
+        files.push(file);
+    }
+    return files;
+}
+
+// getFixedNumberOfEntitiesbyEnqueTime before the FileTaskScheduler
+function runLegacy(entities) {
+    let lastEnqueLockTime_a;
+    let lastEnqueLockTime_b;
+    entities = entities.sort(function (a, b) {
+        lastEnqueLockTime_a = new Date(a.lastEnqueLockTime === undefined ? a.eventdate : a.lastEnqueLockTime);
+        lastEnqueLockTime_b = new Date(b.lastEnqueLockTime === undefined ? b.eventdate : b.lastEnqueLockTime);
+        return (lastEnqueLockTime_a < lastEnqueLockTime_b) ? -1 : ((lastEnqueLockTime_a > lastEnqueLockTime_b) ? 1 : 0);
+    });
+    let filesPerStorageAccountCount = {};
+    let filteredEntities = [];
+    for (let idx = 0; idx < entities.length && filteredEntities.length < MAX_FILE_TASK_PER_INVOKE; idx += 1) {
+        let entity = entities[idx];
+        filesPerStorageAccountCount[entity.storageName] = (filesPerStorageAccountCount[entity.storageName] || 0) + 1;
+        if (filesPerStorageAccountCount[entity.storageName] <= MAX_FILE_TASK_PER_INVOKE) {
+            filteredEntities.push(entity);
+        }
+    }
+    return filteredEntities;
+}
+
+function runScheduler(entities) {
+    let { FileTaskScheduler } = require(path.join(producerDir, 'taskscheduler'));
+    let scheduler = new FileTaskScheduler(MAX_FILE_TASK_PER_INVOKE, MAX_FILE_TASK_PER_STORAGE_ACCOUNT);
+    entities.forEach(function (entity) {
+        scheduler.add(entity);
+    });
+    return scheduler.select();
+}
+
+function runChild(mode, numFiles, numAccounts) {
+    let files = generateFiles(numFiles, numAccounts);
+    let baseRSS = process.memoryUsage().rss;
+    let start = process.hrtime.bigint();
+    let selected = mode === 'legacy' ? runLegacy(files) : runScheduler(files);
+    let milliseconds = Number(process.hrtime.bigint() - start) / 1e6;
+    let tasksPerAccount = {};
+    selected.forEach(function (entity) {
+        tasksPerAccount[entity.storageName] = (tasksPerAccount[entity.storageName] || 0) + 1;
+    });
+    console.log(JSON.stringify({
+        numTasks: selected.length,
+        milliseconds: Math.round(milliseconds),
+        peakRSSMB: Math.round(process.resourceUsage().maxRSS / 1024),
+        baseRSSMB: Math.round(baseRSS / 1024 / 1024),
+        tasksPerAccount: tasksPerAccount
+    }));
+}
+
+if (process.argv[2] === '--child') {
+    runChild(process.argv[3], parseInt(process.argv[4], 10), parseInt(process.argv[5], 10));
+} else {
+    let numFiles = parseInt(process.argv[2] || '500000', 10);
+    let numAccounts = parseInt(process.argv[3] || '5', 10);
+    console.log(`files: ${numFiles} storage accounts: ${numAccounts}`);
+    ['legacy', 'scheduler'].forEach(function (mode) {
+        let output = execFileSync(process.execPath, [__filename, '--child', mode, String(numFiles), String(numAccounts)]);
+        let result = JSON.parse(output.toString());
+        console.log(`${mode}: ${result.numTasks} tasks in ${result.milliseconds}ms peak RSS ${result.peakRSSMB}MB (${result.baseRSSMB}MB with the files) tasks per storage account ${JSON.stringify(result.tasksPerAccount)}`);
+    });
+}
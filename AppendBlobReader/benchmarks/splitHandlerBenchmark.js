@@ -0,0 +1,85 @@
+/*
+    Sends a generated log range through sendDataToSumoUsingSplitHandler to a local HTTP stub answering after a fixed
+    latency and reports the throughput for several values of max_chunks_in_flight, then the throughput and the peak memory
+    of the buffered and of the streaming (sendStreamToSumoUsingSplitHandler) versions.
+    Run "npm run build" in src first, usage: node benchmarks/splitHandlerBenchmark.js [rangeMB] [latencyMs]
+ */
+var http = require('node:http');
+var { Readable } = require('node:stream');
+var { sendDataToSumoUsingSplitHandler, sendStreamToSumoUsingSplitHandler } = require('../target/consumer_build/AppendBlobTaskConsumer/sendDataToSumoUsingSplitHandler');
+
+var rangeMB = parseInt(process.argv[2] || '32', 10);
+var latencyMs = parseInt(process.argv[3] || '50', 10);
+var context = {log: function () {}};
+context.log.error = context.log.verbose = context.log;
+
+function generateRange(sizeBytes) {
+    let lines = [];
+    let size = 0;
+    for (let i = 0; size < sizeBytes; i++) {
+        let line = `2024-05-07 10:14:34 INFO request ${i} completed in ${i % 997} ms user=user${i % 113}\n`;
+        lines.push(line);
+        size += line.length;
+    }
+    return Buffer.from(lines.join(''));
+}
+
+// the range as it is received from the storage account, in 4MB reads
+function* downloadStream(data) {
+    for (let i = 0; i < data.length; i += 4 * 1024 * 1024) {
+        yield Buffer.from(data.subarray(i, i + 4 * 1024 * 1024));
+    }
+}
+
+function getSendOptions(server, windowSize) {
+    return {
+        urlString: 'http://127.0.0.1:' + server.address().port + '/receiver/v1/http/benchmark',
+        MaxAttempts: 1,
+        compress_data: true,
+        metadata: {},
+        max_chunks_in_flight: windowSize
+    };
+}
+
+// peak of the memory used by the heap and by the buffers while fn runs
+async function measureMemory(name, fn) {
+    global.gc && global.gc();
+    let peak = 0;
+    let sample = () => {
+        let usage = process.memoryUsage();
+        peak = Math.max(peak, usage.heapUsed + usage.arrayBuffers);
+    };
+    let timer = setInterval(sample, 5);
+    let start = process.hrtime.bigint();
+    let dataLenSent = await fn();
+    let elapsedMs = Number(process.hrtime.bigint() - start) / 1e6;
+    clearInterval(timer);
+    sample();
+    console.log(`${name}: sent ${dataLenSent} bytes in ${elapsedMs.toFixed(0)} ms, peak memory ${(peak / 1048576).toFixed(0)} MB`);
+}
+
+async function run(server, data, windowSize) {
+    var serviceBusTask = {rowKey: 'benchmark', blobName: 'benchmark.log', startByte: 0};
+    var sendOptions = getSendOptions(server, windowSize);
+    let start = process.hrtime.bigint();
+    let dataLenSent = await sendDataToSumoUsingSplitHandler(context, data, sendOptions, serviceBusTask);
+    let elapsedMs = Number(process.hrtime.bigint() - start) / 1e6;
+    console.log(`max_chunks_in_flight ${windowSize}: sent ${dataLenSent} of ${data.length} bytes in ${elapsedMs.toFixed(0)} ms, ${(data.length / 1048576 / elapsedMs * 1000).toFixed(1)} MB/sec`);
+}
+
+var server = http.createServer(function (req, res) {
+    req.resume();
+    req.on('end', () => setTimeout(() => res.end(), latencyMs));
+});
+
+server.listen(0, '127.0.0.1', async function () {
+    let data = generateRange(rangeMB * 1024 * 1024);
+    for (let windowSize of [1, 2, 4, 8]) {
+        await run(server, data, windowSize);
+    }
+    var serviceBusTask = {rowKey: 'benchmark', blobName: 'benchmark.log', startByte: 0};
+    // the generated range is kept outside of the heap, only the copies made while sending are measured
+    await measureMemory('buffered', () => sendDataToSumoUsingSplitHandler(context, Buffer.concat(Array.from(downloadStream(data))), getSendOptions(server, 4), serviceBusTask));
+    await measureMemory('streaming', () => sendStreamToSumoUsingSplitHandler(context, Readable.from(downloadStream(data)), getSendOptions(server, 4), serviceBusTask));
+    server.close();
+});
@@ -5,18 +5,34 @@
 const { ContainerClient } = require("@azure/storage-blob");
 const { DefaultAzureCredential } = require("@azure/identity");
 const { TableClient } = require("@azure/data-tables");
-const { sendDataToSumoUsingSplitHandler } = require('./sendDataToSumoUsingSplitHandler');
+const { sendStreamToSumoUsingSplitHandler } = require('./sendDataToSumoUsingSplitHandler');
+const { defaultRegistry: formatRegistry, getBlobExtension } = require('./formatregistry');
+const { LRUCache } = require('./lrucache');
+const readyqueue = require('./readyqueue');
+const taskfeedback = require('./taskfeedback');
+const filelease = require('./filelease');
 const azureTableClient = TableClient.fromConnectionString(process.env.AzureWebJobsStorage, process.env.TABLE_NAME);
 const MaxAttempts = 3
+// number of ~1MB chunks of a task sent to Sumo at the same time
+const MaxChunksInFlight = 4
 
 var DEFAULT_CSV_SEPARATOR = ",";
 
 const tokenCredential = new DefaultAzureCredential();
+// ContainerClients keyed by container url, reused across invocations on a warm instance
+const containerClients = new LRUCache(100);
 
-function getUpdatedEntity(task, endByte) {
+function getContainerClient(task) {
+    return containerClients.getOrCreate(`https://${task.storageName}.blob.core.windows.net/${task.containerName}`, function (containerUrl) {
+        return new ContainerClient(containerUrl, tokenCredential);
+    });
+}
+
+function getUpdatedEntity(task, endByte, feedback) {
     //a single entity group transaction is limited to 100 entities. Also, the entire payload of the transaction may not exceed 4MB
     // RowKey/Partition key cannot contain "/"
     // sets the offset updatedate done(releases the enque lock)
+    // the feedback of the task is recorded for the task producer to size the next tasks (see taskfeedback.js)
 
     let entity = {
         done: false,
@@ -35,6 +51,8 @@ function getUpdatedEntity(task, endByte) {
     if (endByte > task.startByte) {
         entity.senddate = new Date().toISOString()
     }
+    Object.assign(entity, taskfeedback.getFeedbackColumns(feedback || {}));
+    entity.readyQueueKey = readyqueue.getReadyQueueKey(entity);
     return entity;
 }
 
@@ -49,13 +67,43 @@ async function updateAppendBlobPointerMap(entity) {
     return await azureTableClient.updateEntity(entity, "Merge");
 }
 
-async function setAppendBlobOffset(context, serviceBusTask, newOffset) {
+/**
+ * returns the ready queue partition of the locked file, moved by the lease renewals from the one of the task
+ */
+function getLockedReadyQueueKey(serviceBusTask, lease) {
+    return lease ? lease.readyQueueKey : serviceBusTask.readyQueueKey;
+}
+
+/**
+ * @param  {} lease - FileLease of the task, null for the tasks created without lease
+ *
+ * with a lease the offset is only updated if the lease of the task is still the lease of the file, a task which lost
+ * it leaves the offset to the task holding the new lease
+ */
+async function setAppendBlobOffset(context, serviceBusTask, newOffset, feedback, lease) {
     return new Promise(async (resolve, reject) => {
         try {
-            // Todo: this should be atomic update if other request decreases offset it shouldn't allow
             context.log.verbose("Attempting to update offset row: %s from: %d to: %d", serviceBusTask.rowKey, serviceBusTask.startByte, newOffset);
-            var entity = getUpdatedEntity(serviceBusTask, newOffset)
-            var updateResult = await updateAppendBlobPointerMap(entity)
+            var entity = getUpdatedEntity(serviceBusTask, newOffset, feedback)
+            if ((await readyqueue.addToReadyQueue(context, [entity])).size > 0) {
+                // the file keeps its lock in the ready queue, the task producer finds it unlocked once the lock expires
+                delete entity.readyQueueKey;
+            }
+            var updateResult;
+            if (lease) {
+                updateResult = await lease.release(entity);
+                if (!updateResult) {
+                    // the index entity added is dropped when it is read
+                    context.log.error(`Lease lost, offset not updated row: ${serviceBusTask.rowKey} from: ${serviceBusTask.startByte} to: ${newOffset} fencingToken: ${serviceBusTask.fencingToken}`);
+                    return resolve();
+                }
+            } else {
+                updateResult = await updateAppendBlobPointerMap(entity)
+            }
+            var previousKey = getLockedReadyQueueKey(serviceBusTask, lease);
+            if (entity.readyQueueKey && previousKey) {
+                await readyqueue.removeFromReadyQueue(context, [{ partitionKey: previousKey, rowKey: serviceBusTask.rowKey }]);
+            }
             context.log.verbose("Updated offset result: %s row: %s from: %d to: %d", JSON.stringify(updateResult), serviceBusTask.rowKey, serviceBusTask.startByte, newOffset);
             resolve();
         } catch (error) {
@@ -64,12 +112,12 @@ async function setAppendBlobOffset(context, serviceBusTask, newOffset) {
     });
 }
 
-async function releaseLockfromOffsetTable(context, serviceBusTask, dataLenSent = 0) {
+async function releaseLockfromOffsetTable(context, serviceBusTask, dataLenSent = 0, feedback = {}, lease = null) {
 
     var newOffset = parseInt(serviceBusTask.startByte, 10) + dataLenSent;
     return new Promise(async function (resolve, reject) {
         try {
-            await setAppendBlobOffset(context, serviceBusTask, newOffset)
+            await setAppendBlobOffset(context, serviceBusTask, newOffset, feedback, lease)
             if (serviceBusTask.startByte === newOffset) {
                 context.log("Successfully updated Lock for Table row: " + serviceBusTask.rowKey + " Offset remains the same : " + newOffset);
             } else {
@@ -127,59 +175,31 @@ function downloadErrorHandler(err, serviceBusTask, context) {
  * 
  * @param {Object} serviceBusTask - Task object associated with the service bus message.
  * @param {Object} context - The context object for logging or other operations.
+ * @param {Object} lease - FileLease of the task, the entity is only deleted if it still holds it
  */
-async function archiveIngestedFile(serviceBusTask, context) {
+async function archiveIngestedFile(serviceBusTask, context, lease = null) {
     try {
         // Delete entity from Azure Table Storage
         // blobName should not be used directly since they might be truncated
-        await azureTableClient.deleteEntity(serviceBusTask.partitionKey, serviceBusTask.rowKey);
+        if (lease) {
+            if (!(await lease.remove())) {
+                context.log.error(`Lease lost, entity not deleted, rowKey: ${serviceBusTask.rowKey}`);
+                return;
+            }
+        } else {
+            await azureTableClient.deleteEntity(serviceBusTask.partitionKey, serviceBusTask.rowKey);
+        }
         context.log(`Entity deleted, rowKey: ${serviceBusTask.rowKey}`);
+        var previousKey = getLockedReadyQueueKey(serviceBusTask, lease);
+        if (previousKey) {
+            await readyqueue.removeFromReadyQueue(context, [{ partitionKey: previousKey, rowKey: serviceBusTask.rowKey }]);
+        }
     } catch (error) {
         context.log.error(`failed to archive Ingested File : ${error}`);
     }
 }
 
 
-/**
- * Stream data from a readable stream to a buffer.
- * 
- * @param {Object} context - The context object for logging or other operations.
- * @param {ReadableStream} readableStream - The readable stream containing the data to be streamed.
- * @param {Object} serviceBusTask - Task object associated with the service bus message.
- * @returns {Promise<Buffer>} - A promise that resolves to a buffer containing the streamed data.
- */
-async function streamToBuffer(context, readableStream, serviceBusTask) {
-    return new Promise((resolve, reject) => {
-        var dataLen = 0;
-        var chunks = [];
-
-        // Event listener for data chunks
-        readableStream.on("data", (data) => {
-            if ((chunks.length >= 10 && chunks.length % 10 === 0) || chunks.length <= 2) {
-                context.log.verbose(`Received ${data.length} bytes of data. numChunks ${chunks.length}`);
-            }
-            // Accumulate data length and push data chunk to chunks array
-            dataLen += data.length;
-            chunks.push(Buffer.isBuffer(data) ? data : Buffer.from(data));
-        });
-
-        // Event listener for end of stream
-        readableStream.on("end", () => {
-            context.log(`Finished Fetching numChunks: ${chunks.length} dataLen: ${dataLen} rowKey: ${serviceBusTask.rowKey}`);
-            // Resolve the promise with concatenated buffer of all chunks
-            resolve(Buffer.concat(chunks));
-        });
-
-        // Event listener for stream errors
-        readableStream.on('error', (err) => {
-            // Reject the promise with the error if any
-            context.log.verbose(`Stream errors in streamToBuffer, rowKey: ${serviceBusTask.rowKey}`);
-            reject(err);
-        });
-    });
-}
-
-
 /**
  * Task Handler method to collect and parse data from Append Blob, send to Sumo Collector/Source
  * 
@@ -188,73 +208,109 @@ async function streamToBuffer(context, readableStream, serviceBusTask) {
  */
 async function appendBlobStreamMessageHandlerv2(context, serviceBusTask) {
 
-    var file_ext = serviceBusTask.blobName.split(".").pop();
-    if (file_ext == serviceBusTask.blobName) {
-        file_ext = "log";
-    }
-
-    var supportedExtensions = ['log', 'csv', 'json', 'blob', 'txt'];
-    if (!(supportedExtensions.includes(file_ext))) {
-        context.log.error("Error in messageHandler: Unknown file extension - " + file_ext + " for blob: " + serviceBusTask.blobName);
+    var format = formatRegistry.getFormat(serviceBusTask);
+    if (format === null || format.compression) {
+        context.log.error("Error in messageHandler: Unknown file extension - " + getBlobExtension(serviceBusTask.blobName) + " for blob: " + serviceBusTask.blobName);
         context.done();
         return;
     }
 
-    let options = {
-        maxRetryRequests: MaxAttempts
-    };
-
-    let bufferData = null;
-    try {
-        let batchSize = setAppendBlobBatchSize(serviceBusTask);
-
-        var containerClient = new ContainerClient(
-            `https://${serviceBusTask.storageName}.blob.core.windows.net/${serviceBusTask.containerName}`,
-            tokenCredential
-        );
-        var blockBlobClient = containerClient.getBlockBlobClient(serviceBusTask.blobName);
-
-        context.log.verbose(`Downloading blob, rowKey: ${serviceBusTask.rowKey}, offset: ${serviceBusTask.startByte}, count: ${serviceBusTask.startByte + batchSize - 1}, option: ${JSON.stringify(options)}`);
-        let downloadBlockBlobResponse = await blockBlobClient.download(serviceBusTask.startByte, batchSize, options);
-        bufferData = await streamToBuffer(context, downloadBlockBlobResponse.readableStreamBody, serviceBusTask)
-        context.log.verbose(`Successfully downloaded data, sending to SUMO.`);
-        
-    } catch (error) {
-        downloadErrorHandler(error, serviceBusTask, context);
-        if (error !== undefined && (error.code === "BlobNotFound" || error.statusCode == 404)) {
-            // delete the entry from table storage
-            await archiveIngestedFile(serviceBusTask, context);
-        } else {
-            await releaseLockfromOffsetTable(context, serviceBusTask);
+    // computed before the renewal of the lease starts, it is stopped by the finally below
+    let feedback = { batchSize: setAppendBlobBatchSize(serviceBusTask) };
+    let lease = null;
+    if (serviceBusTask.leaseId) {
+        lease = new filelease.FileLease(azureTableClient, serviceBusTask, context);
+        try {
+            if (!(await lease.claim())) {
+                context.log(`Stale task, the file was leased again or released, rowKey: ${serviceBusTask.rowKey} fencingToken: ${serviceBusTask.fencingToken}. Exit now!`);
+                context.done();
+                return;
+            }
+        } catch (error) {
+            // the task producer creates a new task once the lease expires
+            context.log.error(`Failed to claim lease, rowKey: ${serviceBusTask.rowKey} error: ${JSON.stringify(error)}. Exit now!`);
+            context.done();
+            return;
         }
-        
-        context.done();
-        return;
+        lease.startRenewal(context);
     }
-    let dataLenSent = 0;
-    try {
 
-        var sendOptions = {
-            urlString: getSumoEndpoint(serviceBusTask),
-            MaxAttempts: MaxAttempts,
-            RetryInterval: 3000,
-            compress_data: true,
-            clientHeader: "appendblobreader-azure-function"
+    try {
+        let options = {
+            maxRetryRequests: MaxAttempts
         };
 
-        setSourceCategory(serviceBusTask, sendOptions);
+        let readableStream = null;
+        let blobLength;
+        try {
+            let batchSize = feedback.batchSize;
 
-        // TODO: create new columns fetch status code and send status code in table so that task producer function can slow down creation of new tasks based on throttling / unavailability of storage/sumologic services
-        dataLenSent = await sendDataToSumoUsingSplitHandler(context, bufferData, sendOptions, serviceBusTask)
+            var blockBlobClient = getContainerClient(serviceBusTask).getBlockBlobClient(serviceBusTask.blobName);
 
-    } catch (err) {
-        context.log.error(`Error while sending to sumo: ${serviceBusTask.rowKey} err ${err}`);
+            context.log.verbose(`Downloading blob, rowKey: ${serviceBusTask.rowKey}, offset: ${serviceBusTask.startByte}, count: ${serviceBusTask.startByte + batchSize - 1}, option: ${JSON.stringify(options)}`);
+            let downloadStartTime = Date.now();
+            let downloadBlockBlobResponse = await blockBlobClient.download(serviceBusTask.startByte, batchSize, options);
+            feedback.downloadLatencyMs = Date.now() - downloadStartTime;
+            feedback.fetchStatusCode = 200;
+            blobLength = taskfeedback.getBlobLength(downloadBlockBlobResponse);
+            // the data is decoded and sent while it is downloaded
+            readableStream = downloadBlockBlobResponse.readableStreamBody;
+            context.log.verbose(`Successfully started download, sending to SUMO.`);
+
+        } catch (error) {
+            downloadErrorHandler(error, serviceBusTask, context);
+            feedback.fetchStatusCode = (error !== undefined && error.statusCode) || 0;
+            if (feedback.fetchStatusCode === 416) {
+                feedback.bytesBehind = 0;
+            }
+            if (error !== undefined && (error.code === "BlobNotFound" || error.statusCode == 404)) {
+                // delete the entry from table storage
+                await archiveIngestedFile(serviceBusTask, context, lease);
+            } else {
+                await releaseLockfromOffsetTable(context, serviceBusTask, 0, feedback, lease);
+            }
+
+            context.done();
+            return;
+        }
+        let dataLenSent = 0;
+        let sendStats = {};
+        let sendStartTime = Date.now();
+        try {
+
+            var sendOptions = {
+                urlString: getSumoEndpoint(serviceBusTask),
+                MaxAttempts: MaxAttempts,
+                RetryInterval: 3000,
+                compress_data: true,
+                max_chunks_in_flight: MaxChunksInFlight,
+                clientHeader: "appendblobreader-azure-function"
+            };
+
+            setSourceCategory(serviceBusTask, sendOptions);
+
+            // the status codes are recorded so that the task producer slows down for throttled storage accounts / sumo
+            dataLenSent = await sendStreamToSumoUsingSplitHandler(context, readableStream, sendOptions, serviceBusTask, sendStats)
+
+        } catch (err) {
+            context.log.error(`Error while sending to sumo: ${serviceBusTask.rowKey} err ${err}`);
+        } finally {
+            feedback.sendLatencyMs = Date.now() - sendStartTime;
+            feedback.sendStatusCode = taskfeedback.getSendStatusCode(sendStats.failedStatusCodes);
+            if (blobLength !== undefined) {
+                feedback.bytesBehind = Math.max(0, blobLength - (parseInt(serviceBusTask.startByte, 10) + dataLenSent));
+            }
+            await releaseLockfromOffsetTable(context, serviceBusTask, dataLenSent, feedback, lease)
+        }
+
+        context.done();
     } finally {
-        await releaseLockfromOffsetTable(context, serviceBusTask, dataLenSent)
+        // the renewal stops with the task, whatever the way it ends
+        if (lease !== null) {
+            lease.stopRenewal();
+        }
     }
 
-    context.done();
-
 }
 
 /**
@@ -0,0 +1,50 @@
+//////////////////////////////////////////////////////////////////////////////////////////////////////
+//           Tool to verify or rebuild the ready queue of the FileOffsetMap table                  //
+//////////////////////////////////////////////////////////////////////////////////////////////////////
+
+/*
+ * Usage, from target/appendblob_producer_build after "npm install":
+ *   AzureWebJobsStorage="<connection string>" TABLE_NAME=FileOffsetMap node AppendBlobTaskProducer/readyqueuetool.js verify|repair|rebuild
+ *
+ * verify - reports the files missing from the ready queue and its stale entities, exits with 1 if files are missing
+ * repair - verify, adds the missing files and removes the stale entities
+ * rebuild - repair and marks the ready queue built, the AppendBlobTaskProducer then polls it instead of FileOffsetMap
+ */
+
+const { TableClient } = require("@azure/data-tables");
+const readyqueue = require('./readyqueue');
+
+function getContext() {
+    var log = function () {
+        console.log.apply(console, arguments);
+    };
+    log.error = console.error;
+    log.verbose = function () {};
+    return { log: log };
+}
+
+async function main(command) {
+    if (!process.env.AzureWebJobsStorage || !process.env.TABLE_NAME || ["verify", "repair", "rebuild"].indexOf(command) === -1) {
+        console.error("usage: AzureWebJobsStorage=<connection string> TABLE_NAME=<table> node readyqueuetool.js verify|repair|rebuild");
+        process.exitCode = 2;
+        return;
+    }
+    var fileTableClient = TableClient.fromConnectionString(process.env.AzureWebJobsStorage, process.env.TABLE_NAME);
+    var context = getContext();
+    var report;
+    if (command === "rebuild") {
+        report = await readyqueue.rebuildReadyQueue(fileTableClient, context);
+    } else {
+        report = await readyqueue.verifyReadyQueue(fileTableClient, context, command === "repair");
+    }
+    console.log(JSON.stringify(report));
+    // stale entities are expected, they are removed when the task producer reads them
+    if (command === "verify" && report.missing > 0) {
+        process.exitCode = 1;
+    }
+}
+
+main(process.argv[2]).catch(function (error) {
+    console.error(error);
+    process.exitCode = 1;
+});
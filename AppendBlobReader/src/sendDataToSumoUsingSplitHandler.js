@@ -1,67 +1,133 @@
-const { decodeDataChunks } = require('./decodeDataChunks');
+const { pipeline } = require('node:stream');
+const { decodeDataChunks, DataChunkDecoder } = require('./decodeDataChunks');
 var sumoHttp = require("./sumoclient");
 
-function sendToSumoBlocking(chunk, sendOptions, context, isText) {
+// number of chunks sent at the same time when sendOptions.max_chunks_in_flight is not set
+const DEFAULT_MAX_CHUNKS_IN_FLIGHT = 4;
 
-    return new Promise(function (resolve, reject) {
+/*
+    Sends the chunks, an array or an async iterable such as a DataChunkDecoder, keeping up to windowSize of them in flight.
+    sendChunk(chunk) returns a promise resolving to true when the chunk is acknowledged. No new chunk is read after a failure.
+    Resolves with the number and the byte length of the chunks of the longest acknowledged prefix, chunks acknowledged after
+    a failed one are not counted so that the committed offset never skips data. An error while reading the chunks is
+    returned as error along with the prefix sent before it.
+ */
+async function sendChunksInWindow(dataChunks, sendChunk, windowSize) {
+    var chunkBytes = [];
+    var acked = [];
+    var inFlight = new Set();
+    var numChunksSent = 0;
+    var dataLenSent = 0;
+    var failed = false;
+    var error = null;
 
-        function failureHandler(msgArray, ctx) {
-            reject();
-        }
-        function successHandler(ctx) {
-            resolve();
-        }
-        let sumoClient = new sumoHttp.SumoClient(sendOptions, context, failureHandler, successHandler);
-        if (!isText) {
-            // Default encoding is UTF-8
-            let data = chunk.toString('utf8');
-            sumoClient.addData(data);
+    function onSettled(idx, success) {
+        if (success) {
+            acked[idx] = true;
+            // move the acknowledged prefix forward
+            while (acked[numChunksSent]) {
+                dataLenSent += chunkBytes[numChunksSent];
+                acked[numChunksSent] = false;
+                numChunksSent += 1;
+            }
         } else {
-            sumoClient.addData(chunk);
+            failed = true;
         }
+    }
 
-        sumoClient.flushAll();
-    });
-
+    let idx = 0;
+    try {
+        for await (const chunk of dataChunks) {
+            while (!failed && inFlight.size >= windowSize) {
+                await Promise.race(inFlight);
+            }
+            if (failed) {
+                break;
+            }
+            let chunkIdx = idx;
+            chunkBytes.push(Buffer.byteLength(chunk));
+            acked.push(false);
+            if (Array.isArray(dataChunks)) {
+                // the chunk is only referenced by the request from now on
+                dataChunks[chunkIdx] = null;
+            }
+            let request = Promise.resolve().then(() => sendChunk(chunk)).then(function (success) {
+                onSettled(chunkIdx, success !== false);
+            }, function () {
+                onSettled(chunkIdx, false);
+            }).then(function () {
+                inFlight.delete(request);
+            });
+            inFlight.add(request);
+            idx += 1;
+        }
+    } catch (err) {
+        error = err;
+    }
+    await Promise.all(inFlight);
+    return error ? {numChunksSent: numChunksSent, dataLenSent: dataLenSent, error: error} : {numChunksSent: numChunksSent, dataLenSent: dataLenSent};
 }
 
 /*
-    Creates a promise chain for each of the chunk received from decodeDataChunks
-    It increments
+    Sends the chunks received from decodeDataChunks with up to sendOptions.max_chunks_in_flight requests at a time
+    using a single client. Returns the byte length of the prefix and of the chunks acknowledged in order.
  */
 async function sendDataToSumoUsingSplitHandler(context, dataBytesBuffer, sendOptions, serviceBusTask) {
 
     var results = decodeDataChunks(context, dataBytesBuffer, serviceBusTask);
     var ignoredprefixLen = results[0];
     var dataChunks = results[1];
-    var numChunksSent = 0;
-    var dataLenSent = 0;
-    return new Promise(function (resolve, reject) {
+    var numChunks = dataChunks.length;
+    var windowSize = sendOptions.max_chunks_in_flight || DEFAULT_MAX_CHUNKS_IN_FLIGHT;
+    // one client for all the chunks of the task
+    var sumoClient = new sumoHttp.SumoClient(sendOptions, context, function (msgArray, ctx) {
+        ctx.log.error(`Failed to send chunk to Sumo blob: ${serviceBusTask.rowKey}`);
+    });
 
-        let promiseChain = Promise.resolve();
-        const makeNextPromise = (chunk) => () => {
-            return sendToSumoBlocking(chunk, sendOptions, context, true).then(function () {
-                numChunksSent += 1;
-                dataLenSent += Buffer.byteLength(chunk);
-            });
-        };
-        for (var i = 0; i < dataChunks.length; i++) {
-            promiseChain = promiseChain.then(makeNextPromise(dataChunks[i]));
-        }
-        return promiseChain.catch(function (err) {
-            context.log.error(`Error in sendDataToSumoUsingSplitHandler blob: ${serviceBusTask.rowKey} prefix: ${ignoredprefixLen} Sent ${dataLenSent} bytes of data. numChunksSent ${numChunksSent}`);
-            resolve(dataLenSent + ignoredprefixLen);
-        }).then(function () {
-            if (dataChunks.length === 0) {
-                context.log(`No chunks to send ${serviceBusTask.rowKey}`);
-            } else if (numChunksSent === dataChunks.length) {
-                context.log(`All chunks successfully sent to sumo, Blob: ${serviceBusTask.rowKey}, Prefix: ${ignoredprefixLen}, Sent ${dataLenSent} bytes of data. numChunksSent ${numChunksSent}`);
-            }
-            resolve(dataLenSent + ignoredprefixLen);
-        });
+    var sent = await sendChunksInWindow(dataChunks, (chunk) => sumoClient.send(chunk), windowSize);
+    if (numChunks === 0) {
+        context.log(`No chunks to send ${serviceBusTask.rowKey}`);
+    } else if (sent.numChunksSent === numChunks) {
+        context.log(`All chunks successfully sent to sumo, Blob: ${serviceBusTask.rowKey}, Prefix: ${ignoredprefixLen}, Sent ${sent.dataLenSent} bytes of data. numChunksSent ${sent.numChunksSent}`);
+    } else {
+        context.log.error(`Error in sendDataToSumoUsingSplitHandler blob: ${serviceBusTask.rowKey} prefix: ${ignoredprefixLen} Sent ${sent.dataLenSent} bytes of data. numChunksSent ${sent.numChunksSent}`);
+    }
+    return sent.dataLenSent + ignoredprefixLen;
+}
+
+/*
+    Streaming version of sendDataToSumoUsingSplitHandler, the downloaded data is piped into a DataChunkDecoder and the
+    chunks are sent as soon as they are decoded. The range is never held in memory as a whole.
+    Returns the byte length of the prefix and of the chunks acknowledged in order, also when reading the stream fails.
+    sendStats is optional, it is set to the delivery stats of the SumoClient (see SumoClient.getStats).
+ */
+async function sendStreamToSumoUsingSplitHandler(context, readableStream, sendOptions, serviceBusTask, sendStats) {
 
+    var decoder = new DataChunkDecoder(context, serviceBusTask);
+    // destroys the download stream as well if sending stops early
+    pipeline(readableStream, decoder, function () {});
+    var windowSize = sendOptions.max_chunks_in_flight || DEFAULT_MAX_CHUNKS_IN_FLIGHT;
+    var sumoClient = new sumoHttp.SumoClient(sendOptions, context, function (msgArray, ctx) {
+        ctx.log.error(`Failed to send chunk to Sumo blob: ${serviceBusTask.rowKey}`);
     });
 
+    var sent = await sendChunksInWindow(decoder, (chunk) => sumoClient.send(chunk), windowSize);
+    var ignoredprefixLen = decoder.ignoredprefixLen;
+    if (sendStats) {
+        Object.assign(sendStats, sumoClient.getStats());
+    }
+    if (sent.error) {
+        context.log.error(`Error while streaming blob: ${serviceBusTask.rowKey} prefix: ${ignoredprefixLen} Sent ${sent.dataLenSent} bytes of data. numChunksSent ${sent.numChunksSent} err: ${sent.error}`);
+    } else if (decoder.numChunks === 0) {
+        context.log(`No chunks to send ${serviceBusTask.rowKey}`);
+    } else if (sent.numChunksSent === decoder.numChunks) {
+        context.log(`All chunks successfully sent to sumo, Blob: ${serviceBusTask.rowKey}, Prefix: ${ignoredprefixLen}, Sent ${sent.dataLenSent} bytes of data. numChunksSent ${sent.numChunksSent}`);
+    } else {
+        context.log.error(`Error in sendStreamToSumoUsingSplitHandler blob: ${serviceBusTask.rowKey} prefix: ${ignoredprefixLen} Sent ${sent.dataLenSent} bytes of data. numChunksSent ${sent.numChunksSent}`);
+    }
+    return sent.dataLenSent + ignoredprefixLen;
 }
 
-exports.sendDataToSumoUsingSplitHandler = sendDataToSumoUsingSplitHandler;
\ No newline at end of file
+exports.sendDataToSumoUsingSplitHandler = sendDataToSumoUsingSplitHandler;
+exports.sendStreamToSumoUsingSplitHandler = sendStreamToSumoUsingSplitHandler;
+exports.sendChunksInWindow = sendChunksInWindow;
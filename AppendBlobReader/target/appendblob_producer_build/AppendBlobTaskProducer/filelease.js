@@ -0,0 +1,244 @@
+//////////////////////////////////////////////////////////////////////////////////////////////////////
+//           Lease of the append blob files locked by the task producer                             //
+//////////////////////////////////////////////////////////////////////////////////////////////////////
+
+/*
+ * A file is locked (done eq true) with a lease saved in its FileOffsetMap entity:
+ *   leaseId - id of the task holding the lock
+ *   leaseExpiry - time after which the task producer releases the lock
+ *   fencingToken - incremented with each lease of the file, a task carries the one of its lease
+ * The task producer takes a lease with a merge conditional on the ETag of the entity it read, so a single task is
+ * created for a file even if several invocations run at the same time. Its lease covers the queueing delay of the
+ * tasks. The consumer claims the lease when it starts (the task is dropped if the file was leased again meanwhile),
+ * renews it while the task runs and releases it with the new offset. All its writes are conditional on the ETag read
+ * with the lease, a consumer which lost its lease cannot move the offset anymore. The ready queue entity of the file
+ * (see readyqueue.js) is moved with the expiry of the lease, so that the producer polls the file once the lease of the
+ * consumer expires.
+ * Files locked before the leases (without leaseExpiry) are released once their lock exceeds the lock threshold.
+ */
+
+const crypto = require("crypto");
+const readyqueue = require('./readyqueue');
+
+// APPSETTING_LeaseDurationSeconds - lease of a running task, renewed every third of it, 30 min by default
+const LEASE_DURATION_MS = (parseInt(process.env.APPSETTING_LeaseDurationSeconds, 10) || 30 * 60) * 1000;
+
+/**
+ * @param  {} entity - FileOffsetMap entity of the file read by the task producer
+ * @param  {} now
+ * @param  {} durationMs - duration of the lease, it must cover the queueing delay of the task
+ * returns the columns of a new lease of the file
+ */
+function getNewLease(entity, now, durationMs) {
+    return {
+        leaseId: crypto.randomUUID(),
+        leaseExpiry: new Date(now.getTime() + durationMs).toISOString(),
+        fencingToken: (Number(entity.fencingToken) || 0) + 1
+    };
+}
+
+/**
+ * returns the columns of a released lease, the fencingToken is kept
+ */
+function getReleasedLease() {
+    return { leaseId: "", leaseExpiry: "" };
+}
+
+/**
+ * @param  {} entity - FileOffsetMap entity of a locked file
+ * @param  {} now
+ * @param  {} lockExpiryTime - ISO time before which the locks without lease are expired
+ */
+function isLockExpired(entity, now, lockExpiryTime) {
+    if (entity.leaseExpiry) {
+        return entity.leaseExpiry <= now.toISOString();
+    }
+    return (entity.lastEnqueLockTime || entity.eventdate) <= lockExpiryTime;
+}
+
+/**
+ * @param  {} entity - FileOffsetMap entity of the file
+ * @param  {} task
+ * returns true if the lease of the task is the current lease of the file
+ */
+function isLeaseHolder(entity, task) {
+    return entity.done === true && entity.leaseId === task.leaseId && Number(entity.fencingToken) === Number(task.fencingToken);
+}
+
+/**
+ * Lease of a task held by the task consumer, the ETag of the entity is updated with each write
+ * @param {} tableClient - FileOffsetMap table client
+ * @param {} task
+ * @param {} context
+ * @constructor
+ */
+function FileLease(tableClient, task, context) {
+    this.tableClient = tableClient;
+    this.task = task;
+    this.context = context;
+    this.etag = null;
+    // partition of the ready queue entity of the file, it follows the expiry of the lease
+    this.readyQueueKey = task.readyQueueKey;
+    this.lost = false;
+    this._renewTimer = null;
+    // the writes are serialized, each one is conditional on the ETag of the previous one
+    this._lastWrite = Promise.resolve();
+}
+
+FileLease.prototype._serialize = function (write) {
+    var result = this._lastWrite.then(write);
+    this._lastWrite = result.catch(function () {});
+    return result;
+};
+
+/**
+ * Reads the entity of the file and extends the lease of the task, resolves with false if the file was leased again or
+ * released, the task is stale then
+ */
+FileLease.prototype.claim = function () {
+    var self = this;
+    return this._serialize(async function () {
+        var entity;
+        try {
+            entity = await self.tableClient.getEntity(self.task.partitionKey, self.task.rowKey);
+        } catch (error) {
+            if (error.statusCode === 404) {
+                self.lost = true;
+                return false;
+            }
+            throw error;
+        }
+        if (!isLeaseHolder(entity, self.task)) {
+            self.lost = true;
+            return false;
+        }
+        self.etag = entity.etag;
+        self.readyQueueKey = entity.readyQueueKey;
+        return self._extend();
+    });
+};
+
+/**
+ * Extends the lease by LEASE_DURATION_MS and moves the ready queue entity of the file to the bucket of the new expiry,
+ * resolves with false if the lease was lost
+ */
+FileLease.prototype.renew = function () {
+    return this._serialize(this._extend.bind(this));
+};
+
+FileLease.prototype._extend = async function () {
+    if (this.lost) {
+        return false;
+    }
+    var update = {
+        partitionKey: this.task.partitionKey,
+        rowKey: this.task.rowKey,
+        leaseExpiry: new Date(Date.now() + LEASE_DURATION_MS).toISOString()
+    };
+    var readyQueueKey = readyqueue.getReadyQueueKey({ done: true, leaseExpiry: update.leaseExpiry });
+    // the new index entity is added first, the file keeps the previous one if it cannot be added
+    var moved = readyQueueKey !== this.readyQueueKey &&
+        (await readyqueue.addToReadyQueue(this.context, [{ partitionKey: update.partitionKey, rowKey: update.rowKey, readyQueueKey: readyQueueKey }])).size === 0;
+    if (moved) {
+        update.readyQueueKey = readyQueueKey;
+    }
+    try {
+        var response = await this.tableClient.updateEntity(update, "Merge", { etag: this.etag });
+        this.etag = response.etag;
+    } catch (error) {
+        if (error.statusCode === 412 || error.statusCode === 404) {
+            // the lease expired and the file was released or leased again, the index entity added is dropped when read
+            this.lost = true;
+            return false;
+        }
+        throw error;
+    }
+    if (moved) {
+        var previousKey = this.readyQueueKey;
+        this.readyQueueKey = readyQueueKey;
+        if (previousKey) {
+            await readyqueue.removeFromReadyQueue(this.context, [{ partitionKey: previousKey, rowKey: update.rowKey }]);
+        }
+    }
+    return true;
+};
+
+/**
+ * Renews the lease every third of LEASE_DURATION_MS until stopRenewal is called
+ */
+FileLease.prototype.startRenewal = function (context) {
+    var self = this;
+    this._renewTimer = setInterval(function () {
+        self.renew().then(function (renewed) {
+            if (!renewed) {
+                context.log.error(`Lease lost for blob: ${self.task.rowKey} fencingToken: ${self.task.fencingToken}`);
+                self.stopRenewal();
+            }
+        }).catch(function (error) {
+            // retried with the next renewal, before the lease expires
+            context.log.error(`Failed to renew lease for blob: ${self.task.rowKey}, error: ${JSON.stringify(error)}`);
+        });
+    }, Math.max(1000, Math.floor(LEASE_DURATION_MS / 3)));
+};
+
+FileLease.prototype.stopRenewal = function () {
+    if (this._renewTimer !== null) {
+        clearInterval(this._renewTimer);
+        this._renewTimer = null;
+    }
+};
+
+/**
+ * Merges the entity (the new offset and the released lease) if the lease is still held, resolves with false otherwise
+ */
+FileLease.prototype.release = function (entity) {
+    var self = this;
+    this.stopRenewal();
+    return this._serialize(async function () {
+        if (self.lost) {
+            return false;
+        }
+        try {
+            await self.tableClient.updateEntity(Object.assign({}, entity, getReleasedLease()), "Merge", { etag: self.etag });
+            return true;
+        } catch (error) {
+            if (error.statusCode === 412 || error.statusCode === 404) {
+                self.lost = true;
+                return false;
+            }
+            throw error;
+        }
+    });
+};
+
+/**
+ * Deletes the entity of the file (archived) if the lease is still held, resolves with false otherwise
+ */
+FileLease.prototype.remove = function () {
+    var self = this;
+    this.stopRenewal();
+    return this._serialize(async function () {
+        if (self.lost) {
+            return false;
+        }
+        try {
+            await self.tableClient.deleteEntity(self.task.partitionKey, self.task.rowKey, { etag: self.etag });
+            return true;
+        } catch (error) {
+            if (error.statusCode === 412 || error.statusCode === 404) {
+                self.lost = true;
+                return false;
+            }
+            throw error;
+        }
+    });
+};
+
+module.exports = {
+    LEASE_DURATION_MS: LEASE_DURATION_MS,
+    getNewLease: getNewLease,
+    getReleasedLease: getReleasedLease,
+    isLockExpired: isLockExpired,
+    isLeaseHolder: isLeaseHolder,
+    FileLease: FileLease
+};
@@ -2,8 +2,35 @@
 //           Function to create Append Blob tasks using File OffsetMap Table into Azure Event Hub //
 //////////////////////////////////////////////////////////////////////////////////////////////////////
 
-const { TableClient, TableTransaction } = require("@azure/data-tables");
+const { TableClient, TableTransaction, odata } = require("@azure/data-tables");
 const tableClient = TableClient.fromConnectionString(process.env.AzureWebJobsStorage, process.env.TABLE_NAME);
+const readyqueue = require('./readyqueue');
+const { FileTaskScheduler } = require('./taskscheduler');
+const taskfeedback = require('./taskfeedback');
+const filelease = require('./filelease');
+// entities per page of the queries, the table service returns at most 1000
+const QUERY_PAGE_SIZE = 1000;
+// based on experiments it takes ~3min to process 8000 tasks with file size of ~5MB
+const MAX_FILE_TASK_PER_INVOKE = 8000;
+// candidate files polled per invocation to select the tasks from, the last page may exceed it
+const MAX_CANDIDATES_PER_INVOKE = 4 * MAX_FILE_TASK_PER_INVOKE;
+// the tasks are selected and their files locked each time a page of candidates was polled, in proportion to the tasks
+// of the invocation per candidate, instead of once all the files are polled
+const SELECTION_ROUND_CANDIDATES = QUERY_PAGE_SIZE;
+// storage account read api limit, a task makes at least one read request
+const MAX_READ_API_LIMIT_PER_SEC = 20000;
+// APPSETTING_MaxFileTaskPerStorageAccount - max tasks of a storage account per invocation, all the tasks by default as
+// the FileTaskScheduler already shares them between the accounts with a backlog
+const MAX_FILE_TASK_PER_STORAGE_ACCOUNT = parseInt(process.env.APPSETTING_MaxFileTaskPerStorageAccount, 10) || MAX_FILE_TASK_PER_INVOKE;
+const MAX_GET_BLOB_REQUEST_PER_INVOKE = 50; // 50*4MB = 200MB max batch size size
+// no page is queried after POLL_TIME_BUDGET_MS, the function runs every 5 min
+const POLL_TIME_BUDGET_MS = 3 * 60 * 1000;
+// the position of the poller is saved between invocations in this entity, "_" is not allowed in container names so it
+// cannot collide with the partitions of the files
+const CHECKPOINT_PARTITION_KEY = "__appendblobtaskproducer__";
+const CHECKPOINT_ROW_KEY = "checkpoint";
+// task limits of the throttled storage accounts, see taskfeedback.js
+const TASK_LIMITS_ROW_KEY = "tasklimits";
 
 function getTask(entity) {
     return {
@@ -19,11 +46,13 @@ function getTask(entity) {
     };
 }
 
-function getLockedEntity(entity) {
+function getLockedEntity(entity, leaseDurationMs) {
     //a single entity group transaction is limited to 100 entities. Also, the entire payload of the transaction may not exceed 4MB
     // rowKey/partitionKey cannot contain "/"
     // lastEnqueLockTime - it denotes the last time when it was enqueued in Event Hub
     // done - it is set to true which means the task is enqueued in Event Hub
+    // leaseId, leaseExpiry, fencingToken - lease of the task, see filelease.js
+    var lease = filelease.getNewLease(entity, new Date(), leaseDurationMs);
     var entity = {
         partitionKey: entity.partitionKey,
         rowKey: entity.rowKey,
@@ -38,6 +67,8 @@ function getLockedEntity(entity) {
         resourceGroupName: entity.resourceGroupName,
         subscriptionId: entity.subscriptionId
     };
+    Object.assign(entity, lease);
+    entity.readyQueueKey = readyqueue.getReadyQueueKey(entity);
     return entity;
 }
 
@@ -67,7 +98,8 @@ function getunLockedEntity(entity) {
         resourceGroupName: entity.resourceGroupName,
         subscriptionId: entity.subscriptionId
     };
-
+    Object.assign(entity, filelease.getReleasedLease());
+    entity.readyQueueKey = readyqueue.getReadyQueueKey(entity);
     return entity;
 }
 
@@ -117,34 +149,139 @@ function isAppendBlobArchived(context, entity) {
 }
 
 /**
+ * @param  {} partitionKey
+ * returns the first partitionKey after the given one or null, only the keys are selected so that the service seeks the
+ * next partition instead of scanning the table
+ */
+async function getNextPartitionKey(partitionKey) {
+    var pages = tableClient.listEntities({
+        queryOptions: { filter: odata`PartitionKey gt ${partitionKey}`, select: ["PartitionKey"] }
+    }).byPage({ maxPageSize: 1 });
+    for await (const page of pages) {
+        if (page.length > 0) {
+            return page[0].partitionKey;
+        }
+    }
+    return null;
+}
+
+/**
+ * @param  {} partitionKey
  * @param  {} tableQuery
- * fetches the files from FileOffset Map table recursively
+ * @param  {} continuationToken - position of the first page, undefined to start from the beginning of the partition
+ * returns an async iterator of the pages of the files of the partition matching tableQuery, each page has the
+ * continuationToken of the next one
  */
-function queryFiles(tableQuery, context) {
-    // Todo: it queries to the whole table break this by per Partitionkey
-    var allentities = [];
-    return new Promise(async (resolve, reject) => {
-        try {
-            var entities = tableClient.listEntities({
-                queryOptions: { filter: tableQuery }
-            });
+function queryPartitionPages(partitionKey, tableQuery, continuationToken) {
+    return tableClient.listEntities({
+        queryOptions: { filter: odata`PartitionKey eq ${partitionKey}` + ` and ${tableQuery}` }
+    }).byPage({ maxPageSize: QUERY_PAGE_SIZE, continuationToken: continuationToken });
+}
 
-            for await (const entity of entities) {
-                allentities.push(entity);
-            }
-            return resolve(allentities);
-        } catch (error) {
-            context.log.error(`Error while fetching queryFiles: ${JSON.stringify(error)}`);
-            return reject(error);
+/*
+ *  Position of the poller in the table: the partition being polled and the continuationToken of its next page, or the
+ *  last partition polled when continuationToken is empty. lastPartitionKey is empty at the start of a pass.
+ */
+async function readCheckpoint(context) {
+    try {
+        var entity = await tableClient.getEntity(CHECKPOINT_PARTITION_KEY, CHECKPOINT_ROW_KEY);
+        return {
+            lastPartitionKey: entity.lastPartitionKey || "",
+            continuationToken: entity.continuationToken || undefined,
+            maxQueueingDelay: entity.maxQueueingDelay || 0
+        };
+    } catch (error) {
+        if (error.statusCode !== 404) {
+            context.log.error(`Unable to read poller checkpoint, starting from the first partition, Error: ${JSON.stringify(error)}`);
         }
-    })
+        return { lastPartitionKey: "", continuationToken: undefined, maxQueueingDelay: 0 };
+    }
+}
+
+async function saveCheckpoint(context, checkpoint) {
+    try {
+        await tableClient.upsertEntity({
+            partitionKey: CHECKPOINT_PARTITION_KEY,
+            rowKey: CHECKPOINT_ROW_KEY,
+            lastPartitionKey: checkpoint.lastPartitionKey,
+            continuationToken: checkpoint.continuationToken || "",
+            maxQueueingDelay: checkpoint.maxQueueingDelay,
+            updatedate: new Date().toISOString()
+        }, "Replace");
+    } catch (error) {
+        // the next invocation polls the same pages again, their files are already locked
+        context.log.error(`Unable to save poller checkpoint, Error: ${JSON.stringify(error)}`);
+    }
+}
+
+/*
+ * returns {limits, updatedate}, limits are the task limits of the storage accounts by storageName and updatedate the
+ * time they were saved, the throttling recorded by the consumer after it is not taken into account yet
+ */
+async function readTaskLimits(context) {
+    try {
+        var entity = await tableClient.getEntity(CHECKPOINT_PARTITION_KEY, TASK_LIMITS_ROW_KEY);
+        return { limits: JSON.parse(entity.limits || "{}"), updatedate: entity.updatedate || "" };
+    } catch (error) {
+        if (error.statusCode !== 404) {
+            context.log.error(`Unable to read task limits, Error: ${JSON.stringify(error)}`);
+        }
+        return { limits: {}, updatedate: "" };
+    }
+}
+
+async function saveTaskLimits(context, limits, updatedate) {
+    try {
+        await tableClient.upsertEntity({
+            partitionKey: CHECKPOINT_PARTITION_KEY,
+            rowKey: TASK_LIMITS_ROW_KEY,
+            limits: JSON.stringify(limits),
+            updatedate: updatedate
+        }, "Replace");
+    } catch (error) {
+        // the next invocation takes the same throttling into account again
+        context.log.error(`Unable to save task limits, Error: ${JSON.stringify(error)}`);
+    }
+}
+
+/*
+ * Halves the task limit of the storage accounts throttled since the previous invocation and increases the others', the
+ * limits reaching the max tasks of an account are dropped. The accounts polled so far are updated, from the limits of
+ * the previous invocation.
+ */
+function getTaskLimits(poll) {
+    var limits = Object.assign({}, poll.taskLimits.limits);
+    Object.keys(poll.scheduler.getBacklogPerAccount()).forEach(function (storageName) {
+        var taskLimit = taskfeedback.getNextTaskLimit(limits[storageName], poll.throttledAccounts.has(storageName), MAX_FILE_TASK_PER_STORAGE_ACCOUNT);
+        if (taskLimit < MAX_FILE_TASK_PER_STORAGE_ACCOUNT) {
+            limits[storageName] = taskLimit;
+        } else {
+            delete limits[storageName];
+        }
+    });
+    return limits;
+}
+
+/*
+ * Saves the task limits of the storage accounts polled, the next invocation starts from them
+ */
+async function updateTaskLimits(context, poll) {
+    var updatedate = new Date(poll.startTime).toISOString();
+    var limits = getTaskLimits(poll);
+    if (poll.throttledAccounts.size > 0 || Object.keys(poll.taskLimits.limits).length > 0) {
+        context.log(`Throttled storage accounts: ${JSON.stringify(Array.from(poll.throttledAccounts))} task limits: ${JSON.stringify(limits)}`);
+        await saveTaskLimits(context, limits, updatedate);
+    }
 }
 
 /*
  *  Updates the entities in batches, it groups the entities by partitionKey
  *  mode - if mode == insert it inserts or merges the entity
+ *  onWritten - optional, called with the entities of each batch written and waited for
+ *  etags - optional, ETags of the entities read by rowKey, an entity is then merged only if it was not changed since.
+ *  A transaction fails as a whole, the entities of a batch with a conflict are merged one by one.
  */
-function batchUpdateOffsetTable(context, allentities, mode) {
+function batchUpdateOffsetTable(context, allentities, mode, onWritten, etags) {
     var batch_promises = [];
     var successCnt = 0;
     var errorCnt = 0;
@@ -166,6 +303,8 @@ function batchUpdateOffsetTable(context, allentities, mode) {
                         const element = currentBatch[index];
                         if (mode === "delete") {
                             transaction.deleteEntity(element.partitionKey, element.rowKey);
+                        } else if (etags) {
+                            transaction.updateEntity(element, "Merge", { etag: etags[element.rowKey] });
                         } else {
                             transaction.updateEntity(element, "Merge");
                         }
@@ -173,8 +312,14 @@ function batchUpdateOffsetTable(context, allentities, mode) {
                     try {
                         await tableClient.submitTransaction(transaction.actions);
                         successCnt += 1
+                        if (onWritten) {
+                            await onWritten(currentBatch);
+                        }
                         return resolve({ status: "success" });
                     } catch (error) {
+                        if (etags && (error.statusCode === 412 || error.statusCode === 404)) {
+                            return resolve(await updateEntitiesIfNotModified(context, currentBatch, etags, onWritten));
+                        }
                         context.log.error(`Error occurred while updating offset table for batch: ${batchIndex}, error: ${JSON.stringify(error)}`);
                         // not using reject so that all promises will get processed in promise.all
                         errorCnt += 1;
@@ -193,83 +338,120 @@ function batchUpdateOffsetTable(context, allentities, mode) {
 
 
 /*
- * In some cases due to rogue message consumer function may not be able to process messages
- * and thus there is a chance that the file may get locked for a long time so the below function automatically
- * releases the lock after a threshold is breached.
+ *  Merges the entities one by one, each one only if it was not changed since it was read
  */
-function getLockedEntitiesExceedingThreshold(context, maxQueueingDelay) {
-
-    var maxlockThresholdMin = 30;
-    if (maxQueueingDelay > 30) {
-        context.log("WARNING maxQueueingDelay exceeding 30 minutes");
-        maxlockThresholdMin = maxQueueingDelay;
+async function updateEntitiesIfNotModified(context, entities, etags, onWritten) {
+    var written = [];
+    var conflicts = 0;
+    for (const entity of entities) {
+        try {
+            await tableClient.updateEntity(entity, "Merge", { etag: etags[entity.rowKey] });
+            written.push(entity);
+        } catch (error) {
+            if (error.statusCode !== 412 && error.statusCode !== 404) {
+                context.log.error(`Error occurred while updating offset table row: ${entity.rowKey}, error: ${JSON.stringify(error)}`);
+            }
+            conflicts += 1;
+        }
     }
-    let MS_PER_MINUTE = 60*1000;
-    var dateVal = new Date(new Date() - maxlockThresholdMin*MS_PER_MINUTE);
-    var lockedFileQuery = `done eq ${true} and blobType eq '${'AppendBlob'}' and offset ge ${0} and lastEnqueLockTime le '${dateVal.toISOString()}'`
-    return queryFiles(lockedFileQuery, context).then(function (allentities) {
-        context.log(`AppendBlob Locked Files exceeding maxlockThresholdMin of ${maxlockThresholdMin}:  ${allentities.length}`);
-        var unlockedEntities = allentities.map(function (entity) {
-            context.log.verbose("Unlocking Append Blob File with rowKey: %s lastEnqueLockTime: %s", entity.rowKey, entity.lastEnqueLockTime);
-            return getunLockedEntity(entity);
-        });
-        return unlockedEntities;
-    }).catch(function (error) {
-        context.log.error(`Unable to fetch AppendBlob locked rows from table, Error: ${JSON.stringify(error)}`);
-        return [];
+    if (onWritten && written.length > 0) {
+        await onWritten(written);
+    }
+    context.log.verbose(`Rows changed by another invocation since they were read: ${conflicts}`);
+    return { status: "success", conflicts: conflicts };
+}
+
+/*
+ *  Saves the new state of the files: their ready queue entity is added first, then FileOffsetMap is updated and the
+ *  previous ready queue entity removed. A file is only updated if it was not changed since it was read, e.g. by another
+ *  invocation or by the consumer. Resolves with the new entities of the files updated, the others are left unchanged.
+ */
+async function updateFiles(context, entities, getNewEntity, poll) {
+    var previousKeys = {};
+    var etags = {};
+    entities.forEach(function (entity) {
+        previousKeys[entity.rowKey] = entity.readyQueueKey;
+        etags[entity.rowKey] = entity.etag;
+    });
+    var newEntities = entities.map(function (entity) {
+        return getNewEntity(entity);
+    });
+    var failed = await readyqueue.addToReadyQueue(context, newEntities);
+    newEntities = newEntities.filter(function (entity) {
+        return !failed.has(entity.rowKey);
     });
+    var updatedEntities = [];
+    var update = batchUpdateOffsetTable(context, newEntities, "insert", function (written) {
+        updatedEntities.push.apply(updatedEntities, written);
+        return readyqueue.removeFromReadyQueue(context, getPreviousIndexEntities(written, previousKeys));
+    }, etags);
+    poll.updates.push(update);
+    // the index entities added for the files not updated are left, another invocation may have added the same ones,
+    // they are dropped when they are read
+    await update;
+    return updatedEntities;
 }
 
-function getFixedNumberOfEntitiesbyEnqueTime(context, entities) {
-    // sort by lastenquetime they are in isoformat so are lexicographically sorted
-    let lastEnqueLockTime_a;
-    let lastEnqueLockTime_b;
-    entities = entities.sort(function (a, b) {
-        if (a.lastEnqueLockTime === undefined) {
-            lastEnqueLockTime_a = a.eventdate;
-        } else {
-            lastEnqueLockTime_a = a.lastEnqueLockTime;
-        }
-        if (b.lastEnqueLockTime === undefined) {
-            lastEnqueLockTime_b = b.eventdate;
-        } else {
-            lastEnqueLockTime_b = b.lastEnqueLockTime;
-        }
-        lastEnqueLockTime_a = new Date(lastEnqueLockTime_a);
-        lastEnqueLockTime_b = new Date(lastEnqueLockTime_b);
-        return (lastEnqueLockTime_a < lastEnqueLockTime_b) ? -1 : ((lastEnqueLockTime_a > lastEnqueLockTime_b) ? 1 : 0);
+function getPreviousIndexEntities(entities, previousKeys) {
+    return entities.filter(function (entity) {
+        return previousKeys[entity.rowKey] && previousKeys[entity.rowKey] !== entity.readyQueueKey;
+    }).map(function (entity) {
+        return { partitionKey: previousKeys[entity.rowKey], rowKey: entity.rowKey };
     });
+}
 
-    let filesPerStorageAccountCount = {};
-    let allFileCount = 0;
-    let maxFileTaskPerInvoke = 8000;
-    // based on experiments it takes ~3min to process 8000 tasks with file size of ~5MB
-    let maxFileTaskPerInvokePerStorageAccount = 8000;
-    var filteredEntities = [];
-    let entity = null;
-    for (let idx = 0; idx < entities.length; idx += 1) {
-        entity = entities[idx];
-
-        if (filesPerStorageAccountCount[entity.storageName] === undefined) {
-            filesPerStorageAccountCount[entity.storageName] = 1;
-        } else {
-            filesPerStorageAccountCount[entity.storageName] += 1;
-        }
-        if (filesPerStorageAccountCount[entity.storageName] <= maxFileTaskPerInvokePerStorageAccount) {
-            allFileCount += 1;
-            filteredEntities.push(entity);
-        }
+/*
+ *  Deletes the archived files and their ready queue entity
+ */
+function archiveFiles(context, entities, poll) {
+    var previousKeys = {};
+    entities.forEach(function (entity) {
+        previousKeys[entity.rowKey] = entity.readyQueueKey;
+    });
+    poll.archived += entities.length;
+    poll.updates.push(batchUpdateOffsetTable(context, entities, "delete", function (deleted) {
+        return readyqueue.removeFromReadyQueue(context, getPreviousIndexEntities(deleted, previousKeys));
+    }));
+}
 
-        if (allFileCount >= maxFileTaskPerInvoke) {
-            break;
-        }
-    };
+function getLockThresholdMinutes(context, maxQueueingDelay) {
+    var maxlockThresholdMin = readyqueue.LOCK_THRESHOLD_MINUTES;
+    if (maxQueueingDelay > maxlockThresholdMin) {
+        context.log("WARNING maxQueueingDelay exceeding 30 minutes");
+        maxlockThresholdMin = maxQueueingDelay;
+    }
+    return maxlockThresholdMin;
+}
 
+/*
+ * In some cases due to rogue message consumer function may not be able to process messages
+ * and thus there is a chance that the file may get locked for a long time so the below function automatically
+ * releases the lock after a threshold is breached.
+ */
+async function unlockEntitiesExceedingThreshold(context, partitionKey, maxQueueingDelay, poll) {
 
-    return filteredEntities;
+    var maxlockThresholdMin = getLockThresholdMinutes(context, maxQueueingDelay);
+    let MS_PER_MINUTE = 60*1000;
+    var now = new Date();
+    var dateVal = new Date(now - maxlockThresholdMin*MS_PER_MINUTE);
+    var lockedFileQuery = `done eq ${true} and blobType eq '${'AppendBlob'}' and offset ge ${0} and (leaseExpiry le '${now.toISOString()}' or lastEnqueLockTime le '${dateVal.toISOString()}')`
+    try {
+        for await (const page of queryPartitionPages(partitionKey, lockedFileQuery)) {
+            await unlockFiles(context, page.filter(function (entity) {
+                return filelease.isLockExpired(entity, now, dateVal.toISOString());
+            }), poll);
+        }
+    } catch (error) {
+        context.log.error(`Unable to fetch AppendBlob locked rows from partition: ${partitionKey}, Error: ${JSON.stringify(error)}`);
+    }
 }
 
-function setBatchSizePerStorageAccount(newFiletasks) {
+/*
+ * The batchSize of a task is bounded by the read api limit of its storage account shared by its tasks, within that bound
+ * it follows the feedback of the previous task of the file (see taskfeedback.js)
+ * entities - FileOffsetMap entities of the tasks
+ */
+function setBatchSizePerStorageAccount(newFiletasks, entities) {
     let filesPerStorageAccountCount = {};
     let task = null;
     for (let idx = 0; idx < newFiletasks.length; idx += 1) {
@@ -280,12 +462,11 @@ function setBatchSizePerStorageAccount(newFiletasks) {
             filesPerStorageAccountCount[task.storageName] += 1;
         }
     };
-    let MAX_READ_API_LIMIT_PER_SEC = 20000;  // storage account read api limit
-    let MAX_GET_BLOB_REQUEST_PER_INVOKE = 50; // 50*4MB = 200MB max batch size size
     for (let idx = 0; idx < newFiletasks.length; idx += 1) {
         task = newFiletasks[idx];
         let apiCallPerFile = Math.max(1, Math.ceil(MAX_READ_API_LIMIT_PER_SEC / filesPerStorageAccountCount[task.storageName]));
-        task.batchSize = Math.min(MAX_GET_BLOB_REQUEST_PER_INVOKE, apiCallPerFile) * 4 * 1024 * 1024; // single request fetches 4MB
+        let maxBatchSize = Math.min(MAX_GET_BLOB_REQUEST_PER_INVOKE, apiCallPerFile) * taskfeedback.BLOB_REQUEST_SIZE; // single request fetches 4MB
+        task.batchSize = taskfeedback.getNextBatchSize(entities[idx], maxBatchSize);
     }
     return newFiletasks;
 }
@@ -309,83 +490,231 @@ function getDateDifferenceInMinutes(date_a, date_b) {
         return null;
     }
 }
-/**
- *First it fetches the unlocked append blob files rows and creates tasks for them in Event Hub
- *
- * To avoid duplication of tasks all the enqueued tasks (in Event Hub) are marked as locked
- * This will ensure that only after consumer function releases the lock after successfully sending the log file
- * then only new task is produced for that file in case of append blobs.
+async function unlockFiles(context, entities, poll) {
+    entities.forEach(function (entity) {
+        context.log.verbose("Unlocking Append Blob File with rowKey: %s lastEnqueLockTime: %s", entity.rowKey, entity.lastEnqueLockTime);
+    });
+    var unlockedEntities = await updateFiles(context, entities, getunLockedEntity, poll);
+    poll.unlocked += unlockedEntities.length;
+}
+
+/*
+ * Adds the unlocked append blob files of a page to the candidates of the invocation, the archived files are deleted
  */
-function getTasksForUnlockedFiles(context) {
+function addCandidates(context, entities, poll) {
+    var archivedFiles = [];
+    entities.forEach(function (entity) {
+        if (isAppendBlobArchived(context, entity)) {
+            archivedFiles.push(entity);
+        } else {
+            poll.scheduler.add(entity);
+            poll.roundCandidates += 1;
+            if (taskfeedback.isThrottled(entity) && (entity.updatedate || "") > poll.taskLimits.updatedate) {
+                poll.throttledAccounts.add(entity.storageName);
+            }
+        }
+        poll.maxQueueingDelay = Math.max(poll.maxQueueingDelay, getDateDifferenceInMinutes(entity.lastEnqueLockTime, entity.updatedate));
+    });
+    archiveFiles(context, archivedFiles, poll);
+}
 
+/*
+ * Creates the tasks of the candidates selected by the scheduler in a round, to avoid duplication of tasks all the enqueued
+ * tasks (in Event Hub) are marked as locked. This will ensure that only after consumer function releases the lock after
+ * successfully sending the log file then only new task is produced for that file in case of append blobs.
+ * No task is created for a file which could not be locked in the ready queue.
+ * slots - tasks of the round, all the tasks of the invocation not created yet by default
+ */
+async function createTasksForRound(context, poll, slots) {
+    poll.scheduler.setTaskLimits(getTaskLimits(poll));
+    var selectedFiles = poll.scheduler.select(slots);
+    poll.roundCandidates = 0;
+    var lockedEntities = {};
+    // the lease covers the queueing delay of the tasks
+    var leaseDurationMs = Math.max(filelease.LEASE_DURATION_MS, getLockThresholdMinutes(context, poll.maxQueueingDelay) * 60 * 1000);
+    (await updateFiles(context, selectedFiles, function (entity) {
+        return getLockedEntity(entity, leaseDurationMs);
+    }, poll)).forEach(function (lockedEntity) {
+        lockedEntities[lockedEntity.rowKey] = lockedEntity;
+    });
+    selectedFiles.forEach(function (entity) {
+        if (lockedEntities[entity.rowKey]) {
+            context.log.verbose("Creating task for file: " + entity.rowKey);
+            var lockedEntity = lockedEntities[entity.rowKey];
+            var task = getTask(entity);
+            // the consumer removes the lock from the ready queue once it is released
+            task.readyQueueKey = lockedEntity.readyQueueKey;
+            // the consumer checks that the lease of the task is still the lease of the file
+            task.leaseId = lockedEntity.leaseId;
+            task.fencingToken = lockedEntity.fencingToken;
+            poll.tasks.push(task);
+            poll.taskFiles.push(entity);
+        }
+    });
+}
+
+/*
+ * Runs a round once SELECTION_ROUND_CANDIDATES candidates were polled since the previous one, so the files are locked
+ * while the poll goes on instead of all at its end
+ */
+async function createTasksForPolledFiles(context, poll) {
+    if (poll.roundCandidates >= SELECTION_ROUND_CANDIDATES) {
+        await createTasksForRound(context, poll, Math.ceil(poll.roundCandidates * MAX_FILE_TASK_PER_INVOKE / MAX_CANDIDATES_PER_INVOKE));
+    }
+}
+
+/*
+ * Creates the remaining tasks of the invocation among all the candidates left, then sets their batch size
+ */
+async function createTasksForSelectedFiles(context, poll) {
+    await updateTaskLimits(context, poll);
+    await createTasksForRound(context, poll);
+    // It takes ~3min to ingest tasks to service bus, currently batch ingestion not supported by Azure
+    setBatchSizePerStorageAccount(poll.tasks, poll.taskFiles);
+    context.log(`New File Tasks created: ${poll.tasks.length} from candidates: ${poll.scheduler.size} per storage account: ${JSON.stringify(poll.scheduler.getBacklogPerAccount())}`);
+}
+
+function isPollBudgetExhausted(poll) {
+    return poll.scheduler.size >= MAX_CANDIDATES_PER_INVOKE || poll.tasks.length >= MAX_FILE_TASK_PER_INVOKE ||
+        (Date.now() - poll.startTime) >= POLL_TIME_BUDGET_MS;
+}
+
+/*
+ * Polls the unlocked files of a partition page by page from continuationToken, returns the continuationToken of the
+ * next page if the budget of the invocation was exhausted before the end of the partition
+ */
+async function pollPartition(context, partitionKey, continuationToken, poll) {
     var existingFileQuery = `done eq ${false} and blobType eq '${'AppendBlob'}' and offset ge ${0}`
-    return new Promise(function (resolve, reject) {
-        return queryFiles(existingFileQuery, context).then(function (allentities) {
-            var newFiletasks = [];
-            var archivedFiles = [];
-            var newFileEntities = [];
-            var lockedEntities = [];
-            var maxQueueingDelay = 0;
-            let currentQueueingDelay = null;
-            allentities.forEach(function (entity) {
-                if (isAppendBlobArchived(context, entity)) {
-                    archivedFiles.push(getunLockedEntity(entity));
-                } else {
-                    newFileEntities.push(entity);
-                    context.log.verbose("Creating task for file: " + entity.rowKey);
-                }
-                maxQueueingDelay = Math.max(maxQueueingDelay, getDateDifferenceInMinutes(entity.lastEnqueLockTime, entity.updatedate));
-
-            });
-            newFileEntities = getFixedNumberOfEntitiesbyEnqueTime(context, newFileEntities)
-            newFileEntities.forEach(function (entity) {
-                newFiletasks.push(getTask(entity));
-                lockedEntities.push(getLockedEntity(entity));
-            });
-            newFiletasks = setBatchSizePerStorageAccount(newFiletasks)
-            context.log("New File Tasks created: " + newFiletasks.length + " AppendBlob Archived Files: " + archivedFiles.length);
-            return resolve([newFiletasks, archivedFiles, lockedEntities, maxQueueingDelay]);
-        }).catch(function (error) {
-            return reject(error);
+    for await (const page of queryPartitionPages(partitionKey, existingFileQuery, continuationToken)) {
+        poll.pages += 1;
+        addCandidates(context, page, poll);
+        await createTasksForPolledFiles(context, poll);
+        if (page.continuationToken && isPollBudgetExhausted(poll)) {
+            return page.continuationToken;
+        }
+    }
+    return undefined;
+}
+
+/*
+ * Polls the ready queue entities eligible now with prefix, the oldest buckets first. The files of the valid entities are
+ * handled by their current state: unlocked files are candidates for a task, files locked for more than the lock threshold are
+ * unlocked, the others are left until a later invocation. Stale entities are removed.
+ */
+async function pollReadyQueueRange(context, prefix, now, poll) {
+    for await (const page of readyqueue.queryEligiblePages(prefix, now, QUERY_PAGE_SIZE)) {
+        poll.pages += 1;
+        var files = await readyqueue.readFileEntities(tableClient, page);
+        var stale = [];
+        var unlockedFiles = [];
+        var lockedFiles = [];
+        page.forEach(function (indexEntity) {
+            if (!readyqueue.isValidIndexEntity(indexEntity, files)) {
+                stale.push(indexEntity);
+            } else if (files.get(indexEntity.rowKey).done) {
+                lockedFiles.push(files.get(indexEntity.rowKey));
+            } else {
+                unlockedFiles.push(files.get(indexEntity.rowKey));
+            }
         });
+        poll.stale += stale.length;
+        poll.updates.push(readyqueue.removeFromReadyQueue(context, stale).then(function () {
+            return [];
+        }));
+        addCandidates(context, unlockedFiles, poll);
+        await createTasksForPolledFiles(context, poll);
+        // the queueing delay of the unlocked files is known as they are polled first
+        var maxlockThresholdMin = getLockThresholdMinutes(context, poll.maxQueueingDelay);
+        var lockExpiryTime = new Date(now - maxlockThresholdMin * 60 * 1000).toISOString();
+        await unlockFiles(context, lockedFiles.filter(function (entity) {
+            return filelease.isLockExpired(entity, now, lockExpiryTime);
+        }), poll);
+        if (isPollBudgetExhausted(poll)) {
+            break;
+        }
+    }
+}
+
+/*
+ * Polls the files of the ready queue instead of FileOffsetMap: the unlocked files then the expired locks. Unlocked files
+ * not reached within the budget of the invocation are in the oldest buckets of the next one.
+ */
+async function pollReadyQueue(context, poll) {
+    var now = new Date();
+    await pollReadyQueueRange(context, readyqueue.READY_PREFIX, now, poll);
+    if ((Date.now() - poll.startTime) < POLL_TIME_BUDGET_MS) {
+        await pollReadyQueueRange(context, readyqueue.LOCKED_PREFIX, now, poll);
+    }
+    context.log(`Ready queue polled, candidates: ${poll.scheduler.size} AppendBlob Archived Files: ${poll.archived} Unlocked Files: ${poll.unlocked} Stale entries: ${poll.stale} pages: ${poll.pages}`);
+}
+
+/*
+ * Polls the FileOffsetMap table partition by partition, until the ready queue is built. Resumes from the position saved
+ * by the previous invocation and saves the position reached.
+ */
+async function pollPartitions(context, poll) {
+    var checkpoint = await readCheckpoint(context);
+    var partitionKey = checkpoint.lastPartitionKey;
+    var lastPartitionKey = checkpoint.lastPartitionKey;
+    var continuationToken = checkpoint.continuationToken;
+    if (!continuationToken) {
+        partitionKey = await getNextPartitionKey(partitionKey);
+    }
+    while (partitionKey !== null && !isPollBudgetExhausted(poll)) {
+        if (partitionKey !== CHECKPOINT_PARTITION_KEY) {
+            poll.partitions += 1;
+            continuationToken = await pollPartition(context, partitionKey, continuationToken, poll);
+            if (continuationToken) {
+                break;
+            }
+            // unlocked with the largest queueing delay seen in this pass
+            await unlockEntitiesExceedingThreshold(context, partitionKey, Math.max(checkpoint.maxQueueingDelay, poll.maxQueueingDelay), poll);
+        }
+        lastPartitionKey = partitionKey;
+        partitionKey = await getNextPartitionKey(partitionKey);
+    }
+    var passEnded = partitionKey === null;
+    await saveCheckpoint(context, {
+        lastPartitionKey: passEnded ? "" : (continuationToken ? partitionKey : lastPartitionKey),
+        continuationToken: passEnded ? undefined : continuationToken,
+        maxQueueingDelay: passEnded ? poll.maxQueueingDelay : Math.max(checkpoint.maxQueueingDelay, poll.maxQueueingDelay)
     });
+    context.log(`FileOffsetMap polled, candidates: ${poll.scheduler.size} AppendBlob Archived Files: ${poll.archived} Unlocked Files: ${poll.unlocked} partitions: ${poll.partitions} pages: ${poll.pages} passEnded: ${passEnded}`);
 }
 
 /**
  * @param  {} context
  *
- * Then it fetches the existing append blob file rows and creates tasks for them in Event Hub
- * Among the existing files it marks the ones which are inactive (it is assumed that the azure service won't be writing to this file after it switched to a new file)
+ * Polls the files ready for a task from the ready queue once it is built (see readyqueue.js), from the FileOffsetMap
+ * table partition by partition until then, until all the files are polled or MAX_CANDIDATES_PER_INVOKE candidates are
+ * found or POLL_TIME_BUDGET_MS is spent. MAX_FILE_TASK_PER_INVOKE tasks are created for the candidates selected by the
+ * FileTaskScheduler, for the files which could be leased (see filelease.js), in rounds as the files are polled and for
+ * the candidates left at the end. Among the existing
+ * files it marks the ones which are inactive (it is assumed that the azure service won't be writing to this file after
+ * it switched to a new file)
  */
-function PollAppendBlobFiles(context) {
-    // Since this function is not synchronize it may generate duplicate task in a scenario where the same function is running concurrently
-    // therefore it's best to run this function at an interval of 5-10 min
-    context.bindings.tasks = []
-    getTasksForUnlockedFiles(context).then(function (r) {
-        var newFiletasks = r[0];
-        var archivedRowEntities = r[1];
-        var entitiesToUpdate = r[2];
-        var maxQueueingDelay = r[3];
-        // It takes ~3min to ingest tasks to service bus, currently batch ingestion not supported by Azure
-        context.bindings.tasks = context.bindings.tasks.concat(newFiletasks);
-        context.log.verbose("new file tasks", newFiletasks);
-        var batch_promises = [
-            getLockedEntitiesExceedingThreshold(context, maxQueueingDelay).then(function (unlockedEntities) {
-                // setting lock for new tasks and unsetting lock for old tasks
-                entitiesToUpdate = entitiesToUpdate.concat(unlockedEntities);
-                return batchUpdateOffsetTable(context, entitiesToUpdate, "insert");
-            }),
-
-            batchUpdateOffsetTable(context, archivedRowEntities, "delete")
-        ];
-        return Promise.all(batch_promises).then(function (results) {
-            context.log("BatchUpdateResults - ", results);
-            context.done();
-        });
-    }).catch(function (error) {
+async function PollAppendBlobFiles(context) {
+    // a file is locked with a lease conditional on the entity read, invocations running concurrently do not create
+    // duplicate tasks (see filelease.js)
+    context.bindings.tasks = [];
+    var poll = { startTime: Date.now(), scheduler: new FileTaskScheduler(MAX_FILE_TASK_PER_INVOKE, MAX_FILE_TASK_PER_STORAGE_ACCOUNT), tasks: context.bindings.tasks, taskFiles: [], roundCandidates: 0, pages: 0, partitions: 0, archived: 0, unlocked: 0, stale: 0, maxQueueingDelay: 0, updates: [], throttledAccounts: new Set() };
+    try {
+        poll.taskLimits = await readTaskLimits(context);
+        if (await readyqueue.isReadyQueueBuilt(context)) {
+            await pollReadyQueue(context, poll);
+        } else {
+            await pollPartitions(context, poll);
+        }
+        await createTasksForSelectedFiles(context, poll);
+        var results = await Promise.all(poll.updates);
+        context.log("BatchUpdateResults - ", [].concat.apply([], results));
+        context.done();
+    } catch (error) {
         context.log.error(`Error in PollOffsetTable, Error: ${JSON.stringify(error)}`);
+        // the files already locked are sent
+        await Promise.all(poll.updates);
         context.done(error);
-    });
+    }
 }
 
 module.exports = function (context, triggerData) {
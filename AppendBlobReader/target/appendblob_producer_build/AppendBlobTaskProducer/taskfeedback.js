@@ -0,0 +1,124 @@
+//////////////////////////////////////////////////////////////////////////////////////////////////////
+//           Feedback of the task consumer used by the task producer to size the tasks               //
+//////////////////////////////////////////////////////////////////////////////////////////////////////
+
+/*
+ * The task consumer records in the FileOffsetMap entity of a file the outcome of its last task: the batchSize used, the
+ * bytes left to read after it, the download and send latencies and the status codes of the storage account (fetch) and
+ * of Sumo (send). The task producer adapts to it with additive increase and multiplicative decrease:
+ *  - the batchSize of a file is halved if its last task was throttled or slow, it grows by BATCH_SIZE_INCREASE while the
+ *    file is behind by more than its last batchSize
+ *  - the tasks of a storage account are halved if one of its files was throttled since the previous invocation, they
+ *    grow by TASK_LIMIT_INCREASE otherwise
+ */
+
+const BLOB_REQUEST_SIZE = 4 * 1024 * 1024; // single request fetches 4MB
+const MIN_BATCH_SIZE = BLOB_REQUEST_SIZE;
+const BATCH_SIZE_INCREASE = 4 * BLOB_REQUEST_SIZE;
+const MIN_TASK_LIMIT = 50;
+const TASK_LIMIT_INCREASE = 500;
+// the task consumer times out after 10 min
+const SLOW_TASK_MS = 5 * 60 * 1000;
+const THROTTLING_STATUS_CODES = [429, 503];
+
+function getInt64(value) {
+    // Int64 values are returned either as strings or as typed values
+    return Number(value !== null && typeof value === "object" ? value.value : value);
+}
+
+function isThrottlingStatusCode(statusCode) {
+    return THROTTLING_STATUS_CODES.indexOf(Number(statusCode)) !== -1;
+}
+
+function isThrottled(entity) {
+    return isThrottlingStatusCode(entity.fetchStatusCode) || isThrottlingStatusCode(entity.sendStatusCode);
+}
+
+function isSlow(entity) {
+    return (Number(entity.downloadLatencyMs) || 0) + (Number(entity.sendLatencyMs) || 0) >= SLOW_TASK_MS;
+}
+
+/**
+ * @param  {} failedStatusCodes - number of failed Sumo responses by status code, see SumoClient.getStats
+ * returns the status code of the send recorded for the task: a throttling one if Sumo throttled it, 200 if all the
+ * responses succeeded
+ */
+function getSendStatusCode(failedStatusCodes) {
+    var statusCodes = Object.keys(failedStatusCodes || {}).map(Number);
+    var throttlingStatusCode = statusCodes.find(isThrottlingStatusCode);
+    if (throttlingStatusCode !== undefined) {
+        return throttlingStatusCode;
+    }
+    return statusCodes.length > 0 ? statusCodes[0] : 200;
+}
+
+/**
+ * @param  {} downloadResponse - response of BlobClient.download
+ * returns the length of the blob from the Content-Range header (e.g. "bytes 0-1023/4096"), undefined if it is unknown
+ */
+function getBlobLength(downloadResponse) {
+    var match = /\/(\d+)$/.exec(downloadResponse.contentRange || "");
+    return match ? Number(match[1]) : undefined;
+}
+
+/**
+ * @param  {} feedback - {batchSize, bytesBehind, downloadLatencyMs, sendLatencyMs, fetchStatusCode, sendStatusCode} of
+ * a task, the ones not measured are unknown
+ * returns the columns of the FileOffsetMap entity recording it, all of them are set to replace the previous task's
+ */
+function getFeedbackColumns(feedback) {
+    return {
+        batchSize: feedback.batchSize || 0,
+        // -1 when the length of the blob is unknown
+        bytesBehind: { type: "Int64", value: String(feedback.bytesBehind === undefined ? -1 : feedback.bytesBehind) },
+        downloadLatencyMs: feedback.downloadLatencyMs || 0,
+        sendLatencyMs: feedback.sendLatencyMs || 0,
+        fetchStatusCode: feedback.fetchStatusCode || 0,
+        sendStatusCode: feedback.sendStatusCode || 0
+    };
+}
+
+/**
+ * @param  {} entity - FileOffsetMap entity of the file
+ * @param  {} maxBatchSize - batchSize allowed by the number of tasks of the storage account
+ * returns the batchSize of the next task of the file, maxBatchSize for files without feedback
+ */
+function getNextBatchSize(entity, maxBatchSize) {
+    var batchSize = Number(entity.batchSize);
+    if (!(batchSize > 0)) {
+        return maxBatchSize;
+    }
+    if (isThrottled(entity) || isSlow(entity)) {
+        batchSize = Math.floor(batchSize / 2);
+    } else if (getInt64(entity.bytesBehind) > batchSize) {
+        batchSize += BATCH_SIZE_INCREASE;
+    }
+    batchSize = Math.floor(batchSize / BLOB_REQUEST_SIZE) * BLOB_REQUEST_SIZE;
+    return Math.max(MIN_BATCH_SIZE, Math.min(maxBatchSize, batchSize));
+}
+
+/**
+ * @param  {} taskLimit - tasks of the storage account in the previous invocation, undefined if it has none
+ * @param  {} throttled - whether one of its files was throttled since the previous invocation
+ * @param  {} maxTasks - upper bound of the tasks of a storage account
+ * returns the tasks of the storage account in this invocation
+ */
+function getNextTaskLimit(taskLimit, throttled, maxTasks) {
+    if (!(taskLimit > 0)) {
+        taskLimit = maxTasks;
+    }
+    if (throttled) {
+        return Math.max(MIN_TASK_LIMIT, Math.floor(taskLimit / 2));
+    }
+    return Math.min(maxTasks, taskLimit + TASK_LIMIT_INCREASE);
+}
+
+module.exports = {
+    BLOB_REQUEST_SIZE: BLOB_REQUEST_SIZE,
+    isThrottled: isThrottled,
+    getSendStatusCode: getSendStatusCode,
+    getBlobLength: getBlobLength,
+    getFeedbackColumns: getFeedbackColumns,
+    getNextBatchSize: getNextBatchSize,
+    getNextTaskLimit: getNextTaskLimit
+};
@@ -0,0 +1,272 @@
+//////////////////////////////////////////////////////////////////////////////////////////////////////
+//           Selection of the append blob files getting a task in an invocation of the task producer //
+//////////////////////////////////////////////////////////////////////////////////////////////////////
+
+/*
+ * The candidate files are added as they are polled. Each container keeps its oldest files (by lastEnqueLockTime, the
+ * eventdate for files never enqueued) in a heap bounded by the number of tasks of the invocation, so the time of a file
+ * is parsed once and the candidates are never sorted as a whole. The tasks are then shared between the storage accounts
+ * and, within an account, between its containers: half of them in equal shares, the shares not used by small backlogs
+ * going to the others, the other half in proportion to their backlog (the candidates added and not selected yet). A
+ * large backlog gets most of the tasks without starving the others. A storage account gets at most its task limit, see
+ * setTaskLimits. The tasks can be selected in several rounds as the candidates are polled, the candidates not selected
+ * in a round stay candidates for the next ones.
+ */
+
+/*
+ * Max-heap of {time, entity} keeping the capacity items with the smallest time
+ */
+function BoundedHeap(capacity) {
+    this.capacity = capacity;
+    this.items = [];
+}
+
+BoundedHeap.prototype.push = function (item) {
+    var items = this.items;
+    if (items.length < this.capacity) {
+        items.push(item);
+        var index = items.length - 1;
+        while (index > 0) {
+            var parent = (index - 1) >> 1;
+            if (items[parent].time >= item.time) {
+                break;
+            }
+            items[index] = items[parent];
+            index = parent;
+        }
+        items[index] = item;
+    } else if (this.capacity > 0 && item.time < items[0].time) {
+        this.replaceRoot(item);
+    }
+};
+
+BoundedHeap.prototype.replaceRoot = function (item) {
+    var items = this.items;
+    var index = 0;
+    for (;;) {
+        var child = 2 * index + 1;
+        if (child >= items.length) {
+            break;
+        }
+        if (child + 1 < items.length && items[child + 1].time > items[child].time) {
+            child += 1;
+        }
+        if (items[child].time <= item.time) {
+            break;
+        }
+        items[index] = items[child];
+        index = child;
+    }
+    items[index] = item;
+};
+
+BoundedHeap.prototype.toSortedArray = function () {
+    return this.items.slice().sort(function (a, b) {
+        return a.time - b.time;
+    });
+};
+
+function getEnqueTime(entity) {
+    var time = Date.parse(entity.lastEnqueLockTime === undefined ? entity.eventdate : entity.lastEnqueLockTime);
+    // files without a valid date are the oldest
+    return isNaN(time) ? 0 : time;
+}
+
+function sum(values) {
+    return values.reduce(function (total, value) {
+        return total + value;
+    }, 0);
+}
+
+/**
+ * @param  {} demands - max number of tasks of each account or container
+ * @param  {} slots - number of tasks to share
+ * @param  {} weights - optional weight of each demand, the demand not served by the equal shares by default
+ * returns the number of tasks of each demand: half of the slots in equal shares, the rest in proportion to the weights,
+ * a share larger than its demand going to the others
+ */
+function allocateSlots(demands, slots, weights) {
+    if (sum(demands) <= slots) {
+        return demands.slice();
+    }
+    var allocation = demands.map(function () { return 0; });
+    var remaining = Math.floor(slots / 2);
+    var open = [];
+    demands.forEach(function (demand, index) {
+        if (demand > 0) {
+            open.push(index);
+        }
+    });
+    while (remaining > 0 && open.length > 0) {
+        var share = Math.max(1, Math.floor(remaining / open.length));
+        var next = [];
+        for (const index of open) {
+            var grant = Math.min(share, demands[index] - allocation[index], remaining);
+            allocation[index] += grant;
+            remaining -= grant;
+            if (allocation[index] < demands[index]) {
+                next.push(index);
+            }
+        }
+        open = next;
+    }
+    remaining = slots - sum(allocation);
+    weights = weights || demands.map(function (demand, index) { return demand - allocation[index]; });
+    open = [];
+    demands.forEach(function (demand, index) {
+        if (allocation[index] < demand) {
+            open.push(index);
+        }
+    });
+    for (var previous = -1; remaining > 0 && open.length > 0 && remaining !== previous;) {
+        previous = remaining;
+        var totalWeight = sum(open.map(function (index) { return weights[index]; }));
+        var capped = false;
+        var shares = open.map(function (index) {
+            var share = totalWeight > 0 ? remaining * weights[index] / totalWeight : remaining / open.length;
+            var grant = Math.min(Math.floor(share), demands[index] - allocation[index]);
+            capped = capped || grant < Math.floor(share);
+            return { index: index, grant: grant, fraction: share - Math.floor(share) };
+        });
+        shares.forEach(function (share) {
+            allocation[share.index] += share.grant;
+            remaining -= share.grant;
+        });
+        if (!capped) {
+            // largest remainders, none of the shares reached its demand
+            shares.sort(function (a, b) { return b.fraction - a.fraction; });
+            for (let i = 0; i < shares.length && remaining > 0; i++) {
+                if (shares[i].fraction > 0 && allocation[shares[i].index] < demands[shares[i].index]) {
+                    allocation[shares[i].index] += 1;
+                    remaining -= 1;
+                }
+            }
+        }
+        open = open.filter(function (index) {
+            return allocation[index] < demands[index];
+        });
+    }
+    return allocation;
+}
+
+/*
+ * Merges the lists taking one item of each list in turn
+ */
+function interleave(lists) {
+    var merged = [];
+    var maxLength = Math.max.apply(null, lists.map(function (list) { return list.length; }).concat([0]));
+    for (let i = 0; i < maxLength; i++) {
+        lists.forEach(function (list) {
+            if (i < list.length) {
+                merged.push(list[i]);
+            }
+        });
+    }
+    return merged;
+}
+
+/**
+ * @param {number} maxTasks - number of tasks of the invocation
+ * @param {number} maxTasksPerAccount - upper bound of the tasks of a storage account
+ * @constructor
+ */
+function FileTaskScheduler(maxTasks, maxTasksPerAccount) {
+    this.maxTasks = maxTasks;
+    this.maxTasksPerAccount = maxTasksPerAccount || maxTasks;
+    // storageName -> containerName -> {backlog, selected, heap}
+    this.accounts = new Map();
+    // storageName -> tasks selected in the previous rounds
+    this.selectedPerAccount = {};
+    // storageName -> max tasks, the accounts without a limit get maxTasksPerAccount
+    this.taskLimits = {};
+    this.size = 0;
+}
+
+/**
+ * @param {Object} taskLimits - max tasks of the storage accounts by storageName, e.g. to slow down a throttled one
+ */
+FileTaskScheduler.prototype.setTaskLimits = function (taskLimits) {
+    this.taskLimits = taskLimits;
+};
+
+FileTaskScheduler.prototype.getTaskLimit = function (storageName) {
+    var taskLimit = this.taskLimits[storageName];
+    return taskLimit === undefined ? this.maxTasksPerAccount : Math.min(taskLimit, this.maxTasksPerAccount);
+};
+
+FileTaskScheduler.prototype.add = function (entity) {
+    var containers = this.accounts.get(entity.storageName);
+    if (containers === undefined) {
+        containers = new Map();
+        this.accounts.set(entity.storageName, containers);
+    }
+    var container = containers.get(entity.containerName);
+    if (container === undefined) {
+        container = { backlog: 0, selected: 0, heap: new BoundedHeap(Math.min(this.maxTasks, this.maxTasksPerAccount)) };
+        containers.set(entity.containerName, container);
+    }
+    container.backlog += 1;
+    container.heap.push({ time: getEnqueTime(entity), entity: entity });
+    this.size += 1;
+};
+
+function getWeight(container) {
+    return container.backlog - container.selected;
+}
+
+function getCandidates(container) {
+    return container.heap.items.length;
+}
+
+/**
+ * @param {number} slots - number of tasks of the round, the tasks of the invocation not selected yet by default
+ * returns the entities selected, the oldest files of each container, in turn by account and by container. They are
+ * removed from the candidates.
+ */
+FileTaskScheduler.prototype.select = function (slots) {
+    var self = this;
+    var selectedTotal = sum(Object.values(this.selectedPerAccount));
+    slots = Math.min(slots === undefined ? this.maxTasks : slots, this.maxTasks - selectedTotal);
+    var accounts = Array.from(this.accounts.entries()).map(function ([storageName, containers]) {
+        var list = Array.from(containers.values());
+        var taskLimit = Math.max(0, self.getTaskLimit(storageName) - (self.selectedPerAccount[storageName] || 0));
+        return {
+            storageName: storageName,
+            containers: list,
+            demand: Math.min(taskLimit, sum(list.map(getCandidates))),
+            weight: sum(list.map(getWeight))
+        };
+    });
+    var accountSlots = allocateSlots(accounts.map(function (account) { return account.demand; }), Math.max(0, slots),
+        accounts.map(function (account) { return account.weight; }));
+    return interleave(accounts.map(function (account, accountIndex) {
+        self.selectedPerAccount[account.storageName] = (self.selectedPerAccount[account.storageName] || 0) + accountSlots[accountIndex];
+        var containerSlots = allocateSlots(account.containers.map(getCandidates), accountSlots[accountIndex], account.containers.map(getWeight));
+        return interleave(account.containers.map(function (container, containerIndex) {
+            var sorted = container.heap.toSortedArray();
+            var selected = sorted.slice(0, containerSlots[containerIndex]);
+            // sorted in decreasing order the candidates left are a max-heap
+            container.heap.items = sorted.slice(selected.length).reverse();
+            container.selected += selected.length;
+            return selected.map(function (item) {
+                return item.entity;
+            });
+        }));
+    }));
+};
+
+/**
+ * returns the number of candidates of each storage account
+ */
+FileTaskScheduler.prototype.getBacklogPerAccount = function () {
+    var backlog = {};
+    this.accounts.forEach(function (containers, storageName) {
+        backlog[storageName] = sum(Array.from(containers.values()).map(function (container) { return container.backlog; }));
+    });
+    return backlog;
+};
+
+module.exports = {
+    FileTaskScheduler: FileTaskScheduler,
+    allocateSlots: allocateSlots
+};
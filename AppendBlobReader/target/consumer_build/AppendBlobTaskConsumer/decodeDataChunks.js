@@ -1,31 +1,28 @@
-/*
-    return index of first time when pattern matches the string
- */
-function regexIndexOf(string, regex, startpos) {
-    var indexOf = string.substring(startpos || 0).search(regex);
-    return (indexOf >= 0) ? (indexOf + (startpos || 0)) : indexOf;
-}
+const { Transform } = require('node:stream');
+const { StringDecoder } = require('node:string_decoder');
+const { boundaryIndexOf, boundaryLastIndexOf } = require('./boundaryscanner');
+const { defaultRegistry: formatRegistry } = require('./formatregistry');
+
+// number of characters at the end of the scanned text which are scanned again with the next data, a boundary split
+// across two reads is found as long as it is shorter than this
+const BOUNDARY_LOOKBACK = 1024;
+// characters at the start of the data used to sniff the format of blobs without extension
+const SNIFF_LENGTH = 256;
 
 /*
-    return index of last time when pattern matches the string
+    Returns the format of the blob from the format registry, blobs without extension are sniffed from the start of the
+    data and read as log files if it is not recognized
  */
-function regexLastIndexOf(string, regex, startpos) {
-    // https://stackoverflow.com/questions/19445994/javascript-string-search-for-regex-starting-at-the-end-of-the-string
-    var stringToWorkWith = string.substring(startpos, string.length);
-    var match = stringToWorkWith.match(regex);
-    return match ? string.lastIndexOf(match.slice(-1)) : -1;
+function getBlobFormat(serviceBusTask, head) {
+    return formatRegistry.getFormat(serviceBusTask, head) || formatRegistry.getFormat({ blobName: "" });
 }
 
 /*  Function to use boundary regex for azure storage accounts to avoid split issue & multiple single event issue */
-function getBoundaryRegex(serviceBusTask) {
-    //this boundary regex is matching for cct, llev, msgdir logs
-    let logRegex = '\\d{4}-\\d{2}-\\d{2}\\s+\\d{2}:\\d{2}:\\d{2}';
+function getBoundaryRegex(serviceBusTask, format) {
+    // the boundary regex of log files is matching for cct, llev, msgdir logs
+    let logRegex = (format || getBlobFormat(serviceBusTask)).boundaryRegex;
     // global is necessary if using regex.exec
     // https://stackoverflow.com/questions/31969913/why-does-this-regexp-exec-cause-an-infinite-loop
-    var file_ext = String(serviceBusTask.blobName).split(".").pop();
-    if (file_ext === "json" || file_ext === "blob") {
-        logRegex = '{\\s*\"';
-    }
     // uncomment and use the snippet below for overriding boundary regex for your log files
     // if (serviceBusTask.storageName === "<your storageAccountName>" || serviceBusTask.containerName === "<your containerName>" ) {
     //     logRegex = '\{\"\@timestamp\"\:\"\\d{4}-\\d{2}-\\d{2}T\\d{2}:\\d{2}:\\d{2}';
@@ -39,6 +36,27 @@ function getBoundaryRegex(serviceBusTask) {
     return new RegExp(logRegex, "gim");
 }
 
+/*
+    Returns true if the data after the last boundary is a complete record, JSON records must parse and log lines must
+    end with a new line. Incomplete records are left for the next invocation.
+ */
+function isCompleteSuffix(context, suffix, format, logRegex) {
+    if (format.jsonRecords || logRegex.source.startsWith('\{')) { // consider as JSON
+        try {
+            JSON.parse(suffix.trim());
+            return true;
+        } catch (error) {
+            context.log.verbose("Failed to parse the JSON last chunk. Ignoring:", { suffix, error });
+        }
+    } else { // consider as log
+        if (suffix.endsWith('\n')) {
+            return true;
+        }
+        context.log.verbose("Failed to parse the log last chunk. Ignoring:", { suffix });
+    }
+    return false;
+}
+
 /*
     Removes the prefix and suffix matching the boundary.
     For example if data = "prefixwithnodate<date><msg><date><msg><date><incompletemsg>"
@@ -56,11 +74,12 @@ function decodeDataChunks(context, dataBytesBuffer, serviceBusTask, maxChunkSize
     var data = dataBytesBuffer.toString(defaultEncoding);
     // remove prefix before first date
     // remove suffix after last date
-    let logRegex = getBoundaryRegex(serviceBusTask);
+    let format = getBlobFormat(serviceBusTask, data.substring(0, SNIFF_LENGTH));
+    let logRegex = getBoundaryRegex(serviceBusTask, format);
 
     // return -1 if not found
-    let firstIdx = regexIndexOf(data, logRegex);
-    let lastIndex = regexLastIndexOf(data, logRegex, firstIdx + 1);
+    let firstIdx = boundaryIndexOf(data, logRegex);
+    let lastIndex = boundaryLastIndexOf(data, logRegex, firstIdx + 1);
 
     // data.substring method extracts the characters in a string between "start" and "end", not including "end" itself.
     let prefix = data.substring(0, firstIdx);
@@ -69,23 +88,8 @@ function decodeDataChunks(context, dataBytesBuffer, serviceBusTask, maxChunkSize
         lastIndex = data.length;
     }
     let suffix = data.substring(lastIndex, data.length);
-    var file_ext = String(serviceBusTask.blobName).split(".").pop();
-    if (suffix.length > 0) {
-        if (file_ext === "json" || file_ext === "blob" || logRegex.source.startsWith('\{')) { // consider as JSON
-            try {
-                JSON.parse(suffix.trim());
-                lastIndex = data.length;
-            } catch (error) {
-                context.log.verbose("Failed to parse the JSON last chunk. Ignoring:", { suffix, lastIndex, error });
-            }
-        } else { // consider as log
-            if (suffix.endsWith('\n')) {
-                lastIndex = data.length;
-            }
-            else {
-                context.log.verbose("Failed to parse the log last chunk. Ignoring:", { suffix, lastIndex });
-            }
-        }
+    if (suffix.length > 0 && isCompleteSuffix(context, suffix, format, logRegex)) {
+        lastIndex = data.length;
     }
 
     // ideally ignoredprefixLen should always be 0. it will be dropped for existing files
@@ -95,6 +99,8 @@ function decodeDataChunks(context, dataBytesBuffer, serviceBusTask, maxChunkSize
     data = data.substring(firstIdx, lastIndex);
     // can't use matchAll since it's available only after version > 12
     let startpos = 0;
+    let match;
+    logRegex.lastIndex = 0;
     while ((match = logRegex.exec(data)) !== null) {
 
         if (match.index - startpos >= maxChunkSize) {
@@ -113,4 +119,111 @@ function decodeDataChunks(context, dataBytesBuffer, serviceBusTask, maxChunkSize
     return [ignoredprefixLen, dataChunks];
 }
 
+/*
+    Streaming version of decodeDataChunks. Bytes written to the stream are decoded as UTF-8 (multibyte characters split
+    across reads are kept for the next read) and scanned incrementally for the boundary regex. Record aligned chunks of
+    about maxChunkSize are pushed as soon as the next boundary is found, so only the current chunk is kept in memory.
+    The prefix before the first boundary and the incomplete suffix after the last one are dropped as in decodeDataChunks,
+    ignoredprefixLen and suffixLen are set once the stream ends.
+ */
+class DataChunkDecoder extends Transform {
+
+    constructor(context, serviceBusTask, maxChunkSize = 1 * 1024 * 1024) {
+        // only a couple of decoded chunks wait for the sender
+        super({ readableObjectMode: true, readableHighWaterMark: 2 });
+        this.context = context;
+        this.serviceBusTask = serviceBusTask;
+        this.maxChunkSize = maxChunkSize;
+        // resolved once the start of the data is received, see _resolveFormat
+        this.format = null;
+        this.logRegex = null;
+        this.decoder = new StringDecoder("utf8");
+        // text not pushed yet, it starts at a boundary once the first boundary is found
+        this.pending = "";
+        // position in pending from which the next scan starts
+        this.scanPos = 0;
+        // start and end in pending of the last boundary found
+        this.lastBoundary = -1;
+        this.lastBoundaryEnd = 0;
+        this.numBoundaries = 0;
+        this.numChunks = 0;
+        this.ignoredprefixLen = 0;
+        this.suffixLen = 0;
+    }
+
+    _scan() {
+        let logRegex = this.logRegex;
+        let match;
+        logRegex.lastIndex = this.scanPos;
+        while ((match = logRegex.exec(this.pending)) !== null) {
+            if (match[0].length === 0) {
+                logRegex.lastIndex += 1;
+                continue;
+            }
+            this.numBoundaries += 1;
+            if (this.numBoundaries === 1 || match.index >= this.maxChunkSize) {
+                if (this.numBoundaries === 1) {
+                    // drop the prefix before the first boundary
+                    this.ignoredprefixLen = Buffer.byteLength(this.pending.substring(0, match.index), "utf8");
+                } else {
+                    this._pushChunk(this.pending.substring(0, match.index));
+                }
+                this.pending = this.pending.substring(match.index);
+                logRegex.lastIndex -= match.index;
+                this.lastBoundary = 0;
+            } else {
+                this.lastBoundary = match.index;
+            }
+            this.lastBoundaryEnd = logRegex.lastIndex;
+        }
+        // matches are never searched inside the last boundary, as with a single exec loop over the whole text
+        this.scanPos = Math.max(this.lastBoundaryEnd, this.pending.length - BOUNDARY_LOOKBACK);
+    }
+
+    // blobs without extension are sniffed, so the scan starts once enough data is received to recognize the format
+    _resolveFormat(ended) {
+        if (this.format === null && (ended || this.pending.length >= SNIFF_LENGTH)) {
+            this.format = getBlobFormat(this.serviceBusTask, this.pending.substring(0, SNIFF_LENGTH));
+            this.logRegex = getBoundaryRegex(this.serviceBusTask, this.format);
+        }
+        return this.format !== null;
+    }
+
+    _pushChunk(chunk) {
+        this.numChunks += 1;
+        this.push(chunk);
+    }
+
+    _transform(data, encoding, callback) {
+        this.pending += this.decoder.write(data);
+        if (this._resolveFormat(false)) {
+            this._scan();
+        }
+        callback();
+    }
+
+    _flush(callback) {
+        this.pending += this.decoder.end();
+        this._resolveFormat(true);
+        this._scan();
+        let lastChunk = this.pending;
+        // as in decodeDataChunks the data after the last boundary is only sent if it is a complete record, unless there
+        // is no more than one boundary in the whole range
+        if (this.numBoundaries > 1) {
+            let suffix = this.pending.substring(this.lastBoundary);
+            if (suffix.length > 0 && !isCompleteSuffix(this.context, suffix, this.format, this.logRegex)) {
+                this.suffixLen = Buffer.byteLength(suffix, "utf8");
+                lastChunk = this.pending.substring(0, this.lastBoundary);
+            }
+        }
+        if (lastChunk.length > 0) {
+            this._pushChunk(lastChunk);
+        }
+        this.pending = "";
+        this.context.log.verbose(`Decode Data Chunks, rowKey: ${this.serviceBusTask.rowKey} numChunks: ${this.numChunks} ignoredprefixLen: ${this.ignoredprefixLen} suffixLen: ${this.suffixLen}`);
+        callback();
+    }
+}
+
 exports.decodeDataChunks = decodeDataChunks;
+exports.DataChunkDecoder = DataChunkDecoder;
@@ -5,14 +5,28 @@
  * @param headers object contains all the headersObj
  **/
 
+// removed slots are only reclaimed once they are at least this many and half of the backing array
+var MIN_COMPACTION_SIZE = 1024;
+
 function MessageBucket(headers) {
     this.headersObj = headers;
-    // core queue to store elements
-    this.queue = new Array(0);
+    // core queue to store elements, elements are removed by moving the head index instead of shifting the array
+    this.queue = [];
+    // byte size of each element, kept in a parallel array so that removals can update the running total
+    this.sizes = [];
+    this.head = 0;
+    this.byteSize = 0;
 }
 
 MessageBucket.prototype.getSize = function() {
-    return this.queue.length;
+    return this.queue.length - this.head;
+};
+
+/**
+ * @returns {number} the running byte size of the elements in the bucket, as reported by add
+ */
+MessageBucket.prototype.getBytes = function() {
+    return this.byteSize;
 };
 
 MessageBucket.prototype.getHeadersObject = function() {
@@ -23,25 +37,60 @@ MessageBucket.prototype.setHeadersObject = function(headers) {
     this.headersObj = headers;
 };
 
+MessageBucket.prototype._reset = function() {
+    this.queue = [];
+    this.sizes = [];
+    this.head = 0;
+    this.byteSize = 0;
+};
 
 /**
  * Evic and return the first element if buffer is not empty, return null otherwise.
  * @returns {*}
  */
 MessageBucket.prototype.remove= function () {
-    if (this.queue.length>0) {
-        let element = this.queue.shift();
+    if (this.head < this.queue.length) {
+        let element = this.queue[this.head];
+        this.byteSize -= this.sizes[this.head];
+        this.queue[this.head] = undefined;
+        this.head += 1;
+        if (this.head === this.queue.length) {
+            this._reset();
+        } else if (this.head >= MIN_COMPACTION_SIZE && this.head * 2 >= this.queue.length) {
+            // amortized O(1), each element is copied at most once per compaction
+            this.queue = this.queue.slice(this.head);
+            this.sizes = this.sizes.slice(this.head);
+            this.head = 0;
+        }
         return element;
     } else return null;
 };
 
-// add an element to this bucket
-MessageBucket.prototype.add = function(elm) {
+/**
+ * Evict and return all the elements in insertion order. The backing array is handed over without copying the elements
+ * when nothing was removed from the bucket since the last drain.
+ * @returns {Array}
+ */
+MessageBucket.prototype.drain = function () {
+    let elements = (this.head === 0) ? this.queue : this.queue.slice(this.head);
+    this._reset();
+    return elements;
+};
+
+/**
+ * add an element to this bucket
+ * @param elm element to add
+ * @param {number} byteSize - optional size of the element, defaults to the byte length of strings and 0 for objects
+ */
+MessageBucket.prototype.add = function(elm, byteSize) {
+    if (byteSize === undefined) {
+        byteSize = (typeof elm === 'string') ? Buffer.byteLength(elm) : 0;
+    }
     this.queue.push(elm);
+    this.sizes.push(byteSize);
+    this.byteSize += byteSize;
 };
 
 module.exports = {
     MessageBucket:MessageBucket
 };
-
-
@@ -0,0 +1,356 @@
+//////////////////////////////////////////////////////////////////////////////////////////////////////
+//           Ready queue: secondary index of the append blob files of the FileOffsetMap table       //
+//////////////////////////////////////////////////////////////////////////////////////////////////////
+
+/*
+ * FileOffsetMap can only be queried by partitionKey/rowKey, so finding the unlocked files (done eq false) or the expired
+ * locks means reading every file. The ready queue table has an entity per file, keyed by its lock state and by the
+ * 5 min bucket of the time it becomes eligible:
+ *   PartitionKey - "ready-yyyyMMddHHmm" for unlocked files, eligible as soon as they are written
+ *                  "locked-yyyyMMddHHmm" for locked files, eligible once their lease expires (see filelease.js) or,
+ *                  for the locks without lease, once the lock exceeds the lock threshold
+ *   RowKey - rowKey of the file, filePartitionKey - partitionKey of the file
+ * so that the task producer only reads the partitions of the buckets already elapsed.
+ *
+ * The partition of a file is saved in its FileOffsetMap entity as readyQueueKey, an index entity is only valid if it
+ * matches. When a file moves, its new index entity is written first, then FileOffsetMap, then the previous index entity
+ * is removed: a failure leaves either the previous state or index entities which are dropped when they are read.
+ */
+
+const { TableClient, TableTransaction, odata } = require("@azure/data-tables");
+const READY_QUEUE_TABLE_NAME = process.env.READY_QUEUE_TABLE_NAME || `${process.env.TABLE_NAME}ReadyQueue`;
+const readyQueueClient = TableClient.fromConnectionString(process.env.AzureWebJobsStorage, READY_QUEUE_TABLE_NAME);
+
+const READY_PREFIX = "ready-";
+const LOCKED_PREFIX = "locked-";
+const BUCKET_MINUTES = 5;
+// minimum lock threshold of the task producer, a lock without lease is released after it
+const LOCK_THRESHOLD_MINUTES = 30;
+// written once the ready queue holds all the files, until then the task producer scans FileOffsetMap
+const STATE_PARTITION_KEY = "state";
+const STATE_ROW_KEY = "built";
+// an entity group transaction is limited to 100 entities of the same partition
+const MAX_TRANSACTION_ENTITIES = 100;
+// the table service allows at most 15 comparisons in a filter, one is used by the partition key
+const MAX_FILTER_ROW_KEYS = 14;
+const MS_PER_MINUTE = 60 * 1000;
+
+/**
+ * @param  {} date
+ * returns the bucket of the date as yyyyMMddHHmm, which sorts as the dates
+ */
+function getBucket(date) {
+    var time = new Date(date).getTime();
+    var bucketStart = new Date(time - time % (BUCKET_MINUTES * MS_PER_MINUTE));
+    return bucketStart.toISOString().replace(/[-T:]/g, "").slice(0, 12);
+}
+
+/**
+ * @param  {} entity - FileOffsetMap entity with its new done, leaseExpiry and lastEnqueLockTime
+ * @param  {} now
+ * returns the partition of the ready queue of the file
+ */
+function getReadyQueueKey(entity, now) {
+    now = now || new Date();
+    if (entity.done && entity.leaseExpiry) {
+        return LOCKED_PREFIX + getBucket(entity.leaseExpiry);
+    }
+    if (entity.done) {
+        var lockTime = new Date(entity.lastEnqueLockTime || now).getTime();
+        return LOCKED_PREFIX + getBucket(lockTime + LOCK_THRESHOLD_MINUTES * MS_PER_MINUTE);
+    }
+    return READY_PREFIX + getBucket(now);
+}
+
+/**
+ * @param  {} prefix - READY_PREFIX or LOCKED_PREFIX
+ * @param  {} now
+ * returns the filter of the partitions of the buckets elapsed at now
+ */
+function getEligibleFilter(prefix, now) {
+    return odata`PartitionKey ge ${prefix} and PartitionKey le ${prefix + getBucket(now || new Date())}`;
+}
+
+function getIndexEntity(entity) {
+    return {
+        partitionKey: entity.readyQueueKey,
+        rowKey: entity.rowKey,
+        filePartitionKey: entity.partitionKey
+    };
+}
+
+function isTableNotFound(error) {
+    return error.statusCode === 404 && JSON.stringify(error).includes("TableNotFound");
+}
+
+async function submitIndexTransaction(actions) {
+    try {
+        return await readyQueueClient.submitTransaction(actions);
+    } catch (error) {
+        if (!isTableNotFound(error)) {
+            throw error;
+        }
+        try {
+            await readyQueueClient.createTable();
+        } catch (createError) {
+            // created by another invocation, a failure surfaces when the transaction is submitted again
+        }
+        return await readyQueueClient.submitTransaction(actions);
+    }
+}
+
+function groupByPartition(entities) {
+    return entities.reduce(function (rv, e) {
+        (rv[e.partitionKey] = rv[e.partitionKey] || []).push(e);
+        return rv;
+    }, {});
+}
+
+/**
+ * @param  {} context
+ * @param  {} entities - FileOffsetMap entities with their new readyQueueKey
+ * Adds the files to the ready queue, resolves with the set of the rowKeys of the files which could not be added, their
+ * readyQueueKey must not be saved in FileOffsetMap
+ */
+async function addToReadyQueue(context, entities) {
+    var failed = new Set();
+    var groupedEntities = groupByPartition(entities.map(getIndexEntity));
+    var batch_promises = [];
+    Object.keys(groupedEntities).forEach(function (groupKey) {
+        var indexEntities = groupedEntities[groupKey];
+        for (let batchIndex = 0; batchIndex < indexEntities.length; batchIndex += MAX_TRANSACTION_ENTITIES) {
+            var currentBatch = indexEntities.slice(batchIndex, batchIndex + MAX_TRANSACTION_ENTITIES);
+            var transaction = new TableTransaction();
+            currentBatch.forEach(function (indexEntity) {
+                transaction.upsertEntity(indexEntity, "Replace");
+            });
+            batch_promises.push(submitIndexTransaction(transaction.actions).catch(function (error) {
+                context.log.error(`Error occurred while adding files to ready queue partition: ${groupKey}, error: ${JSON.stringify(error)}`);
+                currentBatch.forEach(function (indexEntity) {
+                    failed.add(indexEntity.rowKey);
+                });
+            }));
+        }
+    });
+    await Promise.all(batch_promises);
+    return failed;
+}
+
+/**
+ * @param  {} context
+ * @param  {} indexEntities - array of {partitionKey, rowKey} of the ready queue
+ * Removes index entities which are no longer valid, failures are only logged as they are dropped again when read
+ */
+async function removeFromReadyQueue(context, indexEntities) {
+    var groupedEntities = groupByPartition(indexEntities);
+    var batch_promises = [];
+    Object.keys(groupedEntities).forEach(function (groupKey) {
+        var entities = groupedEntities[groupKey];
+        for (let batchIndex = 0; batchIndex < entities.length; batchIndex += MAX_TRANSACTION_ENTITIES) {
+            var currentBatch = entities.slice(batchIndex, batchIndex + MAX_TRANSACTION_ENTITIES);
+            var transaction = new TableTransaction();
+            currentBatch.forEach(function (indexEntity) {
+                transaction.deleteEntity(indexEntity.partitionKey, indexEntity.rowKey);
+            });
+            batch_promises.push(readyQueueClient.submitTransaction(transaction.actions).catch(async function () {
+                // one of them is already removed, which fails the whole transaction
+                for (const indexEntity of currentBatch) {
+                    try {
+                        await readyQueueClient.deleteEntity(indexEntity.partitionKey, indexEntity.rowKey);
+                    } catch (error) {
+                        if (error.statusCode !== 404) {
+                            context.log.error(`Error occurred while removing file from ready queue rowKey: ${indexEntity.rowKey}, error: ${JSON.stringify(error)}`);
+                        }
+                    }
+                }
+            }));
+        }
+    });
+    await Promise.all(batch_promises);
+}
+
+/**
+ * @param  {} prefix - READY_PREFIX or LOCKED_PREFIX
+ * @param  {} now
+ * @param  {} maxPageSize
+ * returns an async iterator of the pages of the index entities eligible at now, the oldest buckets first
+ */
+function queryEligiblePages(prefix, now, maxPageSize) {
+    return readyQueueClient.listEntities({
+        queryOptions: { filter: getEligibleFilter(prefix, now) }
+    }).byPage({ maxPageSize: maxPageSize });
+}
+
+/**
+ * @param  {} fileTableClient - client of FileOffsetMap
+ * @param  {} indexEntities
+ * reads the FileOffsetMap entities of the index entities, resolves with a Map by rowKey without the deleted files
+ */
+async function readFileEntities(fileTableClient, indexEntities) {
+    var files = new Map();
+    var rowKeysByPartition = {};
+    indexEntities.forEach(function (indexEntity) {
+        (rowKeysByPartition[indexEntity.filePartitionKey] = rowKeysByPartition[indexEntity.filePartitionKey] || []).push(indexEntity.rowKey);
+    });
+    var queries = [];
+    Object.keys(rowKeysByPartition).forEach(function (partitionKey) {
+        var rowKeys = rowKeysByPartition[partitionKey];
+        for (let index = 0; index < rowKeys.length; index += MAX_FILTER_ROW_KEYS) {
+            var rowKeyFilter = rowKeys.slice(index, index + MAX_FILTER_ROW_KEYS).map(function (rowKey) {
+                return odata`RowKey eq ${rowKey}`;
+            }).join(" or ");
+            queries.push((async function (filter) {
+                for await (const entity of fileTableClient.listEntities({ queryOptions: { filter: filter } })) {
+                    files.set(entity.rowKey, entity);
+                }
+            })(odata`PartitionKey eq ${partitionKey}` + ` and (${rowKeyFilter})`));
+        }
+    });
+    await Promise.all(queries);
+    return files;
+}
+
+/**
+ * @param  {} indexEntity
+ * @param  {} files - FileOffsetMap entities by rowKey
+ * returns true if the index entity is the one of the current state of its file
+ */
+function isValidIndexEntity(indexEntity, files) {
+    var entity = files.get(indexEntity.rowKey);
+    return entity !== undefined && entity.partitionKey === indexEntity.filePartitionKey && entity.readyQueueKey === indexEntity.partitionKey;
+}
+
+async function isReadyQueueBuilt(context) {
+    try {
+        await readyQueueClient.getEntity(STATE_PARTITION_KEY, STATE_ROW_KEY);
+        return true;
+    } catch (error) {
+        if (error.statusCode !== 404) {
+            context.log.error(`Unable to read ready queue state, Error: ${JSON.stringify(error)}`);
+        }
+        return false;
+    }
+}
+
+/*
+ * Verifies the ready queue against FileOffsetMap: the files without a valid index entity are missing, the index
+ * entities of deleted files or of a previous state are stale. With repair the missing files are added (readyQueueKey
+ * is saved only if the file did not change since it was read) and the stale entities removed.
+ */
+async function verifyReadyQueue(fileTableClient, context, repair) {
+    var report = { files: 0, indexed: 0, missing: 0, stale: 0, repaired: 0 };
+    var appendBlobFilter = `blobType eq '${'AppendBlob'}'`;
+    for await (const page of fileTableClient.listEntities({ queryOptions: { filter: appendBlobFilter } }).byPage({ maxPageSize: 1000 })) {
+        report.files += page.length;
+        var keyed = page.filter(function (entity) { return entity.readyQueueKey; });
+        var indexEntities = await readIndexEntities(keyed);
+        var missing = [];
+        page.forEach(function (entity) {
+            if (entity.readyQueueKey && indexEntities.has(entity.readyQueueKey + "/" + entity.rowKey)) {
+                report.indexed += 1;
+            } else {
+                missing.push(entity);
+            }
+        });
+        report.missing += missing.length;
+        if (repair && missing.length > 0) {
+            report.repaired += await addMissingFiles(fileTableClient, context, missing);
+        }
+    }
+    for await (const page of readyQueueClient.listEntities({ queryOptions: { filter: odata`PartitionKey ne ${STATE_PARTITION_KEY}` } }).byPage({ maxPageSize: 1000 })) {
+        var files = await readFileEntities(fileTableClient, page);
+        var stale = page.filter(function (indexEntity) { return !isValidIndexEntity(indexEntity, files); });
+        report.stale += stale.length;
+        if (repair && stale.length > 0) {
+            await removeFromReadyQueue(context, stale);
+        }
+    }
+    return report;
+}
+
+async function readIndexEntities(entities) {
+    var found = new Set();
+    var grouped = groupByPartition(entities.map(getIndexEntity));
+    var queries = [];
+    Object.keys(grouped).forEach(function (partitionKey) {
+        var rowKeys = grouped[partitionKey].map(function (e) { return e.rowKey; });
+        for (let index = 0; index < rowKeys.length; index += MAX_FILTER_ROW_KEYS) {
+            var rowKeyFilter = rowKeys.slice(index, index + MAX_FILTER_ROW_KEYS).map(function (rowKey) {
+                return odata`RowKey eq ${rowKey}`;
+            }).join(" or ");
+            queries.push((async function (filter) {
+                try {
+                    for await (const indexEntity of readyQueueClient.listEntities({ queryOptions: { filter: filter } })) {
+                        found.add(indexEntity.partitionKey + "/" + indexEntity.rowKey);
+                    }
+                } catch (error) {
+                    if (!isTableNotFound(error)) {
+                        throw error;
+                    }
+                }
+            })(odata`PartitionKey eq ${partitionKey}` + ` and (${rowKeyFilter})`));
+        }
+    });
+    await Promise.all(queries);
+    return found;
+}
+
+async function addMissingFiles(fileTableClient, context, entities) {
+    var now = new Date();
+    var updates = entities.map(function (entity) {
+        return { entity: entity, readyQueueKey: entity.readyQueueKey || getReadyQueueKey(entity, now) };
+    });
+    var failed = await addToReadyQueue(context, updates.map(function (update) {
+        return { partitionKey: update.entity.partitionKey, rowKey: update.entity.rowKey, readyQueueKey: update.readyQueueKey };
+    }));
+    var repaired = 0;
+    for (const update of updates) {
+        if (failed.has(update.entity.rowKey)) {
+            continue;
+        }
+        if (update.entity.readyQueueKey !== update.readyQueueKey) {
+            try {
+                await fileTableClient.updateEntity({ partitionKey: update.entity.partitionKey, rowKey: update.entity.rowKey, readyQueueKey: update.readyQueueKey }, "Merge", { etag: update.entity.etag });
+            } catch (error) {
+                // changed since it was read, it was added by its writer
+                context.log.verbose(`Skipping file updated while repairing, rowKey: ${update.entity.rowKey} error: ${JSON.stringify(error)}`);
+                continue;
+            }
+        }
+        repaired += 1;
+    }
+    return repaired;
+}
+
+/*
+ * Adds all the files of FileOffsetMap to the ready queue and marks it built, the task producer then polls it instead of
+ * FileOffsetMap
+ */
+async function rebuildReadyQueue(fileTableClient, context) {
+    var report = await verifyReadyQueue(fileTableClient, context, true);
+    if (report.repaired === report.missing) {
+        await readyQueueClient.upsertEntity({ partitionKey: STATE_PARTITION_KEY, rowKey: STATE_ROW_KEY, builddate: new Date().toISOString(), files: report.files }, "Replace");
+        report.built = true;
+    } else {
+        context.log.error(`Ready queue not marked built, ${report.missing - report.repaired} files could not be added`);
+        report.built = false;
+    }
+    return report;
+}
+
+module.exports = {
+    READY_PREFIX: READY_PREFIX,
+    LOCKED_PREFIX: LOCKED_PREFIX,
+    LOCK_THRESHOLD_MINUTES: LOCK_THRESHOLD_MINUTES,
+    getBucket: getBucket,
+    getReadyQueueKey: getReadyQueueKey,
+    getEligibleFilter: getEligibleFilter,
+    addToReadyQueue: addToReadyQueue,
+    removeFromReadyQueue: removeFromReadyQueue,
+    queryEligiblePages: queryEligiblePages,
+    readFileEntities: readFileEntities,
+    isValidIndexEntity: isValidIndexEntity,
+    isReadyQueueBuilt: isReadyQueueBuilt,
+    verifyReadyQueue: verifyReadyQueue,
+    rebuildReadyQueue: rebuildReadyQueue
+};
@@ -0,0 +1,102 @@
+/*jshint esversion: 6 */
+/**
+ * Class to limit the number of requests sent to Sumo at the same time. Send tasks are queued per key (the bucket metaKey)
+ * and started in a round robin fashion across keys so that a large bucket does not starve the others, tasks of the same key
+ * are started in FIFO order.
+ * @param maxInFlight max number of tasks running at the same time
+ * @constructor
+ */
+function SendScheduler(maxInFlight) {
+    this.maxInFlight = Math.max(1, Number(maxInFlight) || 1);
+    this.inFlight = 0;
+    this.pending = 0;
+    // key -> array of queued tasks, the Map iteration order is used as the round robin order
+    this.queues = new Map();
+    this.waiters = [];
+}
+
+/**
+ * Queue a send task
+ * @param {string} key - fairness key, usually the bucket metaKey
+ * @param {function} fn - function starting the send, should return a Promise
+ * @returns {Promise} - A promise that resolves to the result of fn once it has been run
+ */
+SendScheduler.prototype.schedule = function(key, fn) {
+    var self = this;
+    return new Promise(function (resolve, reject) {
+        if (!self.queues.has(key)) {
+            self.queues.set(key, []);
+        }
+        self.queues.get(key).push({fn: fn, resolve: resolve, reject: reject});
+        self.pending += 1;
+        self._startNext();
+    });
+};
+
+SendScheduler.prototype._startNext = function() {
+    var self = this;
+    while (this.inFlight < this.maxInFlight && this.queues.size > 0) {
+        let key = this.queues.keys().next().value;
+        let queue = this.queues.get(key);
+        let task = queue.shift();
+        // move the key to the end of the round robin order, or drop it once its queue is empty
+        this.queues.delete(key);
+        if (queue.length > 0) {
+            this.queues.set(key, queue);
+        }
+        this.pending -= 1;
+        this.inFlight += 1;
+        let result;
+        try {
+            result = Promise.resolve(task.fn());
+        } catch (err) {
+            result = Promise.reject(err);
+        }
+        result.then(task.resolve, task.reject).then(function () {
+            self.inFlight -= 1;
+            self._startNext();
+            self._notifyWaiters();
+        });
+    }
+};
+
+SendScheduler.prototype._notifyWaiters = function() {
+    let total = this.getQueuedCount();
+    this.waiters = this.waiters.filter(function (waiter) {
+        if (total <= waiter.limit) {
+            waiter.resolve();
+            return false;
+        }
+        return true;
+    });
+};
+
+/**
+ * @returns {number} the number of tasks queued or running
+ */
+SendScheduler.prototype.getQueuedCount = function() {
+    return this.pending + this.inFlight;
+};
+
+SendScheduler.prototype.getInFlightCount = function() {
+    return this.inFlight;
+};
+
+/**
+ * Wait until the number of queued and running tasks drops to limit
+ * @param {number} limit - number of tasks queued or running at which the promise resolves
+ * @returns {Promise}
+ */
+SendScheduler.prototype.whenBelow = function(limit) {
+    var self = this;
+    if (this.getQueuedCount() <= limit) {
+        return Promise.resolve();
+    }
+    return new Promise(function (resolve) {
+        self.waiters.push({limit: limit, resolve: resolve});
+    });
+};
+
+module.exports = {
+    SendScheduler:SendScheduler
+};
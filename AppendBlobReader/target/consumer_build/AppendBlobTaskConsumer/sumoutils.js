@@ -49,8 +49,107 @@ Promise.retryTillTimeout = function(fn, timeLimit,interval,fnParams) {
     return mainLoop();
 }
 
+/**
+ * Retry policy with exponential backoff and full jitter. Errors are classified before retrying: throttling (429),
+ * timeouts (408), server errors (5xx) and connection errors are retried, any other 4xx fails fast. A Retry-After
+ * returned by the server is honored and no retry is attempted once the time budget would be exceeded.
+ * @param {Object} options - maxAttempts: total number of attempts (default 3)
+ *                           baseDelay: delay in millisecs used for the first retry (default 1000)
+ *                           maxDelay: upper bound of the backoff delay in millisecs (default 30000)
+ *                           timeBudget: time in millisecs all the attempts should fit in, 0 disables it (default 0)
+ *                           retryableStatusCodes: additional status codes to retry, e.g. 412 for conditional updates
+ * @constructor
+ */
+function RetryPolicy(options) {
+    let myOptions = options || {};
+    this.maxAttempts = (myOptions.maxAttempts === undefined ? 3 : myOptions.maxAttempts);
+    this.baseDelay = (myOptions.baseDelay === undefined ? 1000 : myOptions.baseDelay);
+    this.maxDelay = myOptions.maxDelay || 30000;
+    this.timeBudget = myOptions.timeBudget || 0;
+    this.retryableStatusCodes = myOptions.retryableStatusCodes || [];
+}
+
+RetryPolicy.RETRYABLE_ERROR_CODES = ['ECONNRESET', 'ECONNREFUSED', 'ETIMEDOUT', 'ESOCKETTIMEDOUT', 'EPIPE', 'EAI_AGAIN', 'ECONNABORTED'];
+
+/**
+ * @param err - rejection value, either an error or an object wrapping it under 'error'
+ * @returns {number|undefined} the http status code of the failure if any
+ */
+RetryPolicy.getStatusCode = function(err) {
+    if (!err) return undefined;
+    return err.statusCode || (err.error && err.error.statusCode) || (err.response && err.response.status);
+};
+
+RetryPolicy.getErrorCode = function(err) {
+    if (!err) return undefined;
+    return err.code || (err.error && err.error.code);
+};
+
+/**
+ * @param err - rejection value
+ * @returns {number} delay in millisecs requested by the server through Retry-After, 0 if none
+ */
+RetryPolicy.getRetryAfter = function(err) {
+    let retryAfter = err && (err.retryAfter || (err.headers && err.headers['retry-after']));
+    if (retryAfter === undefined || retryAfter === null || retryAfter === '') return 0;
+    let seconds = Number(retryAfter);
+    if (!isNaN(seconds)) return Math.max(0, seconds * 1000);
+    let date = Date.parse(retryAfter);
+    return isNaN(date) ? 0 : Math.max(0, date - Date.now());
+};
+
+RetryPolicy.prototype.isRetryable = function(err) {
+    let statusCode = RetryPolicy.getStatusCode(err);
+    if (statusCode) {
+        return statusCode === 408 || statusCode === 429 || statusCode >= 500 || this.retryableStatusCodes.indexOf(statusCode) !== -1;
+    }
+    let errorCode = RetryPolicy.getErrorCode(err);
+    if (errorCode && typeof errorCode === 'string' && errorCode.charAt(0) === 'E') {
+        return RetryPolicy.RETRYABLE_ERROR_CODES.indexOf(errorCode) !== -1;
+    }
+    // unclassified failures are retried as before
+    return true;
+};
+
+/**
+ * @param {int} attempt - number of attempts done so far
+ * @param err - last rejection value
+ * @returns {number} delay in millisecs before the next attempt
+ */
+RetryPolicy.prototype.getDelay = function(attempt, err) {
+    let backoff = Math.min(this.maxDelay, this.baseDelay * Math.pow(2, attempt - 1));
+    return Math.max(Math.floor(Math.random() * backoff), RetryPolicy.getRetryAfter(err));
+};
+
+/**
+ * Run fn until it succeeds, the error is not retryable, maxAttempts is reached or the time budget is exhausted
+ * @param {function} fn - the function to try, should return a Promise
+ * @param {Array} fnParams - list of params to pass to the function
+ * @param context - optional, must support method "log"
+ * @returns {Promise} - A promise that resolves to the final result
+ */
+RetryPolicy.prototype.execute = function(fn, fnParams, context) {
+    var self = this;
+    var startTime = Date.now();
+    function attempt(attemptNumber) {
+        return fn.apply(this, fnParams).catch(err => {
+            if (context && err) { context.log("Retry error: ", err); }
+            if (attemptNumber >= self.maxAttempts || !self.isRetryable(err)) {
+                return Promise.reject(err);
+            }
+            let delay = self.getDelay(attemptNumber, err);
+            if (self.timeBudget > 0 && Date.now() - startTime + delay > self.timeBudget) {
+                return Promise.reject(err);
+            }
+            return Promise.wait(delay).then(() => attempt(attemptNumber + 1));
+        });
+    }
+    return attempt(1);
+};
+
 module.exports = {
     "p_retryMax" : Promise.retryMax,
     "p_wait" : Promise.wait,
-    "p_retryTillTimeout" : Promise.retryTillTimeout
+    "p_retryTillTimeout" : Promise.retryTillTimeout,
+    "RetryPolicy" : RetryPolicy
 }
@@ -3,8 +3,10 @@
 ///////////////////////////////////////////////////////////////////////////////////
 
 var sumoutils = require('./sumoutils.js');
+var { defaultRegistry: formatRegistry, getBlobExtension } = require('./formatregistry.js');
 const { TableClient } = require("@azure/data-tables");
 const tableClient = TableClient.fromConnectionString(process.env.AzureWebJobsStorage, process.env.TABLE_NAME);
+const readyqueue = require('./readyqueue.js');
 const MaxAttempts = 3
 const RetryInterval = 3000
 
@@ -75,6 +77,7 @@ function getEntity(metadata, endByte, currentEtag) {
         resourceGroupName: metadata.resourceGroupName,
         subscriptionId: metadata.subscriptionId
     };
+    entity.readyQueueKey = readyqueue.getReadyQueueKey(entity);
     if (currentEtag) {
         entity['options'] = {
             ifMatch: currentEtag, // Replace with the current ETag value of the entity
@@ -123,6 +126,22 @@ async function updateOrCreateBlobPointerMap(entity) {
     return response;
 }
 
+/**
+ * Creates the entity of a new file and adds the file to the ready queue, the entity is deleted if it cannot be added
+ * so that creating it is retried.
+ *
+ * @param {Object} context - The context object for logging.
+ * @param {Object} entity - The entity to create.
+ * @returns {Promise<Object>} - A promise that resolves to the response from creating the entity.
+ */
+async function createAppendBlobEntry(context, entity) {
+    var response = await updateOrCreateBlobPointerMap(entity); // this will always create
+    if ((await readyqueue.addToReadyQueue(context, [entity])).size > 0) {
+        await tableClient.deleteEntity(entity.partitionKey, entity.rowKey);
+        throw new Error(`Failed to add AppendBlob Entry to ready queue for rowKey: ${entity.rowKey}`);
+    }
+    return response;
+}
 
 /**
  * @param  {} PartitionKey
@@ -141,7 +160,7 @@ async function createTasksForAppendBlob(partitionKey, rowKey, context, metadata)
     context.log.verbose("Creating an entry for RowKey: ", rowKey)
     try {
         var entity = getEntity(metadata, 0, null);
-        var response = await updateOrCreateBlobPointerMap(entity); // this will always create
+        var response = await createAppendBlobEntry(context, entity);
         return Promise.resolve({ status: "success", rowKey: rowKey, message: "AppendBlob Entry added for RowKey: " + rowKey });
     } catch (err) {
 
@@ -153,7 +172,7 @@ async function createTasksForAppendBlob(partitionKey, rowKey, context, metadata)
                 context.log(`Creating table in storage account: ${process.env.TABLE_NAME}`);
                 await tableClient.createTable();
                 await new Promise(resolve => setTimeout(resolve, 10000)); // 10 second wait for the table to be created
-                var response = await updateOrCreateBlobPointerMap(entity); // this will always create
+                var response = await createAppendBlobEntry(context, entity);
                 return Promise.resolve({ status: "success", rowKey: rowKey, message: "AppendBlob Entry added for RowKey: " + rowKey });
             } catch(err) {
                 return Promise.reject({ status: "failed", rowKey: rowKey, message: `Failed to create table for rowKey: ${rowKey} error: ${JSON.stringify(err)}`});
@@ -211,21 +230,16 @@ function filterAppendBlob(messages) {
  * @returns {Array<Object>} - An array containing only the messages with supported file extensions.
  */
 function filterByFileExtension(context, messages) {
-    // List of supported file extensions
-    var supportedExtensions = ['log', 'csv', 'json', 'blob', 'txt'];
-
-    // Use Array.prototype.filter to filter messages based on extension
+    // Use Array.prototype.filter to keep the messages of the blobs in a format supported by the consumer
     return messages.filter(message => {
-        // Extract file extension from message subject
-        let fileExtension = message.subject.split(".").pop();
-
         // If no extension found
-        if (fileExtension == message.subject) {
+        if (getBlobExtension(message.subject) === "") {
             context.log.verbose("Found file with no extension, accepting appendblob file as log file")
         }
 
-        // Return true if the message's extension is in the list of supported extensions
-        return fileExtension == message.subject || supportedExtensions.includes(fileExtension);
+        // compressed data cannot be read from the end of the previous version of an append blob
+        var format = formatRegistry.getFormat({blobName: message.subject});
+        return format !== null && !format.compression;
     });
 }
 
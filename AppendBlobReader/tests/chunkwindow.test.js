@@ -0,0 +1,47 @@
+const { sendChunksInWindow } = require('../target/consumer_build/AppendBlobTaskConsumer/sendDataToSumoUsingSplitHandler');
+
+// sendChunk stub which acknowledges a chunk after delays[chunk] ms and fails the chunks listed in failures
+function createSender(delays, failures) {
+    var stats = {current: 0, max: 0, started: []};
+    function sendChunk(chunk) {
+        stats.current += 1;
+        stats.max = Math.max(stats.max, stats.current);
+        stats.started.push(chunk);
+        return new Promise(function (resolve) {
+            setTimeout(function () {
+                stats.current -= 1;
+                resolve(!failures.includes(chunk));
+            }, delays[chunk] || 0);
+        });
+    }
+    return [sendChunk, stats];
+}
+
+test('Send all chunks with at most windowSize in flight', async () => {
+    var chunks = ['a', 'bb', 'ccc', 'dddd', 'eeeee'];
+    var [sendChunk, stats] = createSender({'a': 30, 'bb': 5, 'ccc': 20}, []);
+    var sent = await sendChunksInWindow(chunks.slice(), sendChunk, 2);
+    expect(sent).toEqual({numChunksSent: 5, dataLenSent: 15});
+    expect(stats.max).toBe(2);
+});
+
+test('Only count the acknowledged prefix when a chunk fails', async () => {
+    var chunks = ['a', 'bb', 'ccc', 'dddd', 'eeeee'];
+    // ccc is acknowledged but bb fails first
+    var [sendChunk, stats] = createSender({'a': 20, 'bb': 1, 'ccc': 10}, ['bb']);
+    var sent = await sendChunksInWindow(chunks.slice(), sendChunk, 3);
+    expect(sent).toEqual({numChunksSent: 1, dataLenSent: 1});
+    // no chunk is started after the failure
+    expect(stats.started).toEqual(['a', 'bb', 'ccc']);
+});
+
+test('Count multibyte chunks in bytes', async () => {
+    var [sendChunk] = createSender({}, []);
+    var sent = await sendChunksInWindow(['é', '€'], sendChunk, 1);
+    expect(sent).toEqual({numChunksSent: 2, dataLenSent: 5});
+});
+
+test('Resolve for an empty list of chunks', async () => {
+    var [sendChunk] = createSender({}, []);
+    expect(await sendChunksInWindow([], sendChunk, 4)).toEqual({numChunksSent: 0, dataLenSent: 0});
+});
@@ -0,0 +1,117 @@
+// in-memory ready queue table, keyed by partitionKey/rowKey
+const mockIndexEntities = new Map();
+jest.mock('@azure/data-tables', () => ({
+    TableClient: {
+        fromConnectionString: () => ({
+            submitTransaction: async (actions) => {
+                actions.forEach(([action, entity]) => {
+                    if (action === 'upsert') {
+                        mockIndexEntities.set(entity.partitionKey + '/' + entity.rowKey, entity);
+                    } else {
+                        mockIndexEntities.delete(entity.partitionKey + '/' + entity.rowKey);
+                    }
+                });
+            },
+            deleteEntity: async (partitionKey, rowKey) => mockIndexEntities.delete(partitionKey + '/' + rowKey)
+        })
+    },
+    TableTransaction: function () {
+        this.actions = [];
+        this.upsertEntity = (entity) => this.actions.push(['upsert', entity]);
+        this.deleteEntity = (partitionKey, rowKey) => this.actions.push(['delete', { partitionKey: partitionKey, rowKey: rowKey }]);
+    },
+    odata: (strings, ...values) => strings.reduce((filter, part, i) => filter + part + (i < values.length ? `'${values[i]}'` : ''), '')
+}), { virtual: true });
+
+const filelease = require('../target/appendblob_producer_build/AppendBlobTaskProducer/filelease');
+const readyqueue = require('../target/appendblob_producer_build/AppendBlobTaskProducer/readyqueue');
+
+const context = { log: { error: () => {} } };
+
+// FileOffsetMap table client merging the entities if their ETag matches
+function getTableClient(entity) {
+    var etag = 0;
+    entity.etag = 'W/' + etag;
+    return {
+        entity: entity,
+        getEntity: async () => Object.assign({}, entity),
+        updateEntity: async (update, mode, options) => {
+            if (options && options.etag && options.etag !== entity.etag) {
+                throw { statusCode: 412 };
+            }
+            Object.assign(entity, update, { etag: 'W/' + (++etag) });
+            return { etag: entity.etag };
+        }
+    };
+}
+
+test('A new lease increments the fencing token', () => {
+    const now = new Date('2024-03-01T07:00:00.000Z');
+    const lease = filelease.getNewLease({ fencingToken: 4 }, now, 30 * 1000);
+    expect(lease.fencingToken).toBe(5);
+    expect(lease.leaseExpiry).toBe('2024-03-01T07:00:30.000Z');
+    expect(lease.leaseId).not.toBe(filelease.getNewLease({}, now, 30 * 1000).leaseId);
+    expect(filelease.getNewLease({}, now, 1000).fencingToken).toBe(1);
+});
+
+test('A lock expires with its lease, a lock without lease after the lock threshold', () => {
+    const now = new Date('2024-03-01T07:00:00.000Z');
+    const lockExpiryTime = '2024-03-01T06:30:00.000Z';
+    expect(filelease.isLockExpired({ leaseExpiry: '2024-03-01T06:59:59.000Z', lastEnqueLockTime: '2024-03-01T06:59:00.000Z' }, now, lockExpiryTime)).toBe(true);
+    expect(filelease.isLockExpired({ leaseExpiry: '2024-03-01T07:00:01.000Z', lastEnqueLockTime: '2024-03-01T06:00:00.000Z' }, now, lockExpiryTime)).toBe(false);
+    expect(filelease.isLockExpired({ lastEnqueLockTime: '2024-03-01T06:00:00.000Z' }, now, lockExpiryTime)).toBe(true);
+    expect(filelease.isLockExpired({ lastEnqueLockTime: '2024-03-01T06:45:00.000Z' }, now, lockExpiryTime)).toBe(false);
+});
+
+test('A task holding the lease of the file moves the offset and releases it', async () => {
+    const task = { partitionKey: 'c', rowKey: 'sa-c-f', leaseId: 'l1', fencingToken: 2 };
+    const tableClient = getTableClient({ done: true, leaseId: 'l1', fencingToken: 2, offset: 0 });
+    const lease = new filelease.FileLease(tableClient, task, context);
+    expect(await lease.claim()).toBe(true);
+    expect(await lease.renew()).toBe(true);
+    expect(await lease.release({ partitionKey: 'c', rowKey: 'sa-c-f', done: false, offset: 10 })).toBe(true);
+    expect(tableClient.entity).toMatchObject({ done: false, offset: 10, leaseId: '', leaseExpiry: '', fencingToken: 2 });
+});
+
+test('A stale task cannot move the offset', async () => {
+    const task = { partitionKey: 'c', rowKey: 'sa-c-f', leaseId: 'l1', fencingToken: 2 };
+    // leased again before the task started
+    let tableClient = getTableClient({ done: true, leaseId: 'l2', fencingToken: 3, offset: 0 });
+    expect(await new filelease.FileLease(tableClient, task, context).claim()).toBe(false);
+    // leased again while the task was running
+    tableClient = getTableClient({ done: true, leaseId: 'l1', fencingToken: 2, offset: 0 });
+    const lease = new filelease.FileLease(tableClient, task, context);
+    expect(await lease.claim()).toBe(true);
+    await tableClient.updateEntity({ leaseId: 'l2', fencingToken: 3 }, 'Merge');
+    expect(await lease.release({ partitionKey: 'c', rowKey: 'sa-c-f', done: false, offset: 10 })).toBe(false);
+    expect(tableClient.entity).toMatchObject({ done: true, leaseId: 'l2', offset: 0 });
+});
+
+test('The ready queue entity of the file follows the expiry of the lease', async () => {
+    mockIndexEntities.clear();
+    const task = { partitionKey: 'c', rowKey: 'sa-c-f', leaseId: 'l1', fencingToken: 2, readyQueueKey: 'locked-202403010700' };
+    // the producer moved the entity after the task was created, the key of the file is the one read by the claim
+    const tableClient = getTableClient({ partitionKey: 'c', rowKey: 'sa-c-f', done: true, leaseId: 'l1', fencingToken: 2, readyQueueKey: 'locked-202403010705' });
+    mockIndexEntities.set('locked-202403010705/sa-c-f', { partitionKey: 'locked-202403010705', rowKey: 'sa-c-f', filePartitionKey: 'c' });
+    const lease = new filelease.FileLease(tableClient, task, context);
+    expect(await lease.claim()).toBe(true);
+
+    const claimedKey = readyqueue.getReadyQueueKey({ done: true, leaseExpiry: tableClient.entity.leaseExpiry });
+    expect(tableClient.entity.readyQueueKey).toBe(claimedKey);
+    expect(lease.readyQueueKey).toBe(claimedKey);
+    expect([...mockIndexEntities.keys()]).toEqual([claimedKey + '/sa-c-f']);
+
+    // renewed in a later bucket
+    const now = Date.now();
+    const spy = jest.spyOn(Date, 'now').mockReturnValue(now + 60 * 60 * 1000);
+    try {
+        expect(await lease.renew()).toBe(true);
+    } finally {
+        spy.mockRestore();
+    }
+    const renewedKey = readyqueue.getReadyQueueKey({ done: true, leaseExpiry: tableClient.entity.leaseExpiry });
+    expect(renewedKey > claimedKey).toBe(true);
+    expect(tableClient.entity.readyQueueKey).toBe(renewedKey);
+    expect(lease.readyQueueKey).toBe(renewedKey);
+    expect([...mockIndexEntities.keys()]).toEqual([renewedKey + '/sa-c-f']);
+});
@@ -0,0 +1,28 @@
+jest.mock('@azure/data-tables', () => ({
+    TableClient: { fromConnectionString: () => ({}) },
+    TableTransaction: function () {},
+    odata: (strings, ...values) => strings.reduce((filter, part, i) => filter + part + (i < values.length ? `'${values[i]}'` : ''), '')
+}), { virtual: true });
+
+const readyqueue = require('../target/appendblob_producer_build/AppendBlobTaskProducer/readyqueue');
+
+test('Buckets sort as the dates they start', () => {
+    expect(readyqueue.getBucket('2024-03-01T07:24:59.999Z')).toBe('202403010720');
+    expect(readyqueue.getBucket('2024-03-01T07:25:00.000Z')).toBe('202403010725');
+    expect(readyqueue.getBucket('2023-12-31T23:59:00.000Z') < readyqueue.getBucket('2024-01-01T00:00:00.000Z')).toBe(true);
+});
+
+test('Unlocked files are eligible when written, locked files when their lock expires', () => {
+    const now = new Date('2024-03-01T07:22:00.000Z');
+    expect(readyqueue.getReadyQueueKey({ done: false, lastEnqueLockTime: '2024-02-01T00:00:00.000Z' }, now)).toBe('ready-202403010720');
+    expect(readyqueue.getReadyQueueKey({ done: true, lastEnqueLockTime: '2024-03-01T07:22:00.000Z' }, now)).toBe('locked-202403010750');
+    expect(readyqueue.getReadyQueueKey({ done: true, lastEnqueLockTime: '2024-03-01T07:22:00.000Z', leaseExpiry: '2024-03-01T07:22:30.000Z' }, now)).toBe('locked-202403010720');
+    expect(readyqueue.getEligibleFilter('locked-', now)).toBe("PartitionKey ge 'locked-' and PartitionKey le 'locked-202403010720'");
+});
+
+test('Only the index entity of the current state of a file is valid', () => {
+    const files = new Map([['sa-c-f1', { partitionKey: 'c', rowKey: 'sa-c-f1', readyQueueKey: 'ready-202403010720' }]]);
+    expect(readyqueue.isValidIndexEntity({ partitionKey: 'ready-202403010720', rowKey: 'sa-c-f1', filePartitionKey: 'c' }, files)).toBe(true);
+    expect(readyqueue.isValidIndexEntity({ partitionKey: 'locked-202403010650', rowKey: 'sa-c-f1', filePartitionKey: 'c' }, files)).toBe(false);
+    expect(readyqueue.isValidIndexEntity({ partitionKey: 'ready-202403010720', rowKey: 'sa-c-f2', filePartitionKey: 'c' }, files)).toBe(false);
+});
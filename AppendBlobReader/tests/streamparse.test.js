@@ -0,0 +1,52 @@
+const { decodeDataChunks, DataChunkDecoder } = require('../target/consumer_build/AppendBlobTaskConsumer/decodeDataChunks');
+const context = {
+    log: function (message) {
+        console.log(message);
+    }
+};
+context.log.error = context.log.verbose = function () {};
+
+// writes data to a DataChunkDecoder in pieces of pieceSize bytes and returns the same result as decodeDataChunks
+async function decodeStream(data, serviceBusTask, maxChunkSize, pieceSize) {
+    var decoder = new DataChunkDecoder(context, serviceBusTask, maxChunkSize);
+    var dataChunks = [];
+    decoder.on('data', (chunk) => dataChunks.push(chunk));
+    var ended = new Promise((resolve, reject) => {
+        decoder.on('end', resolve);
+        decoder.on('error', reject);
+    });
+    var buffer = Buffer.from(data);
+    for (var i = 0; i < buffer.length; i += pieceSize) {
+        decoder.write(buffer.subarray(i, i + pieceSize));
+    }
+    decoder.end();
+    await ended;
+    return [decoder.ignoredprefixLen, dataChunks];
+}
+
+var logTask = {rowKey: 'datafile.log', blobName: 'datafile.log', startByte: 0};
+var jsonTask = {rowKey: 'datafile.json', blobName: 'datafile.json', startByte: 0};
+
+test('Stream log data split inside boundaries and multibyte characters', async () => {
+    var data = 'prefix\n2024-05-07 10:14:34 première ligne\n2024-05-07 10:14:35 ligne € 2\n2024-05-07 10:14:36 ligne 3\n2024-05-07 10:14:37 incomplète';
+    for (var pieceSize of [1, 2, 5, 17, 1000]) {
+        var expected = decodeDataChunks(context, Buffer.from(data), logTask, 40);
+        expect(await decodeStream(data, logTask, 40, pieceSize)).toEqual(expected);
+    }
+    expect(expected[0]).toBe(7);
+    expect(expected[1].join('')).toBe(data.substring(7, data.indexOf('2024-05-07 10:14:37')));
+});
+
+test('Stream json data with a complete last record', async () => {
+    var data = '{"key1": "value1", "abc": {"xyz": "value3"}}\r\n{"key1": "välue2", "abc": {"xyz": "value4"}}\r\n{ "key1": "value3"}';
+    for (var pieceSize of [1, 3, 64]) {
+        var expected = decodeDataChunks(context, Buffer.from(data), jsonTask, 30);
+        expect(await decodeStream(data, jsonTask, 30, pieceSize)).toEqual(expected);
+    }
+    expect(expected[1].join('')).toBe(data);
+});
+
+test('Stream data with a single boundary', async () => {
+    var data = 'key1 = value1\n2024-05-07 10:14:34 only one record without new line';
+    expect(await decodeStream(data, logTask, 1024, 4)).toEqual(decodeDataChunks(context, Buffer.from(data), logTask, 1024));
+});
@@ -0,0 +1,35 @@
+const taskfeedback = require('../target/appendblob_producer_build/AppendBlobTaskProducer/taskfeedback');
+
+const MB = 1024 * 1024;
+
+test('The batchSize of a throttled or slow file is halved', () => {
+    expect(taskfeedback.getNextBatchSize({ batchSize: 64 * MB, sendStatusCode: 429, bytesBehind: '1000000000' }, 200 * MB)).toBe(32 * MB);
+    expect(taskfeedback.getNextBatchSize({ batchSize: 64 * MB, fetchStatusCode: 503 }, 200 * MB)).toBe(32 * MB);
+    expect(taskfeedback.getNextBatchSize({ batchSize: 64 * MB, fetchStatusCode: 200, sendStatusCode: 200, sendLatencyMs: 6 * 60 * 1000 }, 200 * MB)).toBe(32 * MB);
+    expect(taskfeedback.getNextBatchSize({ batchSize: 4 * MB, sendStatusCode: 429 }, 200 * MB)).toBe(4 * MB);
+});
+
+test('The batchSize of a file behind grows up to the limit of its storage account', () => {
+    expect(taskfeedback.getNextBatchSize({ batchSize: 64 * MB, sendStatusCode: 200, bytesBehind: { type: 'Int64', value: String(500 * MB) } }, 200 * MB)).toBe(80 * MB);
+    expect(taskfeedback.getNextBatchSize({ batchSize: 64 * MB, sendStatusCode: 200, bytesBehind: '0' }, 200 * MB)).toBe(64 * MB);
+    expect(taskfeedback.getNextBatchSize({ batchSize: 64 * MB, bytesBehind: String(500 * MB) }, 40 * MB)).toBe(40 * MB);
+    // no feedback yet
+    expect(taskfeedback.getNextBatchSize({}, 40 * MB)).toBe(40 * MB);
+});
+
+test('The task limit of a storage account decreases multiplicatively and increases additively', () => {
+    expect(taskfeedback.getNextTaskLimit(undefined, true, 8000)).toBe(4000);
+    expect(taskfeedback.getNextTaskLimit(4000, false, 8000)).toBe(4500);
+    expect(taskfeedback.getNextTaskLimit(60, true, 8000)).toBe(50);
+    expect(taskfeedback.getNextTaskLimit(7900, false, 8000)).toBe(8000);
+});
+
+test('The feedback of a task is recorded from the responses', () => {
+    expect(taskfeedback.getSendStatusCode({})).toBe(200);
+    expect(taskfeedback.getSendStatusCode({ 500: 1, 429: 2 })).toBe(429);
+    expect(taskfeedback.getBlobLength({ contentRange: 'bytes 0-1023/4096' })).toBe(4096);
+    expect(taskfeedback.getBlobLength({})).toBeUndefined();
+    expect(taskfeedback.getFeedbackColumns({ batchSize: 8 * MB, fetchStatusCode: 416, bytesBehind: 0 })).toEqual({
+        batchSize: 8 * MB, bytesBehind: { type: 'Int64', value: '0' }, downloadLatencyMs: 0, sendLatencyMs: 0, fetchStatusCode: 416, sendStatusCode: 0
+    });
+});
@@ -0,0 +1,123 @@
+const { FileTaskScheduler, allocateSlots } = require('../target/appendblob_producer_build/AppendBlobTaskProducer/taskscheduler');
+
+function getFile(storageName, containerName, index, lastEnqueLockTime) {
+    return {
+        rowKey: `${storageName}-${containerName}-f${index}`,
+        storageName: storageName,
+        containerName: containerName,
+        eventdate: '2024-03-01T00:00:00.000Z',
+        lastEnqueLockTime: lastEnqueLockTime
+    };
+}
+
+test('Slots are shared equally then in proportion to the demand left', () => {
+    expect(allocateSlots([5, 3], 10)).toEqual([5, 3]);
+    expect(allocateSlots([1000, 10, 10], 100)).toEqual([80, 10, 10]);
+    expect(allocateSlots([600, 200], 100)).toEqual([63, 37]);
+    expect(allocateSlots([0, 50], 10)).toEqual([0, 10]);
+});
+
+test('The slots not shared equally follow the backlog', () => {
+    const scheduler = new FileTaskScheduler(100);
+    for (let i = 0; i < 1200; i++) {
+        scheduler.add(getFile(i < 1000 ? 'large' : 'small', 'c', i, '2024-03-01T00:00:00.000Z'));
+    }
+    const perAccount = scheduler.select().reduce((counts, entity) => Object.assign(counts, { [entity.storageName]: (counts[entity.storageName] || 0) + 1 }), {});
+    // 25 each then 50 * 1000 / 1200 and 50 * 200 / 1200
+    expect(perAccount).toEqual({ large: 67, small: 33 });
+    expect(allocateSlots([100, 100], 20, [3, 1])).toEqual([13, 7]);
+});
+
+test('The oldest files of a container are selected', () => {
+    const scheduler = new FileTaskScheduler(3);
+    [5, 1, 4, 2, 3].forEach((minute) => scheduler.add(getFile('sa', 'c', minute, `2024-03-01T00:0${minute}:00.000Z`)));
+    // never enqueued, the eventdate is used
+    scheduler.add(getFile('sa', 'c', 0));
+    expect(scheduler.size).toBe(6);
+    expect(scheduler.select().map((entity) => entity.rowKey)).toEqual(['sa-c-f0', 'sa-c-f1', 'sa-c-f2']);
+});
+
+test('A storage account with a large backlog does not starve the others', () => {
+    const scheduler = new FileTaskScheduler(100);
+    for (let i = 0; i < 1000; i++) {
+        scheduler.add(getFile('noisy', 'c' + (i % 2), i, '2024-03-01T00:00:00.000Z'));
+    }
+    for (let i = 0; i < 20; i++) {
+        scheduler.add(getFile('quiet', 'c', i, '2024-03-02T00:00:00.000Z'));
+    }
+    const selected = scheduler.select();
+    const perAccount = selected.reduce((counts, entity) => Object.assign(counts, { [entity.storageName]: (counts[entity.storageName] || 0) + 1 }), {});
+    expect(selected.length).toBe(100);
+    expect(perAccount).toEqual({ noisy: 80, quiet: 20 });
+    expect(scheduler.getBacklogPerAccount()).toEqual({ noisy: 1000, quiet: 20 });
+    expect(selected[1].storageName).toBe('quiet');
+});
+
+test('A storage account alone gets all the tasks', () => {
+    const scheduler = new FileTaskScheduler(8000, 8000);
+    for (let i = 0; i < 20000; i++) {
+        scheduler.add(getFile('sa', 'c' + (i % 4), i, '2024-03-01T00:00:00.000Z'));
+    }
+    expect(scheduler.select().length).toBe(8000);
+});
+
+test('The tasks of a storage account are capped', () => {
+    const scheduler = new FileTaskScheduler(100, 60);
+    for (let i = 0; i < 1000; i++) {
+        scheduler.add(getFile('noisy', 'c' + (i % 2), i, '2024-03-01T00:00:00.000Z'));
+    }
+    scheduler.add(getFile('quiet', 'c', 0, '2024-03-02T00:00:00.000Z'));
+    expect(scheduler.select().filter((entity) => entity.storageName === 'noisy').length).toBe(60);
+});
+
+test('A storage account gets at most its task limit', () => {
+    const scheduler = new FileTaskScheduler(100);
+    for (let i = 0; i < 200; i++) {
+        scheduler.add(getFile(i < 100 ? 'throttled' : 'other', 'c', i, '2024-03-01T00:00:00.000Z'));
+    }
+    scheduler.setTaskLimits({ throttled: 10 });
+    const selected = scheduler.select();
+    expect(selected.filter((entity) => entity.storageName === 'throttled').length).toBe(10);
+    expect(selected.length).toBe(100);
+});
+
+test('The rounds select each file once and keep the limits of the invocation', () => {
+    const scheduler = new FileTaskScheduler(100, 60);
+    for (let i = 0; i < 200; i++) {
+        scheduler.add(getFile('noisy', 'c', i, `2024-03-01T00:${String(i % 60).padStart(2, '0')}:00.000Z`));
+    }
+    const firstRound = scheduler.select(50);
+    expect(firstRound.length).toBe(50);
+    for (let i = 0; i < 100; i++) {
+        scheduler.add(getFile('quiet', 'c', i, '2024-03-02T00:00:00.000Z'));
+    }
+    const secondRound = scheduler.select(30);
+    // the remaining tasks of the invocation
+    const lastRound = scheduler.select();
+    const selected = firstRound.concat(secondRound, lastRound);
+    expect(new Set(selected.map((entity) => entity.rowKey)).size).toBe(selected.length);
+    expect(selected.length).toBe(100);
+    expect(selected.filter((entity) => entity.storageName === 'noisy').length).toBe(60);
+    expect(scheduler.select()).toEqual([]);
+});
+
+test('A round selects its share of the tasks from the first page', () => {
+    const scheduler = new FileTaskScheduler(8000);
+    const selected = [];
+    for (let page = 0; page < 32; page++) {
+        for (let i = 0; i < 1000; i++) {
+            const index = page * 1000 + i;
+            scheduler.add(getFile('sa' + (index % 3), 'c', index, new Date(Date.parse('2024-03-01T00:00:00.000Z') + index * 1000).toISOString()));
+        }
+        // a page of 1000 candidates out of the 32000 polled for 8000 tasks
+        const round = scheduler.select(Math.ceil(1000 * 8000 / 32000));
+        expect(round.length).toBe(250);
+        if (page === 0) {
+            expect(round.every((entity) => Number(entity.rowKey.split('-f')[1]) < 1000)).toBe(true);
+        }
+        selected.push(...round);
+    }
+    expect(selected.length).toBe(8000);
+    expect(new Set(selected.map((entity) => entity.rowKey)).size).toBe(8000);
+    expect(scheduler.select()).toEqual([]);
+});
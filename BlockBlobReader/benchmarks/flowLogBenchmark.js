@@ -0,0 +1,157 @@
+/*
+    Flattens a flow log range built by repeating the records of the test fixtures, with the previous handlers (JSON.parse of
+    the whole range, one object per tuple, JSON.stringify of each object) and with JsonRecordTokenizer and the flowlogs
+    flatteners fed with 4MB blocks. Each run is done in a child process and reports the tuples/sec and the peak RSS.
+    Run "npm run build" in src first, usage: node benchmarks/flowLogBenchmark.js [rangeMB]
+ */
+var fs = require('fs');
+var path = require('path');
+var { execFileSync } = require('child_process');
+
+var consumerDir = path.join(__dirname, '../target/consumer_build/BlobTaskConsumer');
+var fixtures = {
+    nsg: ['blob_fixtures.json'],
+    vnet: ['blob_fixtures_vnetflowlogs.json', 'blob_fixtures_subnetflowlogs.json', 'blob_fixtures_networkinterfaceflowlogs.json']
+};
+
+// the range as it is read by the consumer, records separated by commas without the head and tail of the blob
+function generateRange(kind, sizeBytes) {
+    let texts = [];
+    fixtures[kind].forEach(function (file) {
+        JSON.parse(fs.readFileSync(path.join(__dirname, '../tests', file))).records.forEach(function (record) {
+            texts.push(JSON.stringify(record));
+        });
+    });
+    let parts = [];
+    let size = 0;
+    for (let i = 0; size < sizeBytes; i++) {
+        let text = texts[i % texts.length];
+        parts.push(text);
+        size += text.length + 1;
+    }
+    return Buffer.from(parts.join(','));
+}
+
+function legacyNsgEvents(jsonArray, onLine) {
+    let numTuples = 0;
+    jsonArray.forEach(function (record) {
+        let version = record.properties.Version;
+        record.properties.flows.forEach(function (rule) {
+            rule.flows.forEach(function (flow) {
+                flow.flowTuples.forEach(function (tuple) {
+                    let col = tuple.split(",");
+                    let event = {
+                        time: col[0], sys_id: record.systemId, category: record.category, resource_id: record.resourceId,
+                        event_name: record.operationName, rule_name: rule.rule, mac: flow.mac, src_ip: col[1], dest_IP: col[2],
+                        src_port: col[3], dest_port: col[4], protocol: col[5], traffic_destination: col[6], "traffic_a/d": col[7],
+                        version: version, flow_state: null, num_packets_sent_src_to_dest: null, bytes_sent_src_to_dest: null,
+                        num_packets_sent_dest_to_src: null, bytes_sent_dest_to_src: null
+                    };
+                    if (version === 2) {
+                        event.flow_state = (col[8] === "" || col[8] === undefined) ? null : col[8];
+                        event.num_packets_sent_src_to_dest = (col[9] === "" || col[9] === undefined) ? null : col[9];
+                        event.bytes_sent_src_to_dest = (col[10] === "" || col[10] === undefined) ? null : col[10];
+                        event.num_packets_sent_dest_to_src = (col[11] === "" || col[11] === undefined) ? null : col[11];
+                        event.bytes_sent_dest_to_src = (col[12] === "" || col[12] === undefined) ? null : col[12];
+                    }
+                    onLine(event);
+                    numTuples += 1;
+                });
+            });
+        });
+    });
+    return numTuples;
+}
+
+function legacyVnetEvents(jsonArray, onLine) {
+    let numTuples = 0;
+    jsonArray.forEach(function (record) {
+        record.flowRecords.flows.forEach(function (acl) {
+            acl.flowGroups.forEach(function (rule) {
+                rule.flowTuples.forEach(function (tuple) {
+                    let col = tuple.split(",");
+                    onLine({
+                        time: col[0], flowLogGUID: record.flowLogGUID, category: record.category,
+                        flow_log_resource_id: record.flowLogResourceID, target_resource_id: record.targetResourceID,
+                        event_name: record.operationName, acl_id: acl.aclID, rule_name: rule.rule, mac: record.macAddress,
+                        src_ip: col[1], dest_IP: col[2], src_port: col[3], dest_port: col[4], protocol: col[5], flow_direction: col[6],
+                        flow_state: (col[7] === "" || col[7] === undefined) ? null : col[7],
+                        flow_encryption_status: (col[8] === "" || col[8] === undefined) ? null : col[8],
+                        num_packets_sent_src_to_dest: (col[9] === "" || col[9] === undefined) ? null : col[9],
+                        bytes_sent_src_to_dest: (col[10] === "" || col[10] === undefined) ? null : col[10],
+                        num_packets_sent_dest_to_src: (col[11] === "" || col[11] === undefined) ? null : col[11],
+                        bytes_sent_dest_to_src: (col[12] === "" || col[12] === undefined) ? null : col[12],
+                        version: record.flowLogVersion
+                    });
+                    numTuples += 1;
+                });
+            });
+        });
+    });
+    return numTuples;
+}
+
+function runLegacy(kind, range) {
+    let events = [];
+    let msg = range.toString().trim().replace(/(^,)|(,$)/g, "");
+    let jsonArray = JSON.parse("[" + msg + "]");
+    let numTuples = (kind === 'nsg' ? legacyNsgEvents : legacyVnetEvents)(jsonArray, function (event) {
+        events.push(event);
+    });
+    // the events were serialized by SumoClient once all of them were added
+    let outputBytes = 0;
+    events.forEach(function (event) {
+        outputBytes += JSON.stringify(event).length + 1;
+    });
+    return [numTuples, outputBytes];
+}
+
+function runStreaming(kind, range) {
+    let { JsonRecordTokenizer } = require(path.join(consumerDir, 'jsonrecordtokenizer'));
+    let { flattenNsgRecord, flattenVnetRecord } = require(path.join(consumerDir, 'flowlogs'));
+    let flattenRecord = kind === 'nsg' ? flattenNsgRecord : flattenVnetRecord;
+    let tokenizer = new JsonRecordTokenizer({syncRegex: /{\s*"time":/});
+    let numTuples = 0;
+    let outputBytes = 0;
+    let onLine = function (line) {
+        outputBytes += line.length + 1;
+    };
+    let onRecord = function (text) {
+        numTuples += flattenRecord(JSON.parse(text), onLine);
+    };
+    for (let i = 0; i < range.length; i += 4 * 1024 * 1024) {
+        // copied, as the blocks are received from the storage account
+        tokenizer.write(Buffer.from(range.subarray(i, i + 4 * 1024 * 1024)), onRecord);
+    }
+    tokenizer.end();
+    return [numTuples, outputBytes];
+}
+
+function runChild(kind, mode, rangeMB) {
+    let range = generateRange(kind, rangeMB * 1024 * 1024);
+    let baseRSS = process.memoryUsage().rss;
+    let start = process.hrtime.bigint();
+    let [numTuples, outputBytes] = mode === 'legacy' ? runLegacy(kind, range) : runStreaming(kind, range);
+    let seconds = Number(process.hrtime.bigint() - start) / 1e9;
+    console.log(JSON.stringify({
+        numTuples: numTuples,
+        outputBytes: outputBytes,
+        tuplesPerSec: Math.round(numTuples / seconds),
+        peakRSSMB: Math.round(process.resourceUsage().maxRSS / 1024),
+        baseRSSMB: Math.round(baseRSS / 1024 / 1024)
+    }));
+}
+
+if (process.argv[2] === '--child') {
+    runChild(process.argv[3], process.argv[4], parseInt(process.argv[5], 10));
+} else {
+    let rangeMB = parseInt(process.argv[2] || '64', 10);
+    console.log(`range: ${rangeMB}MB`);
+    ['nsg', 'vnet'].forEach(function (kind) {
+        ['legacy', 'streaming'].forEach(function (mode) {
+            let output = execFileSync(process.execPath, [__filename, '--child', kind, mode, String(rangeMB)]);
+            let result = JSON.parse(output.toString());
+            console.log(`${kind} ${mode}: ${result.numTuples} tuples ${result.tuplesPerSec} tuples/sec peak RSS ${result.peakRSSMB}MB (${result.baseRSSMB}MB with the range) output ${result.outputBytes} bytes`);
+        });
+    });
+}
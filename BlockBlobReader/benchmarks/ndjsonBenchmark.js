@@ -0,0 +1,81 @@
+/*
+    Parses a .blob range built by repeating the lines of tests/blob_fixtures.blob, with the previous blobHandler (regex
+    replaces over the whole range and JSON.parse of the range as an array) and with NdjsonParser fed with 4MB blocks.
+    Each run is done in a child process and reports the MB/sec, records/sec and the peak RSS.
+    Run "npm run build" in src first, usage: node benchmarks/ndjsonBenchmark.js [rangeMB]
+ */
+var fs = require('fs');
+var path = require('path');
+var { execFileSync } = require('child_process');
+
+var consumerDir = path.join(__dirname, '../target/consumer_build/BlobTaskConsumer');
+
+function generateRange(sizeBytes) {
+    let lines = fs.readFileSync(path.join(__dirname, '../tests/blob_fixtures.blob')).toString().split('\n');
+    let parts = [];
+    let size = 0;
+    for (let i = 0; size < sizeBytes; i++) {
+        let line = lines[i % lines.length];
+        parts.push(line);
+        size += Buffer.byteLength(line) + 1;
+    }
+    return Buffer.from(parts.join('\n') + '\n');
+}
+
+function legacyBlobHandler(msg) {
+    msg = msg.replace(/\0/g, '');
+    msg = msg.replace(/(\r?\n|\r)/g, ",");
+    msg = msg.trim().replace(/(^,+)|(,+$)/g, "");
+    return JSON.parse("[" + msg + "]");
+}
+
+function runLegacy(range) {
+    let records = [];
+    // the range was downloaded into a buffer and decoded as a whole
+    legacyBlobHandler(range.toString('utf8')).forEach(function (record) {
+        records.push(record);
+    });
+    return records.length;
+}
+
+function runStreaming(range) {
+    let { NdjsonParser } = require(path.join(consumerDir, 'ndjsonparser'));
+    let parser = new NdjsonParser();
+    let numRecords = 0;
+    let onRecord = function () {
+        numRecords += 1;
+    };
+    for (let i = 0; i < range.length; i += 4 * 1024 * 1024) {
+        // copied, as the blocks are received from the storage account
+        parser.write(Buffer.from(range.subarray(i, i + 4 * 1024 * 1024)), onRecord);
+    }
+    parser.end(onRecord);
+    return numRecords;
+}
+
+function runChild(mode, rangeMB) {
+    let range = generateRange(rangeMB * 1024 * 1024);
+    let baseRSS = process.memoryUsage().rss;
+    let start = process.hrtime.bigint();
+    let numRecords = mode === 'legacy' ? runLegacy(range) : runStreaming(range);
+    let seconds = Number(process.hrtime.bigint() - start) / 1e9;
+    console.log(JSON.stringify({
+        numRecords: numRecords,
+        mbPerSec: Math.round(range.length / 1024 / 1024 / seconds),
+        recordsPerSec: Math.round(numRecords / seconds),
+        peakRSSMB: Math.round(process.resourceUsage().maxRSS / 1024),
+        baseRSSMB: Math.round(baseRSS / 1024 / 1024)
+    }));
+}
+
+if (process.argv[2] === '--child') {
+    runChild(process.argv[3], parseInt(process.argv[4], 10));
+} else {
+    let rangeMB = parseInt(process.argv[2] || '100', 10);
+    console.log(`range: ${rangeMB}MB`);
+    ['legacy', 'streaming'].forEach(function (mode) {
+        let output = execFileSync(process.execPath, [__filename, '--child', mode, String(rangeMB)]);
+        let result = JSON.parse(output.toString());
+        console.log(`${mode}: ${result.numRecords} records ${result.mbPerSec} MB/sec ${result.recordsPerSec} records/sec peak RSS ${result.peakRSSMB}MB (${result.baseRSSMB}MB with the range)`);
+    });
+}
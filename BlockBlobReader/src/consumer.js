@@ -3,184 +3,169 @@
 ///////////////////////////////////////////////////////////////////////////////////
 
 var sumoHttp = require('./sumoclient');
+var { SendScheduler } = require('./sendscheduler');
+var { CsvParser } = require('./csvparser');
+var { LRUCache } = require('./lrucache');
+var { defaultRegistry: formatRegistry, getBlobExtension } = require('./formatregistry');
+var { flattenNsgRecord, flattenVnetRecord } = require('./flowlogs');
+var { DOWNLOAD_BLOCK_SIZE, downloadBlocks, downloadAlignedBlocks } = require('./blobdownload');
+var { Readable, pipeline } = require('stream');
 var { ContainerClient } = require("@azure/storage-blob");
 var { DefaultAzureCredential } = require("@azure/identity");
 const { TableClient } = require("@azure/data-tables");
-var { AbortController } = require("@azure/abort-controller");
 var { ServiceBusClient } = require("@azure/service-bus");
 var DEFAULT_CSV_SEPARATOR = ",";
-var MAX_CHUNK_SIZE = 1024;
-var JSON_BLOB_HEAD_BYTES = 12;
-var JSON_BLOB_TAIL_BYTES = 2;
+// size of the ranged read for the csv header row, it is enough for the header in a single read
+var CSV_HEADER_READ_BYTES = 64 * 1024;
+var CSV_HEADER_CACHE_SIZE = 1000;
 const azureTableClient = TableClient.fromConnectionString(process.env.AzureWebJobsStorage, "FileOffsetMap");
+// csv header rows keyed by blob, reused across invocations on a warm instance
+var csvHeaderCache = new LRUCache(CSV_HEADER_CACHE_SIZE);
+var CONTAINER_CLIENT_CACHE_SIZE = 100;
+var tokenCredential = null;
+// ContainerClients keyed by container url, see getContainerClient
+var containerClients = new LRUCache(CONTAINER_CLIENT_CACHE_SIZE);
+// the connection of the client is kept open, only the receivers are closed
+var serviceBusClient = null;
+// dead-lettered tasks received per batch and processed concurrently by the DLQ timer trigger
+var DLQ_BATCH_SIZE = Number(process.env.APPSETTING_DLQBatchSize) || 32;
+var DLQ_CONCURRENCY = Number(process.env.APPSETTING_DLQConcurrency) || 8;
+// no batch is received after DLQ_TIME_BUDGET_MS, the timer runs every 5 min and the function timeout is 10 min
+var DLQ_TIME_BUDGET_MS = Number(process.env.APPSETTING_DLQTimeBudgetMs) || 4 * 60 * 1000;
+var DLQ_LOCK_RENEWAL_MARGIN_MS = 5 * 60 * 1000;
+var DLQ_FIRST_WAIT_MS = 60 * 1000;
+var DLQ_NEXT_WAIT_MS = 5 * 1000;
+var DLQ_MAX_CONCURRENT_REQUESTS = 20;
 
-function csvToArray(strData, strDelimiter) {
-    strDelimiter = (strDelimiter || ",");
-    var objPattern = new RegExp(
-        (
-            "(\\" + strDelimiter + "|\\r?\\n|\\r|^)" +           // Delimiters.
-            "(?:\"([^\"]*(?:\"\"[^\"]*)*)\"|" +                  // Quoted fields.
-            "([^\"\\" + strDelimiter + "\\r\\n]*))"              // Standard fields.
-        ),
-        "gi"
-    );
-    var arrData = [[]];
-    var arrMatches = null;
-    var strMatchedValue;
-    var strMatchedDelimiter;
-    while (arrMatches = objPattern.exec(strData)) {
-        strMatchedDelimiter = arrMatches[1];
-        if (strMatchedDelimiter.length && strMatchedDelimiter !== strDelimiter) {
-            arrData.push([]);
-        }
-
-        if (arrMatches[2]) {
-            strMatchedValue = arrMatches[2].replace( //unescape any double quotes.
-                new RegExp("\"\"", "g"),
-                "\""
-                );
-        } else {
-            strMatchedValue = arrMatches[3]; // We found a non-quoted value.
-        }
-        arrData[arrData.length - 1].push(strMatchedValue);
-    }
-    return arrData;
-}
-
-function hasAllHeaders(text) {
-    var delimitters = new RegExp("(\\r?\\n|\\r)");
-    var strMatchedDelimiter = text.match(delimitters);
-    if (strMatchedDelimiter) {
-        return text.split(strMatchedDelimiter[0])[0];
-    } else {
-        return null;
+/*
+    The header cached for a blob is reused as long as the blob was not recreated, appending blocks changes the ETag but
+    not the creation time. The ETag is compared only when the creation time is not returned.
+ */
+function isSameBlob(cached, blobProperties) {
+    if (cached.createdOn && blobProperties.createdOn) {
+        return cached.createdOn.getTime() === blobProperties.createdOn.getTime();
     }
+    return cached.etag !== undefined && cached.etag === blobProperties.etag;
 }
 
-function getHeaderRecursively(headertext, task, blobService, context) {
-
-    return new Promise(function (resolve, reject) {
-        getData(task, blobService, context).then(function (text) {
-            headertext += text;
-            var onlyheadertext = hasAllHeaders(headertext);
-            var bytesOffset = MAX_CHUNK_SIZE;
-            if (onlyheadertext) {
-                var csvHeaders = csvToArray(onlyheadertext, DEFAULT_CSV_SEPARATOR);
-                if (csvHeaders && csvHeaders[0].length > 0) {
-                    resolve(csvHeaders[0]);
-                } else {
-                    reject("Error in csvToArray parsing: " + csvHeaders);
-                }
-            } else {
-                task.startByte = task.endByte + 1;
-                task.endByte = task.startByte + bytesOffset - 1;
-                getHeaderRecursively(headertext, task, blobService, context).then(function (headers) {
-                    resolve(headers);
-                }).catch(function (err) {
-                    reject(err);
-                });
-            }
-        }).catch(function (err) {
-            reject(err);
-        });
-    });
-
-}
-
-function getcsvHeader(containerName, blobName, blobService, context) {
-    // Todo optimize to avoid multiple request
-    var bytesOffset = MAX_CHUNK_SIZE;
+/*
+    Reads the header row with a single ranged read from the start of the blob, the read is only repeated with a larger
+    range if the header row is longer than readBytes.
+ */
+function readcsvHeader(readBytes, blobService, context, format) {
     var task = {
-        containerName: containerName,
-        blobName: blobName,
         startByte: 0,
-        endByte: bytesOffset - 1
+        endByte: readBytes - 1
     };
-
-    return getHeaderRecursively("", task, blobService, context);
+    var headerProperties = {};
+    return getData(task, blobService, context, headerProperties, format).then(function (text) {
+        var headers = null;
+        var onRow = function (row) {
+            if (!headers) {
+                headers = row;
+            }
+        };
+        var parser = new CsvParser(DEFAULT_CSV_SEPARATOR);
+        parser.write(text, onRow);
+        if (!headers && headerProperties.contentLength < readBytes) {
+            // whole blob is read
+            parser.end(onRow);
+        }
+        if (!headers) {
+            if (headerProperties.contentLength < readBytes) {
+                return Promise.reject("Error in csv header parsing: no header row");
+            }
+            return readcsvHeader(readBytes * 4, blobService, context, format);
+        }
+        return {headers: headers, etag: headerProperties.etag, createdOn: headerProperties.createdOn};
+    });
 }
 
-function csvHandler(context,msgtext, headers) {
-    var messages = csvToArray(msgtext, DEFAULT_CSV_SEPARATOR);
-    var messageArray = [];
-    if (headers.length > 0 && messages.length > 0 && messages[0].length > 0 && headers[0] === messages[0][0]) {
-        messages = messages.slice(1); //removing header row
+/**
+ * @param serviceBusTask - task of the blob
+ * @param blobService - blob client of the blob
+ * @param context
+ * @param blobProperties - etag and createdOn of the blob returned by getData for the task range
+ * @param format - format of the blob, the start of a compressed blob is decompressed
+ * @returns {Promise} - resolves with the header row of the blob
+ */
+function getcsvHeader(serviceBusTask, blobService, context, blobProperties, format) {
+    var cacheKey = serviceBusTask.storageName + "/" + serviceBusTask.containerName + "/" + serviceBusTask.blobName;
+    var cached = csvHeaderCache.get(cacheKey);
+    if (cached && isSameBlob(cached, blobProperties)) {
+        return Promise.resolve(cached.headers);
     }
-    messages.forEach(function (row) {
+    return readcsvHeader(CSV_HEADER_READ_BYTES, blobService, context, format).then(function (header) {
+        csvHeaderCache.set(cacheKey, header);
+        return header.headers;
+    });
+}
+
+/**
+ * Rows with a different number of fields than the headers are dropped
+ * @returns {function} - callback for the csv parser which calls onRecord with an object keyed by the headers for each row
+ */
+function getCsvRowHandler(headers, onRecord) {
+    var isFirstRow = true;
+    return function (row) {
+        if (isFirstRow) {
+            isFirstRow = false;
+            if (headers.length > 0 && row.length > 0 && headers[0] === row[0]) {
+                return; //removing header row
+            }
+        }
         if (row.length === headers.length) {
             var msgobj = {};
             for (var i = headers.length - 1; i >= 0; i--) {
                 msgobj[headers[i]] = row[i];
             }
-            messageArray.push(msgobj);
+            onRecord(msgobj);
         }
-    });
-    return messageArray;
-}
-
-/*
-    return index of first time when pattern matches the string
- */
-function regexIndexOf(string, regex, startpos) {
-    var indexOf = string.substring(startpos || 0).search(regex);
-    return (indexOf >= 0) ? (indexOf + (startpos || 0)) : indexOf;
+    };
 }
 
 /*
-    return index of last time when pattern matches the string
+    Adds the csv rows to sumoClient as the blocks of the task range are downloaded. The header is fetched once the
+    first block returned the blob properties used to validate the cached header.
  */
-function regexLastIndexOf(string, regex, startpos) {
-    // https://stackoverflow.com/questions/19445994/javascript-string-search-for-regex-starting-at-the-end-of-the-string
-    var stringToWorkWith = string.substring(startpos, string.length);
-    var match = stringToWorkWith.match(regex);
-    return match ? string.lastIndexOf(match.slice(-1)) : -1;
+async function csvStreamHandler(context, serviceBusTask, blobService, sumoClient, format) {
+    var blobProperties = {};
+    var parser = format.createParser();
+    var onRow = null;
+    for await (const block of readBlocks(serviceBusTask, blobService, context, blobProperties, format)) {
+        if (!onRow) {
+            var headers = await getcsvHeader(serviceBusTask, blobService, context, blobProperties, format).catch(function (err) {
+                context.log.error("Error in creating json from csv.");
+                throw err;
+            });
+            context.log("Received headers %d", headers.length);
+            onRow = getCsvRowHandler(headers, function (msgobj) {
+                sumoClient.addData(msgobj);
+            });
+        }
+        parser.write(block, onRow);
+        // rows of the next blocks are added once the requests of this block are sent, the download continues meanwhile
+        await sumoClient.whenFlushed();
+    }
+    if (onRow) {
+        parser.end(onRow);
+    }
 }
 
 /*
-    returns array of json by removing unparseable prefix and suffix in data
+    Adds the lines of a log range to sumoClient as the blocks of the task range are downloaded. Each message ends at the
+    last new line of the data received so far so that lines are not split, messages are joined by new lines.
  */
-function getParseableJsonArray(data, context) {
-
-    let logRegex = '{\\s*\"time\"\:'; // starting regex for nsg logs
-    let defaultEncoding = "utf8";
-    let orginalDatalength = data.length;
-    // If the byte sequence in the buffer data is not valid according to the provided encoding, then it is replaced by the default replacement character i.e. U+FFFD.
-    // return -1 if not found
-    let firstIdx = regexIndexOf(data, logRegex);
-    let lastIndex = regexLastIndexOf(data, logRegex, firstIdx + 1);
-
-    // data.substring method extracts the characters in a string between "start" and "end", not including "end" itself.
-    let prefix = data.substring(0, firstIdx);
-    // in case only one time string
-    if (lastIndex === -1 && data.length > 0) {
-        lastIndex = data.length;
-    }
-    let suffix = data.substring(lastIndex, data.length);
-    if (suffix.length > 0) {
-        try {
-            JSON.parse(suffix.trim());
-            lastIndex = data.length;
-        } catch (error) {
-            context.log.error(`Failed to parse the JSON last chunk. Ignoring suffix: ${suffix.trim()}, error: ${error}`);
-        }
-    }
-
-    // ideally ignoredprefixLen should always be 0. it will be dropped for files which are updated
-    context.log.verbose(`Ignoring log prefix length: ${Buffer.byteLength(prefix, defaultEncoding)} suffix length: ${Buffer.byteLength(data.substring(lastIndex, data.length), defaultEncoding)}`);
-
-    // data with both prefix and suffix removed
-    data = data.substring(firstIdx, lastIndex);
-    let dataLenParsed = Buffer.byteLength(prefix + data, defaultEncoding);
-    data = data.trim().replace(/(^,)|(,$)/g, ""); //removing trailing spaces,newlines and leftover commas
-
-    try {
-        var jsonArray = JSON.parse("[" + data + "]");
-        context.log.verbose(`Successfully parsed Json! datalength: ${data.length} orginalDatalength: ${orginalDatalength} dataLenParsed: ${dataLenParsed}`)
-        return [jsonArray, dataLenParsed, true];
-    } catch(error) {
-        context.log.error(`Failed to parse the JSON after removing prefix/suffix  Error: ${error} firstIdx: ${firstIdx} lastIndex: ${lastIndex} prefix: ${prefix} datastart: ${data.substring(0,10)} dataend: ${data.substring(data.length-10,data.length)} orginalDatalength: ${orginalDatalength} dataLenParsed: ${dataLenParsed}`);
-        return [[data], dataLenParsed, false];
+async function logStreamHandler(context, serviceBusTask, blobService, sumoClient, format) {
+    var parser = format.createParser();
+    var onRecord = function (lines) {
+        sumoClient.addData(lines);
+    };
+    for await (const block of readBlocks(serviceBusTask, blobService, context, null, format)) {
+        parser.write(block, onRecord);
+        await sumoClient.whenFlushed();
     }
+    parser.end(onRecord);
 }
 
 function getRowKey(metadata) {
@@ -216,131 +201,52 @@ async function setAppendBlobOffset(context, serviceBusTask, newOffset) {
     }
 }
 
-async function nsgLogsHandler(context, msg, serviceBusTask) {
-
-    let jsonArray = [];
-    msg = msg.trim().replace(/(^,)|(,$)/g, ""); //removing trailing spaces,newlines and leftover commas
-
-    try {
-        jsonArray = JSON.parse("[" + msg + "]");
-    } catch(err) {
-        let response = getParseableJsonArray(msg, context, serviceBusTask);
-        jsonArray = response[0];
-        let is_success = response[2];
-        let newOffset = response[1] + serviceBusTask.startByte;
-        if (is_success) {
-            await setAppendBlobOffset(context, serviceBusTask, newOffset);
-        } else {
-            return jsonArray;
+/*
+    Records are split out of the downloaded blocks by the parser of the format and parsed one at a time, then the flattener
+    of the format writes one line per flow tuple to sumoClient, so the whole range is never parsed at once. When the range starts or
+    ends in the middle of a record, the offset is moved after the last complete record so that the incomplete one is
+    read again with the next task, the offset saved is the last byte read as with the offsets saved by the producer.
+ */
+async function flowLogsHandler(context, serviceBusTask, blobService, sumoClient, format) {
+    var parser = format.createParser();
+    var flattenRecord = flowLogFlatteners[format.name];
+    var numTuples = 0;
+    var onLine = function (line) {
+        sumoClient.addData(line);
+    };
+    var onRecord = function (text) {
+        var record;
+        try {
+            record = JSON.parse(text);
+        } catch (error) {
+            context.log.error(`Failed to parse the JSON record Error: ${error} datastart: ${text.substring(0, 10)} dataend: ${text.substring(text.length - 10)}`);
+            sumoClient.addData(text);
+            return;
         }
-
+        try {
+            numTuples += flattenRecord(record, onLine);
+        } catch (error) {
+            // e.g. an object nested in a truncated record at the start of the range
+            context.log.error(`Failed to flatten the JSON record Error: ${error} datastart: ${text.substring(0, 10)}`);
+        }
+    };
+    for await (const block of readBlocks(serviceBusTask, blobService, context, null, format)) {
+        parser.write(block, onRecord);
+        await sumoClient.whenFlushed();
     }
-
-    let eventsArr = [];
-    jsonArray.forEach(function (record) {
-        let version = record.properties.Version;
-        record.properties.flows.forEach(function (rule) {
-            rule.flows.forEach(function (flow) {
-                flow.flowTuples.forEach(function (tuple) {
-                    let col = tuple.split(",");
-                    let event = {
-                        time: col[0], // this should be epoch time
-                        sys_id: record.systemId,
-                        category: record.category,
-                        resource_id: record.resourceId,
-                        event_name: record.operationName,
-                        rule_name: rule.rule,
-                        mac: flow.mac,
-                        src_ip: col[1],
-                        dest_IP: col[2],
-                        src_port: col[3],
-                        dest_port: col[4],
-                        protocol: col[5],
-                        traffic_destination: col[6],
-                        "traffic_a/d": col[7],
-                        version: version,
-                        flow_state: null,
-                        num_packets_sent_src_to_dest: null,
-                        bytes_sent_src_to_dest: null,
-                        num_packets_sent_dest_to_src: null,
-                        bytes_sent_dest_to_src: null
-                        // nsg_name:
-                        // resource_group_name:
-                    }
-                    if (version === 2) {
-                        event.flow_state = (col[8] === "" || col[8] === undefined) ?  null : col[8];
-                        event.num_packets_sent_src_to_dest = (col[9] === "" || col[9] === undefined) ?  null : col[9];
-                        event.bytes_sent_src_to_dest = (col[10] === "" || col[10] === undefined) ?  null : col[10];
-                        event.num_packets_sent_dest_to_src = (col[11] === "" || col[11] === undefined) ?  null : col[11];
-                        event.bytes_sent_dest_to_src = (col[12] === "" || col[12] === undefined) ?  null : col[12];
-                    }
-                    eventsArr.push(event);
-                })
-            })
-        })
-    });
-    return eventsArr;
-}
-
-async function networkFlowLogsHandler(context, msg, serviceBusTask) {
-
-    let jsonArray = [];
-    msg = msg.trim().replace(/(^,)|(,$)/g, ""); //removing trailing spaces,newlines and leftover commas
-
-    try {
-        jsonArray = JSON.parse("[" + msg + "]");
-    } catch(err) {
-        let response = getParseableJsonArray(msg, context, serviceBusTask);
-        jsonArray = response[0];
-        let is_success = response[2];
-        let newOffset = response[1] + serviceBusTask.startByte;
-        if (is_success) {
-            await setAppendBlobOffset(context, serviceBusTask, newOffset);
-        } else {
-            return jsonArray;
+    var result = parser.end();
+    context.log.verbose(`Flattened flow logs numRecords: ${result.numRecords} numTuples: ${numTuples} skippedBytes: ${result.skippedBytes} incompleteBytes: ${result.incompleteBytes}`);
+    if (result.skippedBytes > 0 || result.incompleteBytes > 0) {
+        if (result.numRecords === 0) {
+            context.log.error(`Failed to find a complete JSON record in blob ${serviceBusTask.blobName} ${serviceBusTask.startByte} ${serviceBusTask.endByte}`);
+        } else if (!format.compression) {
+            // consumed is an offset in the decompressed data of compressed blobs, whose ranges are not read again
+            await setAppendBlobOffset(context, serviceBusTask, serviceBusTask.startByte + result.consumed - 1);
         }
-
     }
-    // Format: https://learn.microsoft.com/en-us/azure/network-watcher/vnet-flow-logs-overview#log-format
-    let eventsArr = [];
-    jsonArray.forEach(function (record) {
-        record.flowRecords.flows.forEach(function (acl) {
-            acl.flowGroups.forEach(function (rule) {
-                rule.flowTuples.forEach(function (tuple) {
-                    let col = tuple.split(",");
-                    let event = {
-                        time: col[0], // Time stamp of when the flow occurred, in UNIX epoch format.
-                        flowLogGUID: record.flowLogGUID,
-                        category: record.category,
-                        flow_log_resource_id: record.flowLogResourceID,
-                        target_resource_id: record.targetResourceID,
-                        event_name: record.operationName,
-                        acl_id: acl.aclID,
-                        rule_name: rule.rule,
-                        mac: record.macAddress,
-                        src_ip: col[1],
-                        dest_IP: col[2],
-                        src_port: col[3],
-                        dest_port: col[4],
-                        protocol: col[5],
-                        flow_direction: col[6],
-                        flow_state: (col[7] === "" || col[7] === undefined) ?  null : col[7],
-                        flow_encryption_status: (col[8] === "" || col[8] === undefined) ?  null : col[8],
-                        num_packets_sent_src_to_dest: (col[9] === "" || col[9] === undefined) ?  null : col[9],
-                        bytes_sent_src_to_dest: (col[10] === "" || col[10] === undefined) ?  null : col[10],
-                        num_packets_sent_dest_to_src: (col[11] === "" || col[11] === undefined) ?  null : col[11],
-                        bytes_sent_dest_to_src: (col[12] === "" || col[12] === undefined) ?  null : col[12],
-                        version: record.flowLogVersion
-
-                    }
-                    eventsArr.push(event);
-                });
-            });
-        });
-    });
-    return eventsArr;
 }
 
+var flowLogFlatteners = {"nsg": flattenNsgRecord, "vnetflowlogs": flattenVnetRecord};
 
 function jsonHandler(context,msg) {
     // it's assumed that json is well formed {},{}
@@ -351,110 +257,216 @@ function jsonHandler(context,msg) {
     return jsonArray;
 }
 
-function blobHandler(context,msg) {
-    // it's assumed that .blob files contains json separated by \n
-    //https://docs.microsoft.com/en-us/azure/application-insights/app-insights-export-telemetry
+/*
+    Parses each line of a newline delimited JSON range (e.g. .blob files) on its own and adds the records to sumoClient
+    as the blocks of the task range are downloaded. Malformed lines are logged with their position in the blob and
+    skipped, a last line without line break which cannot be parsed is read again with the next task.
+ */
+async function blobStreamHandler(context, serviceBusTask, blobService, sumoClient, format) {
+    // the positions in compressed blobs are offsets in the decompressed data
+    var baseOffset = format.compression ? 0 : serviceBusTask.startByte;
+    var parser = format.createParser({
+        onError: function (error, start, end) {
+            context.log.error(`Failed to parse the JSON line in blob ${serviceBusTask.blobName} bytes ${baseOffset + start}-${baseOffset + end - 1} Error: ${error}`);
+        }
+    });
+    var onRecord = function (record) {
+        sumoClient.addData(record);
+    };
+    for await (const block of readBlocks(serviceBusTask, blobService, context, null, format)) {
+        parser.write(block, onRecord);
+        await sumoClient.whenFlushed();
+    }
+    var result = parser.end(onRecord);
+    context.log.verbose(`Parsed json lines numRecords: ${result.numRecords} badLines: ${result.badLines} skippedBytes: ${result.skippedBytes} incompleteBytes: ${result.incompleteBytes}`);
+    if (result.incompleteBytes > 0 && !format.compression) {
+        await setAppendBlobOffset(context, serviceBusTask, serviceBusTask.startByte + result.consumed - 1);
+    }
+}
 
-    var jsonArray = [];
-    msg = msg.replace(/\0/g, '');
-    msg = msg.replace(/(\r?\n|\r)/g, ",");
-    msg = msg.trim().replace(/(^,+)|(,+$)/g, ""); //removing trailing spaces,newlines and leftover commas
-    jsonArray = JSON.parse("[" + msg + "]");
-    return jsonArray;
+/**
+ * Decompresses the downloaded blocks, the decompressed data is yielded in blocks of about DOWNLOAD_BLOCK_SIZE
+ * @param blocks - async iterable of the compressed blocks
+ * @param decompressor - zlib stream
+ */
+async function* decompressBlocks(blocks, decompressor) {
+    // download failures and corrupted data are thrown by the iteration of the decompressed data
+    pipeline(Readable.from(blocks), decompressor, function () {});
+    var pending = [];
+    var pendingBytes = 0;
+    for await (const chunk of decompressor) {
+        pending.push(chunk);
+        pendingBytes += chunk.length;
+        if (pendingBytes >= DOWNLOAD_BLOCK_SIZE) {
+            yield Buffer.concat(pending, pendingBytes);
+            pending = [];
+            pendingBytes = 0;
+        }
+    }
+    if (pendingBytes > 0) {
+        yield Buffer.concat(pending, pendingBytes);
+    }
 }
 
-function logHandler(context,msg) {
-    return [msg];
+/*
+    A compressed range can only be decompressed from the start of a compressed member, a range starting after the
+    previous version of the blob is one if the blob was appended with whole members (several gzip members in a file are
+    valid gzip), otherwise the blob was rewritten and it is read again from its start.
+ */
+async function* downloadCompressedBlocks(task, blockBlobClient, context, blobProperties, compression) {
+    var isFirstBlock = true;
+    for await (const block of downloadBlocks(task, blockBlobClient, context, blobProperties)) {
+        if (isFirstBlock && task.startByte > 0 && !compression.isMemberStart(block)) {
+            context.log(`Range of blob ${task.blobName} ${task.startByte} ${task.endByte} does not start with a ${compression.name} member, reading the blob from the start`);
+            task.startByte = 0;
+            yield* downloadBlocks(task, blockBlobClient, context, blobProperties);
+            return;
+        }
+        isFirstBlock = false;
+        yield block;
+    }
+}
+
+/*
+    Removes the head of the format (e.g. {"records":[ of the flow logs) from the decompressed data of a blob read from its
+    start, the task start is known once the first block is downloaded.
+ */
+async function* skipHeadBytes(blocks, task, headBytes) {
+    var toSkip = -1;
+    for await (const block of blocks) {
+        if (toSkip === -1) {
+            toSkip = task.startByte === 0 ? headBytes : 0;
+        }
+        if (toSkip >= block.length) {
+            toSkip -= block.length;
+            continue;
+        }
+        yield toSkip > 0 ? block.subarray(toSkip) : block;
+        toSkip = 0;
+    }
 }
 
-function getData(task, blockBlobClient, context) {
-    // Todo support for chunk reading(if range is large)
+/**
+ * Downloads the task range, compressed blobs are decompressed as the blocks are downloaded
+ * @param blobProperties - optional, see downloadBlocks
+ * @param format - optional format of the blob
+ */
+function readBlocks(task, blockBlobClient, context, blobProperties, format) {
+    if (!format || !format.compression) {
+        if (task.alignStart || task.alignEnd) {
+            return downloadAlignedBlocks(task, blockBlobClient, context, blobProperties);
+        }
+        return downloadBlocks(task, blockBlobClient, context, blobProperties);
+    }
+    var compression = format.compression;
+    var blocks = decompressBlocks(downloadCompressedBlocks(task, blockBlobClient, context, blobProperties, compression),
+        compression.createDecompressor());
+    return format.headBytes ? skipHeadBytes(blocks, task, format.headBytes) : blocks;
+}
+
+/**
+ * Downloads the task range as text
+ * @param blobProperties - optional object in which the etag, createdOn and contentLength of the response are set
+ * @param format - optional format of the blob, compressed blobs are decompressed
+ */
+function getData(task, blockBlobClient, context, blobProperties, format) {
     // valid offset status code 206 (Partial Content).
     // invalid offset status code 416 (Requested Range Not Satisfiable)
     //context.log("Inside get data function:");
     return new Promise(async function (resolve, reject) {
         try {
+            if (format && format.compression) {
+                // the size of the decompressed data is not known
+                var blocks = [];
+                for await (const block of readBlocks(task, blockBlobClient, context, blobProperties, format)) {
+                    blocks.push(block);
+                }
+                resolve(Buffer.concat(blocks).toString('utf8'));
+                return;
+            }
             var buffer = Buffer.alloc(task.endByte - task.startByte + 1);
-            await blockBlobClient.downloadToBuffer(buffer, task.startByte, (task.endByte - task.startByte + 1) , {
-            abortSignal: AbortController.timeout(30 * 60 * 1000),
-            blockSize: 4 * 1024 * 1024,
-            concurrency: 1
-            });
-            resolve(buffer.toString());
+            var bytesRead = 0;
+            for await (const block of downloadBlocks(task, blockBlobClient, context, blobProperties)) {
+                bytesRead += block.copy(buffer, bytesRead);
+            }
+            // the range is shorter than requested when it ends after the end of the blob
+            resolve(buffer.toString('utf8', 0, bytesRead));
         } catch (err) {
             reject(err);
         }
     })};
 
+/*
+    The credential and the clients are reused across invocations on a warm instance, the credential caches the access
+    tokens it acquires until they expire.
+ */
+function getContainerClient(task) {
+    if (!tokenCredential) {
+        tokenCredential = new DefaultAzureCredential();
+    }
+    return containerClients.getOrCreate(`https://${task.storageName}.blob.core.windows.net/${task.containerName}`, function (containerUrl) {
+        return new ContainerClient(containerUrl, tokenCredential);
+    });
+}
+
+function getServiceBusClient() {
+    if (!serviceBusClient) {
+        serviceBusClient = new ServiceBusClient(process.env.APPSETTING_TaskQueueConnectionString);
+    }
+    return serviceBusClient;
+}
+
 function getBlockBlobService(context, task) {
     return new Promise(function (resolve, reject) {
     try{
         //context.log("Inside Block Blob Service")
-        var tokenCredential = new DefaultAzureCredential();
-        var containerClient = new ContainerClient(
-            `https://${task.storageName}.blob.core.windows.net/${task.containerName}`,
-            tokenCredential
-        );
-        var blockBlobClient = containerClient.getBlockBlobClient(task.blobName);
+        var blockBlobClient = getContainerClient(task).getBlockBlobClient(task.blobName);
         resolve(blockBlobClient);
         } catch (err){
             reject(err);
         }
     })};
 
+/**
+ * Download and parse the task range, then send it using sumoClient
+ * @returns {Promise} - resolves with the delivery stats of sumoClient, or null when the invocation was already completed
+ */
 function messageHandler(serviceBusTask, context, sumoClient) {
-    var file_ext = serviceBusTask.blobName.split(".").pop();
-    if (file_ext == serviceBusTask.blobName) {
-        file_ext = "log";
-    }
-    var msghandler = {"log": logHandler, "csv": csvHandler, "json": jsonHandler, "blob": blobHandler, "nsg": nsgLogsHandler, "vnetflowlogs": networkFlowLogsHandler};
-    if (!(file_ext in msghandler)) {
-        context.log.error("Error in messageHandler: Unknown file extension - " + file_ext + " for blob: " + serviceBusTask.blobName);
+    var format = formatRegistry.getFormat(serviceBusTask);
+    var msghandler = {"json": jsonHandler};
+    // handlers which download and parse the range incrementally, only a few sub-ranges of the range are kept in memory
+    var streamhandler = {"log": logStreamHandler, "csv": csvStreamHandler, "blob": blobStreamHandler, "nsg": flowLogsHandler, "vnetflowlogs": flowLogsHandler};
+    if (!format || (!(format.name in msghandler) && !(format.name in streamhandler))) {
+        context.log.error("Error in messageHandler: Unknown file extension - " + getBlobExtension(serviceBusTask.blobName) + " for blob: " + serviceBusTask.blobName);
         context.done();
-        return;
+        return Promise.resolve(null);
     }
-    if ((file_ext === "json") && (serviceBusTask.containerName === "insights-logs-networksecuritygroupflowevent" || serviceBusTask.containerName === "insights-logs-flowlogflowevent")) {
+    if (format.headBytes !== undefined && !format.compression) {
         // because in json first block and last block remain as it is and azure service adds new block in 2nd last pos
-        if ((serviceBusTask.endByte < JSON_BLOB_HEAD_BYTES + JSON_BLOB_TAIL_BYTES) || (serviceBusTask.endByte == serviceBusTask.startByte)) {
+        if ((serviceBusTask.endByte < format.headBytes + format.tailBytes) || (serviceBusTask.endByte == serviceBusTask.startByte)) {
             context.done(); //rejecting first commit when no data is there data will always be atleast HEAD_BYTES+DATA_BYTES+TAIL_BYTES
-            return;
+            return Promise.resolve(null);
         }
-        serviceBusTask.endByte -= JSON_BLOB_TAIL_BYTES;
-        if (serviceBusTask.startByte <= JSON_BLOB_HEAD_BYTES + JSON_BLOB_TAIL_BYTES) {
-            serviceBusTask.startByte = JSON_BLOB_HEAD_BYTES;
+        serviceBusTask.endByte -= format.tailBytes;
+        if (serviceBusTask.startByte <= format.headBytes + format.tailBytes) {
+            serviceBusTask.startByte = format.headBytes;
         } else {
             serviceBusTask.startByte -= 1; //to remove comma before json object
         }
-        file_ext = serviceBusTask.containerName === "insights-logs-networksecuritygroupflowevent" ? "nsg" : "vnetflowlogs";
     }
-    getBlockBlobService(context, serviceBusTask).then(function (blobService) {
-        return getData(serviceBusTask, blobService, context).then(async function (msg) {
+    return getBlockBlobService(context, serviceBusTask).then(async function (blobService) {
+        if (format.name in streamhandler) {
+            await streamhandler[format.name](context, serviceBusTask, blobService, sumoClient, format);
             context.log("Sucessfully downloaded blob %s %d %d", serviceBusTask.blobName, serviceBusTask.startByte, serviceBusTask.endByte);
-            var messageArray;
-            if (file_ext === "csv") {
-                return getcsvHeader(serviceBusTask.containerName, serviceBusTask.blobName, blobService, context).then(function (headers) {
-                    context.log("Received headers %d", headers.length);
-                    messageArray = csvHandler(context,msg, headers);
-                    // context.log("Transformed data %s", JSON.stringify(messageArray));
-                    messageArray.forEach(function (msg) {
-                        sumoClient.addData(msg);
-                    });
-                    sumoClient.flushAll();
-                }).catch(function (err) {
-                    context.log.error("Error in creating json from csv.");
-                    context.done(err);
-                });
-            } else {
-                if (file_ext === "nsg" || file_ext === "vnetflowlogs") {
-                    messageArray = await msghandler[file_ext](context, msg, serviceBusTask);
-                } else {
-                    messageArray = msghandler[file_ext](context, msg);
-                }
-                messageArray.forEach(function (msg) {
-                    sumoClient.addData(msg);
-                });
-                sumoClient.flushAll();
-            }
+            return sumoClient.flushAll();
+        }
+        return getData(serviceBusTask, blobService, context, null, format).then(function (msg) {
+            context.log("Sucessfully downloaded blob %s %d %d", serviceBusTask.blobName, serviceBusTask.startByte, serviceBusTask.endByte);
+            var messageArray = msghandler[format.name](context, msg);
+            messageArray.forEach(function (msg) {
+                sumoClient.addData(msg);
+            });
+            return sumoClient.flushAll();
         });
     }).catch(function (err) {
         if(err.statusCode === 404) {
@@ -464,6 +476,7 @@ function messageHandler(serviceBusTask, context, sumoClient) {
             context.log.error("Error in messageHandler: Failed to send blob " + serviceBusTask.blobName + " " + serviceBusTask.startByte + " " +serviceBusTask.endByte + " err: " + err);
             context.done(err);
         }
+        return null;
 
     });
 }
@@ -524,113 +537,202 @@ function servicebushandler(context, serviceBusTask) {
         MaxAttempts: 3,
         RetryInterval: 3000,
         compress_data: true,
+        // large blob ranges are sent as ~1MB requests instead of a single request per bucket
+        streaming_flush: true,
+        // start sending while the rest of the range is still being added
+        max_bucket_bytes: 4 * 1024 * 1024,
         clientHeader: "blobreader-azure-function"
     };
     setSourceCategory(serviceBusTask, options);
     function failureHandler(msgArray, ctx) {
         ctx.log.error(`Failed to send to Sumo`);
-        if (sumoClient.messagesAttempted === sumoClient.messagesReceived) {
-            ctx.done("TaskConsumer failedmessages: " + sumoClient.messagesFailed);
+    }
+
+    sumoClient = new sumoHttp.SumoClient(options, context, failureHandler);
+    //context.log("Reached inside ServiceBus Handler")
+    messageHandler(serviceBusTask, context, sumoClient).then(function (stats) {
+        if (!stats) {
+            return;
+        }
+        if (stats.messagesFailed > 0) {
+            context.log.error(`Failed to send few messages to Sumo`)
+            context.done("TaskConsumer failedmessages: " + stats.messagesFailed);
+        } else {
+            context.log(`Successfully sent to Sumo, Exiting now.`);
+            context.done();
+        }
+    });
+
+}
+
+/*
+    Context of a dead-lettered task processed along with others in the same invocation: messageHandler ends the task
+    with done() instead of the invocation, the outcome is kept in taskContext.error.
+ */
+function createTaskContext(context) {
+    var taskContext = Object.create(context);
+    taskContext.error = null;
+    taskContext.done = function (err) {
+        taskContext.error = err || null;
+    };
+    return taskContext;
+}
+
+function dlqFailureHandler(msgArray, ctx) {
+    ctx.log.error("Failed to send to Sumo");
+}
+
+/*
+    Resends a dead-lettered task and settles its message: completed once sent, or when it cannot succeed (unknown
+    extension, empty range, deleted blob), abandoned otherwise so that it is received again by a later run.
+    Resolves with "completed", "abandoned" or "unsettled" (the settlement failed, the lock expires).
+ */
+async function processDLQMessage(context, queueReceiver, message, sendScheduler) {
+    var serviceBusTask = JSON.parse(JSON.stringify(message.body));
+    var options = {
+        urlString: process.env.APPSETTING_SumoLogEndpoint,
+        MaxAttempts: 3,
+        RetryInterval: 3000,
+        compress_data: true,
+        // large blob ranges are sent as ~1MB requests instead of a single request per bucket
+        streaming_flush: true,
+        // the requests of the tasks processed concurrently share the same limit
+        send_scheduler: sendScheduler,
+        clientHeader: "dlqblobreader-azure-function"
+    };
+    setSourceCategory(serviceBusTask, options);
+    var taskContext = createTaskContext(context);
+    var sumoClient = new sumoHttp.SumoClient(options, taskContext, dlqFailureHandler);
+    var failed;
+    try {
+        var stats = await messageHandler(serviceBusTask, taskContext, sumoClient);
+        failed = stats ? stats.messagesFailed > 0 : taskContext.error !== null;
+    } catch (err) {
+        context.log.error(`Error in processing DLQ task: ${serviceBusTask.blobName} err: ${err}`);
+        failed = true;
+    }
+    if (failed) {
+        context.log.error(`Failed to send DLQ task: ${serviceBusTask.blobName} ${serviceBusTask.startByte} ${serviceBusTask.endByte}`);
+    }
+    return settleDLQMessage(context, queueReceiver, message, failed);
+}
+
+async function settleDLQMessage(context, queueReceiver, message, failed) {
+    try {
+        if (failed) {
+            await queueReceiver.abandonMessage(message);
+            return "abandoned";
         }
+        await queueReceiver.completeMessage(message);
+        return "completed";
+    } catch (err) {
+        context.log.error(`Failed to settle message in DLQ. error: ${err}`);
+        return "unsettled";
     }
-    function successHandler(ctx) {
-        if (sumoClient.messagesAttempted === sumoClient.messagesReceived) {
-            if (sumoClient.messagesFailed > 0) {
-                ctx.log.error(`Failed to send few messages to Sumo`)
-                ctx.done("TaskConsumer failedmessages: " + sumoClient.messagesFailed);
+}
+
+/*
+    Processes the messages with up to concurrency of them in flight, adds the outcome of each message to counts.
+    An abandoned message goes back to the dead letter queue, the sequence numbers of the ones abandoned in the run are
+    added to abandoned and they are abandoned again without being sent ("skipped") when they are received again.
+ */
+async function processDLQBatch(context, queueReceiver, messages, sendScheduler, concurrency, counts, abandoned) {
+    var next = 0;
+    async function worker() {
+        while (next < messages.length) {
+            var message = messages[next];
+            next += 1;
+            var sequenceNumber = String(message.sequenceNumber);
+            var outcome;
+            if (abandoned.has(sequenceNumber)) {
+                outcome = await settleDLQMessage(context, queueReceiver, message, true);
+                outcome = outcome === "abandoned" ? "skipped" : outcome;
             } else {
-                ctx.log(`Successfully sent to Sumo, Exiting now.`);
-                ctx.done();
+                outcome = await processDLQMessage(context, queueReceiver, message, sendScheduler);
+                if (outcome === "abandoned") {
+                    abandoned.add(sequenceNumber);
+                }
             }
+            counts[outcome] += 1;
         }
     }
-
-    sumoClient = new sumoHttp.SumoClient(options, context, failureHandler, successHandler);
-    //context.log("Reached inside ServiceBus Handler")
-    messageHandler(serviceBusTask, context, sumoClient);
-
+    var workers = [];
+    for (var i = 0; i < Math.min(concurrency, messages.length); i++) {
+        workers.push(worker());
+    }
+    await Promise.all(workers);
 }
 
+/*
+    Drains the dead letter queue: batches of DLQBatchSize messages are received and processed by DLQConcurrency workers
+    until the queue is empty or DLQTimeBudgetMs is spent, so that a backlog left by an outage is drained in a few runs
+    instead of one task per run. The run stops as well when no message of a batch is completed, e.g. while Sumo is
+    down, instead of receiving and resending the same messages until the time budget is spent.
+ */
 async function timetriggerhandler(context, timetrigger) {
 
     if (timetrigger.isPastDue) {
         context.log("timetriggerhandler running late");
     }
+    var startTime = Date.now();
     try{
-        var sbClient = new ServiceBusClient(process.env.APPSETTING_TaskQueueConnectionString);
-        var queueReceiver = sbClient.createReceiver(process.env.APPSETTING_TASKQUEUE_NAME,{ subQueueType: "deadLetter", receiveMode: "peekLock" });
+        var queueReceiver = getServiceBusClient().createReceiver(process.env.APPSETTING_TASKQUEUE_NAME, {
+            subQueueType: "deadLetter",
+            receiveMode: "peekLock",
+            // messages waiting for a worker keep their lock until the run ends
+            maxAutoLockRenewalDurationInMs: DLQ_TIME_BUDGET_MS + DLQ_LOCK_RENEWAL_MARGIN_MS
+        });
     }catch(err){
         context.log.error("Failed to create service bus client and receiver");
         context.done(err);
         return;
     }
+    // the Sumo requests of all the tasks of the run share the same concurrency limit
+    var sendScheduler = new SendScheduler(DLQ_MAX_CONCURRENT_REQUESTS);
+    var counts = {received: 0, batches: 0, completed: 0, abandoned: 0, skipped: 0, unsettled: 0};
+    // sequence numbers of the messages abandoned in the run
+    var abandoned = new Set();
+    var error = null;
     try {
-        var messages = await queueReceiver.receiveMessages(1, {
-            maxWaitTimeInMs: 60 * 1000,
-        });
-        if (!messages.length) {
-            context.log("No more messages to receive");
-            await queueReceiver.close();
-            await sbClient.close();
-            context.done();
-            return;
-        }
-        var myJSON = JSON.stringify(messages[0].body);
-        var serviceBusTask = JSON.parse(myJSON);
-        // Message received and locked and try to resend
-        var options = {
-            urlString: process.env.APPSETTING_SumoLogEndpoint,
-            MaxAttempts: 3,
-            RetryInterval: 3000,
-            compress_data: true,
-            clientHeader: "dlqblobreader-azure-function"
-        };
-        setSourceCategory(serviceBusTask, options);
-        var sumoClient;
-        async function failureHandler(msgArray, ctx) {
-            ctx.log.error("Failed to send to Sumo");
-            if (sumoClient.messagesAttempted === sumoClient.messagesReceived) {
-                await queueReceiver.close();
-                await sbClient.close();
-                ctx.done("TaskConsumer failedmessages: " + sumoClient.messagesFailed);
+        var maxWaitTimeInMs = DLQ_FIRST_WAIT_MS;
+        while (Date.now() - startTime < DLQ_TIME_BUDGET_MS) {
+            var messages = await queueReceiver.receiveMessages(DLQ_BATCH_SIZE, {
+                maxWaitTimeInMs: maxWaitTimeInMs
+            });
+            if (!messages.length) {
+                context.log("No more messages to receive");
+                break;
             }
-        }
-        async function successHandler(ctx) {
-            if (sumoClient.messagesAttempted === sumoClient.messagesReceived) {
-                //TODO: Test Scenario for combination of successful and failed requests
-                if (sumoClient.messagesFailed > 0) {
-                    await queueReceiver.close();
-                    await sbClient.close();
-                    ctx.log.error('Failed to send few messages to Sumo')
-                    ctx.done("DLQTaskConsumer failedmessages: " + sumoClient.messagesFailed);
-                } else {
-                    ctx.log('Successfully sent to Sumo, Exiting now.');
-                    try{
-                        await queueReceiver.completeMessage(messages[0]);
-                        ctx.log("Successfully deleted message from DLQ.");
-                    } catch(err){
-                        ctx.log.error(`Failed to delete message from DLQ. error: ${error}`);
-                    }
-                    await queueReceiver.close();
-                    await sbClient.close();
-                    ctx.done();
-                }
+            counts.received += messages.length;
+            counts.batches += 1;
+            var completed = counts.completed;
+            await processDLQBatch(context, queueReceiver, messages, sendScheduler, DLQ_CONCURRENCY, counts, abandoned);
+            if (counts.completed === completed) {
+                context.log("No message of the batch was completed, the remaining messages are left for the next run");
+                break;
             }
+            // the following batches are only the messages already in the queue
+            maxWaitTimeInMs = DLQ_NEXT_WAIT_MS;
         }
-        sumoClient = new sumoHttp.SumoClient(options, context, failureHandler, successHandler);
-        messageHandler(serviceBusTask, context, sumoClient);
-      } catch(error){
+    } catch(err){
+        context.log.error("Error in reading messages from DLQ");
+        error = err;
+    }
+    try {
         await queueReceiver.close();
-        await sbClient.close();
-        if (typeof error === 'string' && new RegExp("\\b" + "No messages" + "\\b", "gi").test(error)) {
-            context.log.error(error);
-            context.done();
-        } else {
-            context.log.error("Error in reading messages from DLQ");
-            context.done(error);
-        }
-      }
+    } catch (err) {
+        context.log.error(`Failed to close DLQ receiver. error: ${err}`);
+    }
+    var seconds = (Date.now() - startTime) / 1000;
+    context.log(`DLQ drained: received ${counts.received} in ${counts.batches} batches, completed ${counts.completed}, abandoned ${counts.abandoned}, skipped ${counts.skipped}, unsettled ${counts.unsettled} in ${seconds.toFixed(1)}s (${(counts.completed / seconds).toFixed(2)} tasks/sec)`);
+    if (error) {
+        context.done(error);
+    } else if (counts.abandoned > 0) {
+        context.done("DLQTaskConsumer failedtasks: " + counts.abandoned);
+    } else {
+        context.done();
     }
+}
 
 module.exports = function (context, triggerData) {
     // triggerData = {
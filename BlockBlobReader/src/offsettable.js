@@ -0,0 +1,149 @@
+/*jshint esversion: 6 */
+/*
+    Access to the offsets of the blobs in the FileOffsetMap table. The entities of the blobs of a container (the
+    partition) are read with filtered queries and written back with entity group transactions, instead of a request per
+    blob. The offsets are updated with optimistic concurrency: an entity read is replaced only if its ETag did not change,
+    a new entity is created only if no other invocation created it meanwhile.
+ */
+
+var { odata } = require("@azure/data-tables");
+
+// the table service allows at most 15 comparisons in a filter, one is used by the partition key
+var MAX_FILTER_ROW_KEYS = 14;
+// an entity group transaction is limited to 100 entities of the same partition
+var MAX_TRANSACTION_ENTITIES = 100;
+
+function isTableNotFound(err) {
+    return err.statusCode === 404 && (err.code === "TableNotFound" || JSON.stringify(err).includes("TableNotFound"));
+}
+
+/**
+ * @param entity - entity read from the table
+ * @returns {number} - the offset saved in the entity
+ */
+function getOffset(entity) {
+    // Int64 values are returned either as strings or as typed values
+    return Number(entity.offset !== null && typeof entity.offset === "object" ? entity.offset.value : entity.offset);
+}
+
+async function queryEntities(tableClient, partitionKey, rowKeys, entities) {
+    var rowKeyFilter = rowKeys.map(function (rowKey) {
+        return odata`RowKey eq ${rowKey}`;
+    }).join(" or ");
+    var iterator = tableClient.listEntities({
+        queryOptions: { filter: odata`PartitionKey eq ${partitionKey}` + " and (" + rowKeyFilter + ")" }
+    });
+    for await (const entity of iterator) {
+        entities.set(entity.rowKey, entity);
+    }
+}
+
+/**
+ * Reads the entities of the rowKeys of a partition, the table is created if it does not exist
+ * @returns {Promise<Map>} - entities by rowKey, the rowKeys without entity are not in the map
+ */
+async function readOffsetEntities(tableClient, partitionKey, rowKeys, context) {
+    var entities = new Map();
+    var queries = [];
+    for (var i = 0; i < rowKeys.length; i += MAX_FILTER_ROW_KEYS) {
+        queries.push(queryEntities(tableClient, partitionKey, rowKeys.slice(i, i + MAX_FILTER_ROW_KEYS), entities));
+    }
+    try {
+        await Promise.all(queries);
+    } catch (err) {
+        if (!isTableNotFound(err)) {
+            throw err;
+        }
+        context.log(`Creating table in storage account: ${process.env.TABLE_NAME}`);
+        try {
+            await tableClient.createTable();
+        } catch (createErr) {
+            // created by another invocation, failures surface when the entities are written
+            context.log(`Failed to create table error: ${JSON.stringify(createErr)}`);
+        }
+        entities.clear();
+    }
+    return entities;
+}
+
+/*
+    Returns the position in the transaction of the entity which failed it, the error message of a transaction starts
+    with it e.g. "1:The update condition specified in the request was not satisfied.", -1 if it is not found
+ */
+function getFailedIndex(err) {
+    var message = (err.details && err.details.odataError && err.details.odataError.message) || err.message || "";
+    var match = /^(\d+):/.exec(typeof message === "string" ? message : String(message.value || ""));
+    return match ? Number(match[1]) : -1;
+}
+
+function getAction(write) {
+    if (write.etag) {
+        return ["update", write.entity, "Replace", { etag: write.etag }];
+    }
+    return ["create", write.entity];
+}
+
+function addFailure(result, write, err) {
+    var rowKey = write.entity.rowKey;
+    // 412: updated, 409: created, 404: deleted since it was read
+    if (err.statusCode === 412 || err.statusCode === 409 || err.statusCode === 404) {
+        result.conflicts.push(rowKey);
+    } else {
+        result.failed.push({ rowKey: rowKey, error: err });
+    }
+}
+
+/*
+    A transaction is atomic, the entity failing it is removed and the transaction is submitted again with the others
+ */
+async function submitTransaction(tableClient, writes, result) {
+    var remaining = writes.slice();
+    while (remaining.length > 0) {
+        try {
+            var response = await tableClient.submitTransaction(remaining.map(getAction));
+            remaining.forEach(function (write) {
+                result.written.push(write.entity.rowKey);
+            });
+            ((response && response.subResponses) || []).forEach(function (subResponse) {
+                if (subResponse.rowKey !== undefined && subResponse.etag) {
+                    result.etags[subResponse.rowKey] = subResponse.etag;
+                }
+            });
+            return;
+        } catch (err) {
+            var index = remaining.length === 1 ? 0 : getFailedIndex(err);
+            if (index < 0 || index >= remaining.length) {
+                // the entity failing the transaction is not known, each entity is written on its own
+                for (const write of remaining) {
+                    await submitTransaction(tableClient, [write], result);
+                }
+                return;
+            }
+            addFailure(result, remaining[index], err);
+            remaining.splice(index, 1);
+        }
+    }
+}
+
+/**
+ * Writes the entities of a partition with transactions of up to MAX_TRANSACTION_ENTITIES entities
+ * @param writes - array of {entity, etag}, the entity is replaced if etag is set, otherwise it is created
+ * @returns {Promise<{written: Array, etags: Object, conflicts: Array, failed: Array}>} - rowKeys written, new ETags of
+ * the entities written by rowKey, rowKeys whose entity was changed by another invocation since it was read and
+ * {rowKey, error} of the other failures
+ */
+async function writeOffsetEntities(tableClient, writes) {
+    var result = { written: [], etags: {}, conflicts: [], failed: [] };
+    var transactions = [];
+    for (var i = 0; i < writes.length; i += MAX_TRANSACTION_ENTITIES) {
+        transactions.push(submitTransaction(tableClient, writes.slice(i, i + MAX_TRANSACTION_ENTITIES), result));
+    }
+    await Promise.all(transactions);
+    return result;
+}
+
+module.exports = {
+    getOffset: getOffset,
+    readOffsetEntities: readOffsetEntities,
+    writeOffsetEntities: writeOffsetEntities
+};
@@ -3,10 +3,27 @@
 ///////////////////////////////////////////////////////////////////////////////////
 
 var sumoutils = require('./sumoutils.js');
+var { defaultRegistry: formatRegistry, getBlobExtension } = require('./formatregistry.js');
+var { getOffset, readOffsetEntities, writeOffsetEntities } = require('./offsettable.js');
+var { getNewTask, getNewCompressedTask } = require('./taskplanner.js');
+var { LRUCache } = require('./lrucache.js');
 var { TableClient } = require("@azure/data-tables");
 var tableClient = TableClient.fromConnectionString(process.env.APPSETTING_AzureWebJobsStorage,process.env.APPSETTING_TABLE_NAME);
 const MaxAttempts = 3
 const RetryInterval = 3000
+// size of the ranges of the tasks, see taskplanner.getNewTask
+const TaskRangeTargetBytes = Number(process.env.APPSETTING_TaskRangeTargetBytes) || 32 * 1024 * 1024;
+// offsets and ETags of the entities read or written recently, keyed by rowKey. A blob in the cache is planned from the
+// cached offset without reading its entity, the write is conditional on the cached ETag so that a stale entry fails
+// with 412 and the entity is read again.
+const offsetCache = new LRUCache(10000, 10 * 60 * 1000);
+// 409/412 mean that another invocation created or updated the row concurrently, retrying re-reads the offset
+const retryPolicy = new sumoutils.RetryPolicy({
+    maxAttempts: MaxAttempts,
+    baseDelay: RetryInterval,
+    timeBudget: 2 * 60 * 1000,
+    retryableStatusCodes: [409, 412]
+});
 
 function getRowKey(metadata) {
     var storageName =  metadata.url.split("//").pop().split(".")[0];
@@ -35,7 +52,7 @@ function getBlobMetadata(message) {
     };
 }
 
-function getEntity(metadata, endByte, currentEtag) {
+function getEntity(metadata, endByte) {
      //a single entity group transaction is limited to 100 entities. Also, the entire payload of the transaction may not exceed 4MB
     // rowKey/partitionKey cannot contain "/"
     var entity = {
@@ -47,11 +64,6 @@ function getEntity(metadata, endByte, currentEtag) {
         offset: { type: "Int64", value: String(endByte) },
         date: (new Date()).toISOString()
     };
-    if (currentEtag) {
-        entity['options'] = {
-            ifMatch: currentEtag, // Replace with the current ETag value of the entity
-          };
-    }
     return entity;
 }
 
@@ -64,111 +76,113 @@ function getContentLengthPerBlob(eventHubMessages, allcontentlengths, metadatama
     });
 }
 
-async function getBlobPointerMap(partitionKey, rowKey, context) {
-    // Todo Add retries for node migration in cases of timeouts(non 400 & 500 errors)
-    var statusCode = 200;
-    var entity;
-    try {
-        entity = await tableClient.getEntity(partitionKey, rowKey);
-        //context.log("retreived existing rowkey: " + rowKey)
-    } catch(err) {
+/**
+ * @returns {Array} - [tasks, lastoffset] the tasks reading the blob after currentoffset and the offset to save
+ */
+function planTasks(currentoffset, contentlengths, metadata) {
+    var format = formatRegistry.getFormat(metadata);
+    if (format && format.compression) {
+        return getNewCompressedTask(currentoffset, contentlengths, metadata);
+    }
+    return getNewTask(currentoffset, contentlengths, metadata, format, TaskRangeTargetBytes);
+}
 
-        if ((err.statusCode === 404) && JSON.stringify(err).includes("TableNotFound")) {
-            try {
-                context.log(`Creating table in storage account: ${process.env.TABLE_NAME}`);
-                await tableClient.createTable();
-                await new Promise(resolve => setTimeout(resolve, 10000)); // 10 second wait for the table to be created
-            } catch(err) {
-                context.log(`Failed to create table for rowKey: ${rowKey} error: ${JSON.stringify(err)}`);
+/*
+    Creates the tasks of the blobs of a container: the offsets of the blobs are read and written back in batches, and
+    the tasks of a blob are only created once its new offset is saved. The blobs whose offset was changed by another
+    invocation in the meantime are planned again from the new offset, up to MaxAttempts times.
+    Resolves with a response per blob with new tasks, failed responses carry the offsets of the tasks which could not be
+    saved.
+ */
+async function createTasksForPartition(partitionKey, rowKeys, allcontentlengths, metadatamap, context) {
+    var responses = [];
+    var pending = rowKeys;
+    var offsets = {};
+    for (var attempt = 1; pending.length > 0; attempt += 1) {
+        var lastError = null;
+        var retry = [];
+        try {
+            var entities = new Map();
+            var toRead = [];
+            pending.forEach(function (rowKey) {
+                var cached = offsetCache.get(rowKey);
+                if (cached) {
+                    entities.set(rowKey, cached);
+                } else {
+                    toRead.push(rowKey);
+                }
+            });
+            if (toRead.length > 0) {
+                (await readOffsetEntities(tableClient, partitionKey, toRead, context)).forEach(function (entity, rowKey) {
+                    entities.set(rowKey, entity);
+                    offsetCache.set(rowKey, {offset: getOffset(entity), etag: entity.etag});
+                });
+            }
+            var writes = [];
+            var plans = {};
+            pending.forEach(function (rowKey) {
+                var entity = entities.get(rowKey);
+                var currentoffset = entity ? getOffset(entity) : -1;
+                var [tasks, lastoffset] = planTasks(currentoffset, allcontentlengths[rowKey], metadatamap[rowKey]);
+                offsets[rowKey] = {currentoffset: currentoffset, lastoffset: lastoffset};
+                if (tasks.length > 0) { // modify offset only when it's been changed
+                    plans[rowKey] = tasks;
+                    writes.push({entity: getEntity(metadatamap[rowKey], lastoffset), etag: entity ? entity.etag : null});
+                }
+            });
+            var result = await writeOffsetEntities(tableClient, writes);
+            result.written.forEach(function (rowKey) {
+                if (result.etags[rowKey]) {
+                    offsetCache.set(rowKey, {offset: offsets[rowKey].lastoffset, etag: result.etags[rowKey]});
+                } else {
+                    offsetCache.delete(rowKey);
+                }
+                context.bindings.tasks = context.bindings.tasks.concat(plans[rowKey]);
+                responses.push({status: "success", rowKey: rowKey, message: plans[rowKey].length + " Tasks added for rowKey: " + rowKey});
+            });
+            result.conflicts.forEach(function (rowKey) {
+                context.log.verbose("Need to Retry: " + rowKey);
+                offsetCache.delete(rowKey);
+                retry.push(rowKey);
+            });
+            result.failed.forEach(function (failure) {
+                lastError = failure.error;
+                offsetCache.delete(failure.rowKey);
+                if (retryPolicy.isRetryable(failure.error)) {
+                    retry.push(failure.rowKey);
+                } else {
+                    responses.push(getFailedResponse(failure.rowKey, "Unable to Update offset", failure.error, offsets[failure.rowKey]));
+                }
+            });
+        } catch (err) {
+            // unable to retrieve offsets, hence ingesting whole files from starting byte if the retries fail
+            lastError = err;
+            pending.forEach(function (rowKey) {
+                offsets[rowKey] = {currentoffset: -1, lastoffset: Math.max.apply(null, allcontentlengths[rowKey]) - 1};
+            });
+            retry = retryPolicy.isRetryable(err) ? pending : [];
+            if (retry.length === 0) {
+                pending.forEach(function (rowKey) {
+                    responses.push(getFailedResponse(rowKey, "Unable to Retrieve offset", err, offsets[rowKey]));
+                });
             }
         }
-        // err object keys : [ 'name', 'code', 'statusCode', 'request', 'response', 'details' ]
-        if(err.statusCode === 404) {
-            //context.log("no existing row found, new file scenario for rowkey: " + rowKey)
-            statusCode = 404;
-        } else {
-            throw err;
+        if (retry.length > 0 && attempt >= MaxAttempts) {
+            retry.forEach(function (rowKey) {
+                responses.push(getFailedResponse(rowKey, "Unable to Update offset", lastError || "update condition not satisfied", offsets[rowKey]));
+            });
+            retry = [];
         }
-    }
-    //context.log({statusCode: statusCode, entity: entity});
-    return {statusCode: statusCode, entity: entity};
-}
-
-async function updateBlobPointerMap(entity, context) {
-    let response;
-    if(entity.options){
-        let options = entity.options;
-        delete entity.options;
-        response = await tableClient.updateEntity(entity,"Replace",options)
-    }else{
-        response = await tableClient.createEntity(entity)
-    }
-    return response;
-}
-
-function getNewTask(currentoffset,sortedcontentlengths,metadata){
-    var tasks = [];
-    var lastoffset = currentoffset;
-    var i, endByte, task;
-    for (i = 0; i < sortedcontentlengths.length; i += 1) {
-        endByte = sortedcontentlengths[i] - 1;
-        if (endByte > lastoffset) {
-            // this will remove duplicate contentlengths
-            // to specify a range encompassing the first 512 bytes of a blob use x-ms-range: bytes=0-511  contentLength = 512
-            // saving in offset: 511 endByte
-            task = Object.assign({
-                startByte: lastoffset + 1,
-                endByte: endByte
-            }, metadata);
-            tasks.push(task);
-            lastoffset = endByte;
+        if (retry.length > 0) {
+            await sumoutils.p_wait(retryPolicy.getDelay(attempt, lastError));
         }
+        pending = retry;
     }
-    if (tasks.length === 0 && sortedcontentlengths.length > 0  && endByte < currentoffset) {
-        // in NSG Flow logs sometimes file gets rewritten, hence starting the file from the beginning
-        task = Object.assign({
-            startByte: 0,
-            endByte: endByte
-        }, metadata);
-        tasks.push(task);
-        lastoffset = endByte;
-    }
-    return [tasks,lastoffset];
+    return responses;
 }
 
-async function createTasksForBlob(partitionKey, rowKey, sortedcontentlengths, context, metadata) {
-    //context.log("inside createTasksForBlob", partitionKey, rowKey, sortedcontentlengths, metadata);
-    if (sortedcontentlengths.length === 0) {
-        return Promise.resolve({status: "success", message: "No tasks created for rowKey: " + rowKey});
-    }
-    try{
-        var retrievedResponse = await getBlobPointerMap(partitionKey, rowKey, context);
-        //context.log("retrieved blob pointer successsfully for rowkey: " + rowKey + " response: "+ retrievedResponse)
-    }catch(err){
-       // unable to retrieve offset, hence ingesting whole file from starting byte
-       let lastoffset = sortedcontentlengths[sortedcontentlengths.length - 1] - 1;
-       return Promise.reject({status: "failed", rowKey: rowKey, message: "Unable to Retrieve offset for rowKey: " + rowKey + " Error: " + err, lastoffset : lastoffset, currentoffset: -1});
-    }
-    var currentoffset = retrievedResponse.statusCode === 404 ? -1 : Number(retrievedResponse.entity.offset);
-    var currentEtag = retrievedResponse.statusCode === 404 ? null : retrievedResponse.entity.etag;
-    var [tasks,lastoffset] = getNewTask(currentoffset, sortedcontentlengths, metadata);
-
-    if (tasks.length > 0) { // modify offset only when it's been changed
-        var entity = getEntity(metadata, lastoffset, currentEtag);
-        try{
-            var updatedResponse = await updateBlobPointerMap(entity, context);
-            //context.log("updated blob pointer successsfully for rowkey: " + rowKey + " response: "+ updatedResponse)
-            context.bindings.tasks = context.bindings.tasks.concat(tasks);
-            return Promise.resolve({status: "success",rowKey: rowKey, message: tasks.length + " Tasks added for rowKey: " + rowKey});
-        }catch(err){
-            if (err && err.details && err.details.odataError && err.details.odataError.code === "UpdateConditionNotSatisfied" && err.statusCode === 412) {
-                context.log.verbose("Need to Retry: " + rowKey);
-            }
-            return Promise.reject({status: "failed",rowKey: rowKey, message: "Unable to Update offset for rowKey: " + rowKey + " Error: " + err, lastoffset : lastoffset, currentoffset: currentoffset});
-        }
-    } else {
-        return Promise.resolve({status: "success",rowKey: rowKey, message: "No tasks created for rowKey: " + rowKey});
-    }
+function getFailedResponse(rowKey, reason, err, offsets) {
+    return {status: "failed", rowKey: rowKey, message: reason + " for rowKey: " + rowKey + " Error: " + err, lastoffset: offsets.lastoffset, currentoffset: offsets.currentoffset, statusCode: err.statusCode, code: err.code};
 }
 
 /**
@@ -193,21 +207,14 @@ function filterBlockBlob(messages) {
  * @returns {Array<Object>} - An array containing only the messages with supported file extensions.
  */
 function filterByFileExtension(context, messages) {
-    // List of supported file extensions
-    var supportedExtensions = ['log', 'csv', 'json', 'blob', 'txt'];
-
-    // Use Array.prototype.filter to filter messages based on extension
+    // Use Array.prototype.filter to keep the messages of the blobs in a format supported by the consumer
     return messages.filter(message => {
-        // Extract file extension from message subject
-        let fileExtension = message.subject.split(".").pop();
-
         // If no extension found
-        if (fileExtension == message.subject) {
+        if (getBlobExtension(message.subject) === "") {
             context.log.verbose("Found file with no extension, accepting blockblob file as log file")
         }
 
-        // Return true if the message's extension is in the list of supported extensions
-        return fileExtension == message.subject || supportedExtensions.includes(fileExtension);
+        return formatRegistry.isSupportedBlob(message.subject);
     });
 }
 
@@ -224,39 +231,32 @@ module.exports = async function (context, eventHubMessages) {
             var metadatamap = {};
             var allcontentlengths = {};
             getContentLengthPerBlob(filterMessages, allcontentlengths, metadatamap);
-            var processed = 0;
             context.bindings.tasks = [];
-            var allRowPromises = [];
-            var totalRows = Object.keys(allcontentlengths).length;
             var errArr = [], rowKey;
+            // rowKeys grouped by partitionKey, the offsets of a partition are read and written together
+            var partitions = {};
             for (rowKey in allcontentlengths) {
-                var sortedcontentlengths = allcontentlengths[rowKey].sort(); // ensuring increasing order of contentlengths
-                var metadata = metadatamap[rowKey];
-                var partitionKey = metadata.containerName;
-                allRowPromises.push(sumoutils.p_retryMax(createTasksForBlob,MaxAttempts,RetryInterval,[partitionKey, rowKey, sortedcontentlengths, context, metadata], context).catch((err) => err));
+                var partitionKey = metadatamap[rowKey].containerName;
+                (partitions[partitionKey] || (partitions[partitionKey] = [])).push(rowKey);
             }
-            await Promise.all(allRowPromises).then((responseValues) => {
-                    //creating duplicate task for file causing an error when update condition is not satisfied in mutiple read and write scenarios for same row key in fileOffSetMap table
-                    for (let response of responseValues){
-                        processed += 1;
-                        if(response.status === "failed"){
-                            context.log.verbose("creating duplicate task since retry failed for rowkey: " + response.rowKey);
-                            var duplicateTask = Object.assign({
-                                startByte: response.currentoffset + 1,
-                                endByte: response.lastoffset
-                            }, metadatamap[response.rowKey]);
-                            context.bindings.tasks = context.bindings.tasks.concat([duplicateTask]);
-                            errArr.push(response.message);
-                        }
-                    }
+            var allPartitionPromises = Object.keys(partitions).map(function (partitionKey) {
+                return createTasksForPartition(partitionKey, partitions[partitionKey], allcontentlengths, metadatamap, context);
             });
-            if (totalRows === processed) {
-                context.log("Tasks Created: " + JSON.stringify(context.bindings.tasks) + " Blobpaths: " + JSON.stringify(allcontentlengths));
-                if (errArr.length > 0) {
-                    context.log.error(errArr.join('\n'));
+            var responseValues = [].concat.apply([], await Promise.all(allPartitionPromises));
+            //creating duplicate task for file causing an error when update condition is not satisfied in mutiple read and write scenarios for same row key in fileOffSetMap table
+            for (let response of responseValues){
+                if(response.status === "failed"){
+                    context.log.verbose("creating duplicate task since retry failed for rowkey: " + response.rowKey);
+                    var [duplicateTasks] = planTasks(response.currentoffset, [response.lastoffset + 1], metadatamap[response.rowKey]);
+                    context.bindings.tasks = context.bindings.tasks.concat(duplicateTasks);
+                    errArr.push(response.message);
                 }
-                context.done();
             }
+            context.log("Tasks Created: " + JSON.stringify(context.bindings.tasks) + " Blobpaths: " + JSON.stringify(allcontentlengths));
+            if (errArr.length > 0) {
+                context.log.error(errArr.join('\n'));
+            }
+            context.done();
         } else {
             context.log(`eventHubMessages might not pertain to blockblob or files with supported extensions, Exit now!`);
             context.done();
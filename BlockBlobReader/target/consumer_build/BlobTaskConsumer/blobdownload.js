@@ -0,0 +1,151 @@
+/*jshint esversion: 6 */
+/*
+    Ranged downloads of the task ranges of the blobs, as sub-ranges downloaded in parallel and yielded in order.
+ */
+
+var { AbortController } = require("@azure/abort-controller");
+
+// task ranges are downloaded as sub-ranges of DOWNLOAD_BLOCK_SIZE bytes, DOWNLOAD_CONCURRENCY of them in parallel
+var DOWNLOAD_BLOCK_SIZE = 4 * 1024 * 1024;
+var DOWNLOAD_CONCURRENCY = 4;
+// max bytes of the sub-ranges being downloaded for a task, the block size is reduced to stay below it
+var MAX_DOWNLOAD_BUFFER_BYTES = 16 * 1024 * 1024;
+// bytes read at a time after the end of a range to complete its last line, see downloadAlignedBlocks
+var ALIGN_READ_BYTES = 64 * 1024;
+var LINE_BREAK = 0x0a;
+
+/**
+ * Splits the task range into sub-ranges downloaded in parallel, the block size is reduced so that at most
+ * maxBufferedBytes are downloaded at once.
+ * @param options - optional blockSize, concurrency and maxBufferedBytes
+ * @returns {{ranges: Array, concurrency: number}}
+ */
+function getDownloadPlan(task, options) {
+    options = options || {};
+    var concurrency = Math.max(1, options.concurrency || DOWNLOAD_CONCURRENCY);
+    var maxBufferedBytes = options.maxBufferedBytes || MAX_DOWNLOAD_BUFFER_BYTES;
+    var blockSize = Math.max(1, Math.min(options.blockSize || DOWNLOAD_BLOCK_SIZE, Math.floor(maxBufferedBytes / concurrency)));
+    var ranges = [];
+    for (var startByte = task.startByte; startByte <= task.endByte; startByte += blockSize) {
+        ranges.push({startByte: startByte, endByte: Math.min(startByte + blockSize - 1, task.endByte)});
+    }
+    return {ranges: ranges, concurrency: concurrency};
+}
+
+function downloadRange(range, blockBlobClient, blobProperties) {
+    return new Promise(async function (resolve, reject) {
+        try {
+            var buffer = Buffer.alloc(range.endByte - range.startByte + 1);
+            var response = await blockBlobClient.download(range.startByte, buffer.length, {
+                abortSignal: AbortController.timeout(30 * 60 * 1000),
+                maxRetryRequests: 3
+            });
+            if (blobProperties) {
+                blobProperties.etag = response.etag;
+                blobProperties.createdOn = response.createdOn;
+            }
+            var bytesRead = 0;
+            var stream = response.readableStreamBody;
+            stream.on('data', function (data) {
+                bytesRead += data.copy(buffer, bytesRead);
+            });
+            stream.on('end', function () {
+                resolve(buffer.subarray(0, bytesRead));
+            });
+            stream.on('error', reject);
+        } catch (err) {
+            reject(err);
+        }
+    });
+}
+
+/**
+ * Downloads the task range as sub-ranges in parallel and yields them in order
+ * @param blobProperties - optional object in which the etag, createdOn and contentLength (bytes yielded) are set
+ * @param options - see getDownloadPlan
+ */
+async function* downloadBlocks(task, blockBlobClient, context, blobProperties, options) {
+    var plan = getDownloadPlan(task, options);
+    var inFlight = [];
+    var next = 0;
+    var contentLength = 0;
+    while (next < plan.ranges.length || inFlight.length > 0) {
+        while (next < plan.ranges.length && inFlight.length < plan.concurrency) {
+            var download = downloadRange(plan.ranges[next], blockBlobClient, blobProperties);
+            // failures of later sub-ranges are thrown when they are reached
+            download.catch(function () {});
+            inFlight.push({range: plan.ranges[next], download: download});
+            next += 1;
+        }
+        var current = inFlight.shift();
+        var block = await current.download;
+        contentLength += block.length;
+        if (blobProperties) {
+            blobProperties.contentLength = contentLength;
+        }
+        yield block;
+        if (block.length < current.range.endByte - current.range.startByte + 1) {
+            // the range ends after the end of the blob
+            return;
+        }
+    }
+}
+
+/*
+    Ranges split by the producer between two content lengths are aligned on line breaks: a range flagged with alignStart
+    skips the line started in the previous range, a range flagged with alignEnd is read after its end up to the end of
+    its last line. A line is read by the range in which it starts, the byte before the range is read to know whether
+    the range starts with a line.
+ */
+async function* downloadAlignedBlocks(task, blockBlobClient, context, blobProperties) {
+    var range = Object.assign({}, task, {startByte: task.alignStart ? task.startByte - 1 : task.startByte});
+    var skipping = !!task.alignStart;
+    var endsWithLine = true;
+    for await (var block of downloadBlocks(range, blockBlobClient, context, blobProperties)) {
+        if (skipping) {
+            var lineBreak = block.indexOf(LINE_BREAK);
+            if (lineBreak === -1) {
+                continue;
+            }
+            block = block.subarray(lineBreak + 1);
+            skipping = false;
+        }
+        if (block.length > 0) {
+            endsWithLine = block[block.length - 1] === LINE_BREAK;
+            yield block;
+        }
+    }
+    if (!task.alignEnd || skipping || endsWithLine) {
+        // no line starts in the range or the last one ends in the range
+        return;
+    }
+    for (var startByte = task.endByte + 1; ; startByte += ALIGN_READ_BYTES) {
+        var next;
+        try {
+            next = await downloadRange({startByte: startByte, endByte: startByte + ALIGN_READ_BYTES - 1}, blockBlobClient);
+        } catch (err) {
+            if (err.statusCode === 416) {
+                // the last line ends at the end of the blob
+                return;
+            }
+            throw err;
+        }
+        var end = next.indexOf(LINE_BREAK);
+        if (end !== -1) {
+            yield next.subarray(0, end + 1);
+            return;
+        }
+        yield next;
+        if (next.length < ALIGN_READ_BYTES) {
+            return;
+        }
+    }
+}
+
+module.exports = {
+    DOWNLOAD_BLOCK_SIZE: DOWNLOAD_BLOCK_SIZE,
+    getDownloadPlan: getDownloadPlan,
+    downloadRange: downloadRange,
+    downloadBlocks: downloadBlocks,
+    downloadAlignedBlocks: downloadAlignedBlocks
+};
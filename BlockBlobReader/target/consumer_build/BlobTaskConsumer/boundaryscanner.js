@@ -0,0 +1,72 @@
+/*jshint esversion: 6 */
+/**
+ * Functions to find record boundaries (matches of a boundary regex) in the data downloaded from a blob. Matches are searched
+ * in place with a global regex and its lastIndex, so no substring of the data is copied, and the last boundary is searched
+ * from the end of the data. Boundaries should not overlap each other, e.g. '{\s*"time":' or a timestamp.
+ */
+
+// size of the first window scanned from the end of the data by boundaryLastIndexOf, it is doubled after each miss
+var LAST_BOUNDARY_WINDOW = 64 * 1024;
+
+/**
+ * @param {RegExp|string} regex - boundary regex or its source
+ * @returns {RegExp} the regex with the global flag, so that lastIndex is used by exec
+ */
+function getGlobalRegex(regex) {
+    if (typeof regex === 'string') {
+        return new RegExp(regex, 'g');
+    }
+    return regex.global ? regex : new RegExp(regex.source, regex.flags + 'g');
+}
+
+/**
+ * @param {string} data
+ * @param {RegExp|string} regex - boundary regex
+ * @param {number} fromIndex - optional index from which the boundary is searched
+ * @returns {number} index of the first boundary at or after fromIndex, -1 if not found
+ */
+function boundaryIndexOf(data, regex, fromIndex) {
+    let globalRegex = getGlobalRegex(regex);
+    globalRegex.lastIndex = Math.max(fromIndex || 0, 0);
+    let match = globalRegex.exec(data);
+    return match ? match.index : -1;
+}
+
+/**
+ * Windows of growing size are scanned from the end of the data until one contains a boundary, so that when the last record
+ * is small only the end of the data is scanned.
+ * @param {string} data
+ * @param {RegExp|string} regex - boundary regex
+ * @param {number} fromIndex - optional index from which the boundary is searched
+ * @returns {number} index of the last boundary at or after fromIndex, -1 if not found
+ */
+function boundaryLastIndexOf(data, regex, fromIndex) {
+    let globalRegex = getGlobalRegex(regex);
+    let minIndex = Math.max(fromIndex || 0, 0);
+    let windowSize = LAST_BOUNDARY_WINDOW;
+    let windowEnd = data.length;
+    while (true) {
+        let windowStart = Math.max(windowEnd - windowSize, minIndex);
+        let lastIndex = -1;
+        let match;
+        globalRegex.lastIndex = windowStart;
+        // boundaries starting after windowEnd were already searched by the previous window
+        while ((match = globalRegex.exec(data)) !== null && match.index < windowEnd) {
+            lastIndex = match.index;
+            if (match[0].length === 0) {
+                globalRegex.lastIndex += 1;
+            }
+        }
+        if (lastIndex >= 0 || windowStart === minIndex) {
+            return lastIndex;
+        }
+        windowEnd = windowStart;
+        windowSize *= 2;
+    }
+}
+
+module.exports = {
+    getGlobalRegex:getGlobalRegex,
+    boundaryIndexOf:boundaryIndexOf,
+    boundaryLastIndexOf:boundaryLastIndexOf
+};
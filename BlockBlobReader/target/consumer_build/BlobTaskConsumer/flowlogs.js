@@ -0,0 +1,116 @@
+/*jshint esversion: 6 */
+/*
+    Flattens NSG and VNet flow log records into one JSON line per flow tuple. The lines are written directly from the tuple
+    columns, the fields shared by all the tuples of a rule (and of a flow for NSG) are serialized once per rule, so no
+    object is created per tuple. The lines are the same as JSON.stringify of the events built field by field.
+ */
+
+// tuples without these characters can be quoted as is
+var NEEDS_ESCAPE = /["\\\u0000-\u001f\ud800-\udfff]/;
+
+// ',"name":value' or '' when the value is undefined, as JSON.stringify does for object members
+function member(name, value) {
+    if (value === undefined) {
+        return '';
+    }
+    return ',"' + name + '":' + JSON.stringify(value);
+}
+
+function column(name, value, safe) {
+    if (value === undefined) {
+        return '';
+    }
+    return ',"' + name + '":' + (safe ? '"' + value + '"' : JSON.stringify(value));
+}
+
+function nullableColumn(name, value, safe) {
+    if (value === "" || value === undefined) {
+        return ',"' + name + '":null';
+    }
+    return ',"' + name + '":' + (safe ? '"' + value + '"' : JSON.stringify(value));
+}
+
+var NSG_V1_COUNTERS = ',"flow_state":null,"num_packets_sent_src_to_dest":null,"bytes_sent_src_to_dest":null,' +
+    '"num_packets_sent_dest_to_src":null,"bytes_sent_dest_to_src":null}';
+
+/**
+ * Writes the tuples of a NetworkSecurityGroupFlowEvent record
+ * https://learn.microsoft.com/en-us/azure/network-watcher/nsg-flow-logs-overview#log-format
+ * @param record - parsed record
+ * @param {function} onLine - called with the JSON line of each tuple
+ * @returns {number} - number of tuples
+ */
+function flattenNsgRecord(record, onLine) {
+    let numTuples = 0;
+    let version = record.properties.Version;
+    let versionField = member("version", version);
+    record.properties.flows.forEach(function (rule) {
+        rule.flows.forEach(function (flow) {
+            let prefix = member("sys_id", record.systemId) + member("category", record.category) +
+                member("resource_id", record.resourceId) + member("event_name", record.operationName) +
+                member("rule_name", rule.rule) + member("mac", flow.mac);
+            flow.flowTuples.forEach(function (tuple) {
+                let col = tuple.split(",");
+                let safe = !NEEDS_ESCAPE.test(tuple);
+                let line = '{"time":' + (safe ? '"' + col[0] + '"' : JSON.stringify(col[0])) + prefix +
+                    column("src_ip", col[1], safe) + column("dest_IP", col[2], safe) +
+                    column("src_port", col[3], safe) + column("dest_port", col[4], safe) +
+                    column("protocol", col[5], safe) + column("traffic_destination", col[6], safe) +
+                    column("traffic_a/d", col[7], safe) + versionField;
+                if (version === 2) {
+                    line += nullableColumn("flow_state", col[8], safe) +
+                        nullableColumn("num_packets_sent_src_to_dest", col[9], safe) +
+                        nullableColumn("bytes_sent_src_to_dest", col[10], safe) +
+                        nullableColumn("num_packets_sent_dest_to_src", col[11], safe) +
+                        nullableColumn("bytes_sent_dest_to_src", col[12], safe) + '}';
+                } else {
+                    line += NSG_V1_COUNTERS;
+                }
+                onLine(line);
+                numTuples += 1;
+            });
+        });
+    });
+    return numTuples;
+}
+
+/**
+ * Writes the tuples of a VNet FlowLogFlowEvent record
+ * https://learn.microsoft.com/en-us/azure/network-watcher/vnet-flow-logs-overview#log-format
+ * @param record - parsed record
+ * @param {function} onLine - called with the JSON line of each tuple
+ * @returns {number} - number of tuples
+ */
+function flattenVnetRecord(record, onLine) {
+    let numTuples = 0;
+    let versionField = member("version", record.flowLogVersion) + '}';
+    let recordPrefix = member("flowLogGUID", record.flowLogGUID) + member("category", record.category) +
+        member("flow_log_resource_id", record.flowLogResourceID) + member("target_resource_id", record.targetResourceID) +
+        member("event_name", record.operationName);
+    record.flowRecords.flows.forEach(function (acl) {
+        acl.flowGroups.forEach(function (rule) {
+            let prefix = recordPrefix + member("acl_id", acl.aclID) + member("rule_name", rule.rule) +
+                member("mac", record.macAddress);
+            rule.flowTuples.forEach(function (tuple) {
+                let col = tuple.split(",");
+                let safe = !NEEDS_ESCAPE.test(tuple);
+                onLine('{"time":' + (safe ? '"' + col[0] + '"' : JSON.stringify(col[0])) + prefix +
+                    column("src_ip", col[1], safe) + column("dest_IP", col[2], safe) +
+                    column("src_port", col[3], safe) + column("dest_port", col[4], safe) +
+                    column("protocol", col[5], safe) + column("flow_direction", col[6], safe) +
+                    nullableColumn("flow_state", col[7], safe) + nullableColumn("flow_encryption_status", col[8], safe) +
+                    nullableColumn("num_packets_sent_src_to_dest", col[9], safe) +
+                    nullableColumn("bytes_sent_src_to_dest", col[10], safe) +
+                    nullableColumn("num_packets_sent_dest_to_src", col[11], safe) +
+                    nullableColumn("bytes_sent_dest_to_src", col[12], safe) + versionField);
+                numTuples += 1;
+            });
+        });
+    });
+    return numTuples;
+}
+
+module.exports = {
+    flattenNsgRecord: flattenNsgRecord,
+    flattenVnetRecord: flattenVnetRecord
+};
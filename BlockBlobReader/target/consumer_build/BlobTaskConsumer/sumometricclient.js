@@ -87,15 +87,16 @@ SumoMetricClient.prototype.addData = function(data) {
     var self = this;
 
     function submitMessage(message) {
-        let metaKey = self.generateLogBucketKey(message);
-        if (!self.dataMap.has(metaKey)) {
-            self.dataMap.set(metaKey, new bucket.MessageBucket(self.generateHeaders(message)));
-        }
+        let bucketKey = self.getBucketKey(message);
+        let targetBucket = self.getBucket(message, bucketKey);
         if ('metric_string' in message) {
-            self.dataMap.get(metaKey).add(message['metric_string']);
+            targetBucket.add(message['metric_string']);
+        } else if (self.options.max_bucket_bytes) {
+            targetBucket.add(JSON.stringify(message));
         } else {
-            self.dataMap.get(metaKey).add(message);
+            targetBucket.add(message);
         }
+        self.checkBucketThresholds(bucketKey.key, targetBucket);
     }
 
     if (data instanceof Array) {
@@ -107,13 +108,16 @@ SumoMetricClient.prototype.addData = function(data) {
         self.messagesReceived +=1;
         submitMessage(data);
     }
+    return this.scheduler.getQueuedCount() < this.maxQueuedRequests;
 };
 
 /**
  * Flush a whole message bucket to sumo, compress data if needed and with up to MaxAttempts
  * @param {string} metaKey - key to identify the buffer from the internal map
+ * @returns {Promise} - resolves once the messages of the bucket have been attempted, never rejects
  */
 SumoMetricClient.prototype.flushBucketToSumo = function(metaKey) {
+    this.clearBucketTimer(metaKey);
     let targetBuffer = this.dataMap.get(metaKey);
     var self = this;
     let curOptions = Object.assign({agent: httpAgent},this.options);
@@ -138,7 +142,8 @@ SumoMetricClient.prototype.flushBucketToSumo = function(metaKey) {
                             resolve(body);
                             // TODO: anything here?
                         } else {
-                            reject({'error':"statusCode: " + res.statusCode + " statusMessage: " + res.statusMessage + " body: " + body,'res':null});
+                            self.failedStatusCodes[res.statusCode] = (self.failedStatusCodes[res.statusCode] || 0) + 1;
+                            reject({'error':"statusCode: " + res.statusCode + " statusMessage: " + res.statusMessage + " body: " + body,'res':null,'statusCode':res.statusCode,'retryAfter':res.headers['retry-after']});
                         }
                         // TODO: finalizeContext();
                     });
@@ -153,55 +158,60 @@ SumoMetricClient.prototype.flushBucketToSumo = function(metaKey) {
     });
     }
 
-    if (targetBuffer) {
-        curOptions.headers = targetBuffer.getHeadersObject();
-        let msgArray = [];
-        let message;
-        while (targetBuffer.getSize()>0) {
-            message = targetBuffer.remove();
-            if (message instanceof Object) {
-                msgArray.push(JSON.stringify(message));
-            } else {
-                msgArray.push(message);
+    if (targetBuffer && targetBuffer.getSize() > 0) {
+        curOptions.headers = Object.assign({}, targetBuffer.getHeadersObject());
+        // messages are serialized in place in the drained array
+        let msgArray = targetBuffer.drain();
+        for (let i = 0; i < msgArray.length; i++) {
+            if (msgArray[i] instanceof Object) {
+                msgArray[i] = JSON.stringify(msgArray[i]);
             }
         }
 
+        function onSuccess() {
+            self.recordBucketStats(metaKey, msgArray.length, 0);
+            self.success_callback(self.context);
+        }
+
+        function onFailure(errorMessage) {
+            self.messagesFailed += msgArray.length;
+            self.messagesAttempted += msgArray.length;
+            self.recordBucketStats(metaKey, 0, msgArray.length);
+            self.context.log.error(errorMessage + ' messagesAttempted: ' + self.messagesAttempted  + ' messagesReceived: ' + self.messagesReceived);
+            self.failure_callback(msgArray,self.context);
+        }
+
         if (curOptions.compress_data) {
             curOptions.headers['Content-Encoding'] = 'gzip';
 
-            return zlib.gzip(msgArray.join('\n'),function(e,compressed_data){
-                if (!e)  {
-                    self.context.log.verbose("gzip successful");
-                    return sumoutils.p_retryMax(httpSend,self.MaxAttempts,self.RetryInterval,[msgArray,compressed_data], self.context)
-                        .then(()=> {
-                        self.context.log.verbose("Successfully sent to Sumo after "+self.MaxAttempts);
-                        self.success_callback(self.context);}
-                )
-                .catch((err) => {
-                    self.messagesFailed += msgArray.length;
-                    self.messagesAttempted += msgArray.length;
-                    self.context.log.error("Failed to send after maxattempts: " + self.MaxAttempts + " " + JSON.stringify(err) + ' messagesAttempted: ' + self.messagesAttempted  + ' messagesReceived: ' + self.messagesReceived);
-                    self.failure_callback(msgArray,self.context);
+            return this.trackFlush(new Promise(function (resolve) {
+                zlib.gzip(msgArray.join('\n'),function(e,compressed_data){
+                    if (!e)  {
+                        self.context.log.verbose("gzip successful");
+                        resolve(self.scheduler.schedule(metaKey, () => self.retryPolicy.execute(httpSend,[msgArray,compressed_data], self.context))
+                            .then(()=> {
+                                self.context.log.verbose("Successfully sent to Sumo after "+self.MaxAttempts);
+                                onSuccess();
+                            })
+                            .catch((err) => {
+                                onFailure("Failed to send after maxattempts: " + self.MaxAttempts + " " + JSON.stringify(err));
+                            }));
+                    } else {
+                        onFailure("Failed to gzip: " + JSON.stringify(e));
+                        resolve();
+                    }
                 });
-                } else {
-                    self.messagesFailed += msgArray.length;
-                    self.messagesAttempted += msgArray.length;
-                    self.context.log.error("Failed to gzip: " + JSON.stringify(e) + ' messagesAttempted: ' + self.messagesAttempted  + ' messagesReceived: ' + self.messagesReceived);
-                    self.failure_callback(msgArray,self.context);
-                }
-            });
+            }));
         }  else {
             //self.context.log('Send raw data to Sumo');
-            return sumoutils.p_retryMax(httpSend,self.MaxAttempts,self.RetryInterval,[msgArray,msgArray.join('\n')], self.context)
-                .then(()=> { self.success_callback(self.context);})
-            .catch((err) => {
-                self.messagesFailed += msgArray.length;
-                self.messagesAttempted += msgArray.length;
-                self.context.log.error("Failed to send after maxattempts: " + self.MaxAttempts + " " + JSON.stringify(err) + ' messagesAttempted: ' + self.messagesAttempted  + ' messagesReceived: ' + self.messagesReceived);
-                self.failure_callback(msgArray,self.context);
-        });
+            return this.trackFlush(self.scheduler.schedule(metaKey, () => self.retryPolicy.execute(httpSend,[msgArray,msgArray.join('\n')], self.context))
+                .then(()=> { onSuccess(); })
+                .catch((err) => {
+                    onFailure("Failed to send after maxattempts: " + self.MaxAttempts + " " + JSON.stringify(err));
+                }));
         }
     }
+    return Promise.resolve();
 };
 
 /**
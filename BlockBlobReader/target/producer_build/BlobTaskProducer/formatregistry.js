@@ -0,0 +1,316 @@
+/*jshint esversion: 6 */
+/**
+ * Registry of the blob formats shared by the BlockBlob and AppendBlob readers. The format of a blob is chosen by container
+ * rule, then by extension of the blob name, then by sniffing the start of the data, and blobs without extension default to
+ * log. A format is a plain object:
+ *   name           - used by the readers to pick their handler
+ *   extensions     - extensions of the blob names in this format
+ *   containers     - optional container names whose blobs with one of containerExtensions are in this format
+ *   sniff(head)    - optional, returns true if the text at the start of the data is in this format
+ *   boundaryRegex  - source of the regex matching the start of a record, used to align the ranges on records
+ *   jsonRecords    - true if the records are JSON objects
+ *   lineRecords    - true if the records are lines, a range can then be split anywhere and aligned on the line breaks
+ *   headBytes      - optional bytes at the start of the blob which are not part of a record, e.g. {"records":[
+ *   tailBytes      - optional bytes at the end of the blob which are not part of a record, e.g. ]}
+ *   createParser(options) - returns a streaming parser, options are specific to the format (e.g. onError of the
+ *                    NdjsonParser), write(buffer, onRecord) is called with each downloaded block and end(onRecord) once
+ *                    the range is read, end returns stats of the data parsed (numRecords, consumed, skippedBytes and
+ *                    incompleteBytes), consumed is the length of the data up to the last complete record
+ * A compressed blob, e.g. app.log.gz, is in the format of its name without the compression extension, the format returned
+ * for it has a compression property:
+ *   name                 - name of the compression
+ *   extensions           - extensions of the compressed blob names
+ *   isMemberStart(data)  - returns true if the data starts with a compressed member, e.g. the magic bytes of gzip
+ *   createDecompressor() - returns a zlib stream decompressing the data, the data received so far is decompressed
+ *                          if it ends before the end of the compressed data
+ */
+
+var TIMESTAMP_BOUNDARY = '\\d{4}-\\d{2}-\\d{2}\\s+\\d{2}:\\d{2}:\\d{2}';
+var JSON_OBJECT_BOUNDARY = '{\\s*"';
+var FLOW_LOG_RECORD_BOUNDARY = '{\\s*"time":';
+var LF = 0x0a;
+
+/**
+ * Parser of text data emitting blocks of complete lines, the line break ending a block is not part of it
+ * @constructor
+ */
+function LineRecordParser() {
+    this.remainder = null;
+    this.offset = 0;
+    this.consumed = 0;
+    this.numRecords = 0;
+}
+
+LineRecordParser.prototype.write = function(buffer, onRecord) {
+    let data = this.remainder ? Buffer.concat([this.remainder, buffer]) : buffer;
+    // a line break is a single byte which is never part of a multibyte character
+    let lastNewLine = data.lastIndexOf(LF);
+    this.offset += buffer.length;
+    if (lastNewLine === -1) {
+        this.remainder = data;
+        return;
+    }
+    this.remainder = lastNewLine + 1 < data.length ? data.subarray(lastNewLine + 1) : null;
+    this.consumed = this.offset - (this.remainder ? this.remainder.length : 0);
+    this.numRecords += 1;
+    onRecord(data.toString('utf8', 0, lastNewLine));
+};
+
+/**
+ * The data after the last line break is emitted as the last block, it is counted in incompleteBytes
+ */
+LineRecordParser.prototype.end = function(onRecord) {
+    let incompleteBytes = 0;
+    if (this.remainder) {
+        incompleteBytes = this.remainder.length;
+        this.numRecords += 1;
+        onRecord(this.remainder.toString('utf8'));
+        this.remainder = null;
+    }
+    return {numRecords: this.numRecords, consumed: this.consumed, skippedBytes: 0, incompleteBytes: incompleteBytes};
+};
+
+/**
+ * CsvParser fed with bytes, the records are the rows as arrays of fields
+ * @constructor
+ */
+function CsvRecordParser(delimiter) {
+    let { CsvParser } = require('./csvparser');
+    let { StringDecoder } = require('string_decoder');
+    this.parser = new CsvParser(delimiter);
+    this.decoder = new StringDecoder('utf8');
+    this.numRecords = 0;
+    this.offset = 0;
+}
+
+CsvRecordParser.prototype._counted = function(onRecord) {
+    let self = this;
+    return function (row) {
+        self.numRecords += 1;
+        onRecord(row);
+    };
+};
+
+CsvRecordParser.prototype.write = function(buffer, onRecord) {
+    this.offset += buffer.length;
+    this.parser.write(this.decoder.write(buffer), this._counted(onRecord));
+};
+
+CsvRecordParser.prototype.end = function(onRecord) {
+    let counted = this._counted(onRecord);
+    this.parser.write(this.decoder.end(), counted);
+    this.parser.end(counted);
+    return {numRecords: this.numRecords, consumed: this.offset, skippedBytes: 0, incompleteBytes: 0};
+};
+
+function createJsonRecordParser(boundaryRegex) {
+    let { JsonRecordTokenizer } = require('./jsonrecordtokenizer');
+    return new JsonRecordTokenizer({syncRegex: boundaryRegex ? new RegExp(boundaryRegex) : null});
+}
+
+// text starting with a JSON object, possibly after the comma separating it from the previous one
+function startsWithJsonObject(head) {
+    return /^[\s,]*{\s*"/.test(head);
+}
+
+// magic bytes and compression method (deflate) of a gzip member, RFC 1952
+function isGzipMemberStart(data) {
+    return data.length >= 3 && data[0] === 0x1f && data[1] === 0x8b && data[2] === 0x08;
+}
+
+// zlib header with the deflate method and a valid check value, RFC 1950
+function isZlibStreamStart(data) {
+    return data.length >= 2 && (data[0] & 0x0f) === 0x08 && ((data[0] << 8) | data[1]) % 31 === 0;
+}
+
+/**
+ * @param {string} blobName
+ * @returns {string} - extension of the last segment of the blob name, "" if it has none
+ */
+function getBlobExtension(blobName) {
+    let fileName = String(blobName).split("/").pop();
+    let dotIdx = fileName.lastIndexOf(".");
+    return dotIdx === -1 ? "" : fileName.substring(dotIdx + 1);
+}
+
+/**
+ * @constructor
+ */
+function FormatRegistry() {
+    this.formats = [];
+    this.byExtension = new Map();
+    this.byContainer = new Map();
+    this.byCompressionExtension = new Map();
+    this.defaultFormat = null;
+}
+
+/**
+ * Adds a format, a format registered later takes over the extensions and containers of the previous ones
+ * @param format - see the description of the format object at the top of this file
+ * @param isDefault - optional, use the format for the blobs without extension
+ */
+FormatRegistry.prototype.register = function(format, isDefault) {
+    let self = this;
+    this.formats.push(format);
+    (format.extensions || []).forEach(function (ext) {
+        self.byExtension.set(ext, format);
+    });
+    (format.containers || []).forEach(function (containerName) {
+        self.byContainer.set(containerName, format);
+    });
+    if (isDefault) {
+        this.defaultFormat = format;
+    }
+    return this;
+};
+
+/**
+ * Adds a compression, see the description of the compression object at the top of this file
+ */
+FormatRegistry.prototype.registerCompression = function(compression) {
+    let self = this;
+    compression.extensions.forEach(function (ext) {
+        self.byCompressionExtension.set(ext, compression);
+    });
+    return this;
+};
+
+/**
+ * @param task - object with blobName and optional containerName
+ * @param {string} head - optional text at the start of the data, sniffed for blobs without a known extension
+ * @returns the format of the blob, null if the extension is not supported
+ */
+FormatRegistry.prototype.getFormat = function(task, head) {
+    let ext = getBlobExtension(task.blobName);
+    let compression = this.byCompressionExtension.get(ext);
+    if (compression) {
+        // the start of the compressed data cannot be sniffed
+        let blobName = String(task.blobName);
+        let format = this.getFormat({
+            blobName: blobName.substring(0, blobName.length - ext.length - 1),
+            containerName: task.containerName
+        });
+        return format === null ? null : Object.assign({}, format, {compression: compression});
+    }
+    let containerFormat = task.containerName ? this.byContainer.get(task.containerName) : undefined;
+    if (containerFormat && containerFormat.containerExtensions.includes(ext)) {
+        return containerFormat;
+    }
+    if (ext !== "" && this.byExtension.has(ext)) {
+        return this.byExtension.get(ext);
+    }
+    if (ext === "" && head !== undefined) {
+        let sniffed = this.formats.find(function (format) {
+            return format.sniff && format.sniff(head);
+        });
+        if (sniffed) {
+            return sniffed;
+        }
+    }
+    return ext === "" ? this.defaultFormat : null;
+};
+
+/**
+ * @param {string} blobName - blob name or event subject
+ * @returns {boolean} - true if blobs with this name can be read, used to filter the blob events
+ */
+FormatRegistry.prototype.isSupportedBlob = function(blobName) {
+    return this.getFormat({blobName: blobName}) !== null;
+};
+
+// formats read by the BlockBlob and AppendBlob readers
+var defaultRegistry = new FormatRegistry()
+    .register({
+        name: "log",
+        extensions: ["log", "txt"],
+        boundaryRegex: TIMESTAMP_BOUNDARY,
+        jsonRecords: false,
+        lineRecords: true,
+        createParser: function () {
+            return new LineRecordParser();
+        }
+    }, true)
+    .register({
+        name: "csv",
+        extensions: ["csv"],
+        boundaryRegex: TIMESTAMP_BOUNDARY,
+        jsonRecords: false,
+        // a quoted line break at the split of a range breaks the row around it
+        lineRecords: true,
+        createParser: function () {
+            return new CsvRecordParser(",");
+        }
+    })
+    .register({
+        name: "json",
+        extensions: ["json"],
+        sniff: startsWithJsonObject,
+        boundaryRegex: JSON_OBJECT_BOUNDARY,
+        jsonRecords: true,
+        createParser: function () {
+            return createJsonRecordParser(null);
+        }
+    })
+    .register({
+        // application insights continuous export and other newline delimited JSON, one JSON object per line
+        name: "blob",
+        extensions: ["blob", "ndjson", "jsonl"],
+        boundaryRegex: JSON_OBJECT_BOUNDARY,
+        jsonRecords: true,
+        lineRecords: true,
+        createParser: function (options) {
+            let { NdjsonParser } = require('./ndjsonparser');
+            return new NdjsonParser(options);
+        }
+    })
+    .register({
+        name: "nsg",
+        containers: ["insights-logs-networksecuritygroupflowevent"],
+        containerExtensions: ["json"],
+        boundaryRegex: FLOW_LOG_RECORD_BOUNDARY,
+        jsonRecords: true,
+        headBytes: 12,
+        tailBytes: 2,
+        createParser: function () {
+            return createJsonRecordParser(FLOW_LOG_RECORD_BOUNDARY);
+        }
+    })
+    .register({
+        name: "vnetflowlogs",
+        containers: ["insights-logs-flowlogflowevent"],
+        containerExtensions: ["json"],
+        boundaryRegex: FLOW_LOG_RECORD_BOUNDARY,
+        jsonRecords: true,
+        headBytes: 12,
+        tailBytes: 2,
+        createParser: function () {
+            return createJsonRecordParser(FLOW_LOG_RECORD_BOUNDARY);
+        }
+    })
+    .registerCompression({
+        // a gzip file may contain several members, e.g. blocks appended by the exporter, they are all decompressed
+        name: "gzip",
+        extensions: ["gz", "gzip"],
+        isMemberStart: isGzipMemberStart,
+        createDecompressor: function () {
+            let zlib = require('zlib');
+            return zlib.createGunzip({finishFlush: zlib.constants.Z_SYNC_FLUSH});
+        }
+    })
+    .registerCompression({
+        name: "deflate",
+        extensions: ["deflate", "zz"],
+        isMemberStart: isZlibStreamStart,
+        createDecompressor: function () {
+            let zlib = require('zlib');
+            return zlib.createInflate({finishFlush: zlib.constants.Z_SYNC_FLUSH});
+        }
+    });
+
+module.exports = {
+    FormatRegistry:FormatRegistry,
+    LineRecordParser:LineRecordParser,
+    CsvRecordParser:CsvRecordParser,
+    getBlobExtension:getBlobExtension,
+    defaultRegistry:defaultRegistry
+};
@@ -0,0 +1,87 @@
+/*jshint esversion: 6 */
+/*
+    Planning of the task ranges of a blob from the content lengths of its events. The offset saved for a blob is the
+    last byte read (contentLength - 1), -1 for a new blob.
+ */
+
+/*
+    Plans the tasks reading the blob up to its last content length. Growth events are merged into ranges of up to
+    targetBytes so that chatty writers do not create a task per commit, the ranges end at content lengths of the events,
+    which are at the end of a commit. Growth larger than targetBytes of a format with line records is split into ranges of
+    targetBytes, such a range starting or ending between two content lengths is flagged with alignStart/alignEnd and
+    the consumer aligns it on the line breaks.
+ */
+function getNewTask(currentoffset, contentlengths, metadata, format, targetBytes) {
+    var splittable = !!(format && format.lineRecords);
+    // numeric sort, removing the duplicate contentlengths
+    var endBytes = Array.from(new Set(contentlengths.map(Number))).sort(function (a, b) {
+        return a - b;
+    }).map(function (contentLength) {
+        return contentLength - 1;
+    });
+    var lastEndByte = endBytes[endBytes.length - 1];
+    if (endBytes.length === 0 || lastEndByte === currentoffset) {
+        return [[], currentoffset];
+    }
+    if (lastEndByte < currentoffset) {
+        // in NSG Flow logs sometimes file gets rewritten, hence starting the file from the beginning
+        currentoffset = -1;
+    }
+    var tasks = [];
+    var newTask = function (startByte, endByte, isBoundaryStart, isBoundaryEnd) {
+        // to specify a range encompassing the first 512 bytes of a blob use x-ms-range: bytes=0-511  contentLength = 512
+        // saving in offset: 511 endByte
+        var task = Object.assign({startByte: startByte, endByte: endByte}, metadata);
+        if (!isBoundaryStart) {
+            task.alignStart = true;
+        }
+        if (!isBoundaryEnd) {
+            task.alignEnd = true;
+        }
+        tasks.push(task);
+    };
+    var startByte = currentoffset + 1;
+    var isBoundaryStart = true;
+    var endByte = currentoffset;
+    endBytes.forEach(function (boundary) {
+        if (boundary <= currentoffset) {
+            return;
+        }
+        if (endByte >= startByte && boundary - startByte + 1 > targetBytes) {
+            newTask(startByte, endByte, isBoundaryStart, true);
+            startByte = endByte + 1;
+            isBoundaryStart = true;
+        }
+        endByte = boundary;
+        while (splittable && endByte - startByte + 1 > targetBytes) {
+            newTask(startByte, startByte + targetBytes - 1, isBoundaryStart, false);
+            startByte += targetBytes;
+            isBoundaryStart = false;
+        }
+    });
+    newTask(startByte, endByte, isBoundaryStart, true);
+    return [tasks, endByte];
+}
+
+/*
+    A compressed blob cannot be read from an arbitrary byte, so a single task is created for all the new versions of the
+    blob. It starts after the previous version, which is the start of a member if the blob was appended with whole
+    compressed members, otherwise the consumer reads the blob from its start.
+ */
+function getNewCompressedTask(currentoffset, contentlengths, metadata) {
+    var endByte = Math.max.apply(null, contentlengths) - 1;
+    if (endByte === currentoffset) {
+        return [[], currentoffset];
+    }
+    var task = Object.assign({
+        // a blob smaller than the previous version was rewritten
+        startByte: endByte > currentoffset ? currentoffset + 1 : 0,
+        endByte: endByte
+    }, metadata);
+    return [[task], endByte];
+}
+
+module.exports = {
+    getNewTask: getNewTask,
+    getNewCompressedTask: getNewCompressedTask
+};
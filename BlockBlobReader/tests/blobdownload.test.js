@@ -0,0 +1,77 @@
+jest.mock('@azure/abort-controller', () => ({
+    AbortController: { timeout: () => null }
+}), { virtual: true });
+
+const { Readable } = require('stream');
+const { getDownloadPlan, downloadBlocks, downloadAlignedBlocks } = require('../target/consumer_build/BlobTaskConsumer/blobdownload');
+const { getNewTask } = require('../target/producer_build/BlobTaskProducer/taskplanner');
+
+const context = { log: () => {} };
+
+// block blob client reading the ranges of content, ranges starting after its end fail with 416
+function getBlobClient(content) {
+    const client = { requests: [] };
+    client.download = async function (offset, count) {
+        client.requests.push([offset, count]);
+        if (offset >= content.length) {
+            throw { statusCode: 416 };
+        }
+        return {
+            etag: 'etag',
+            readableStreamBody: Readable.from([content.subarray(offset, offset + count)])
+        };
+    };
+    return client;
+}
+
+async function read(blocks) {
+    const buffers = [];
+    for await (const block of blocks) {
+        buffers.push(block);
+    }
+    return Buffer.concat(buffers).toString('utf8');
+}
+
+test('The task range is split into sub-ranges of at most maxBufferedBytes in flight', () => {
+    expect(getDownloadPlan({ startByte: 0, endByte: 9 }, { blockSize: 4, concurrency: 2 })).toEqual({
+        ranges: [{ startByte: 0, endByte: 3 }, { startByte: 4, endByte: 7 }, { startByte: 8, endByte: 9 }],
+        concurrency: 2
+    });
+    expect(getDownloadPlan({ startByte: 10, endByte: 19 }, { blockSize: 8, concurrency: 2, maxBufferedBytes: 10 }).ranges.length).toBe(2);
+});
+
+test('Sub-ranges are yielded in order and stop at the end of the blob', async () => {
+    const content = Buffer.from('0123456789abcdefghij');
+    const blobProperties = {};
+    expect(await read(downloadBlocks({ startByte: 2, endByte: 17 }, getBlobClient(content), context, blobProperties, { blockSize: 3, concurrency: 3 }))).toBe('23456789abcdefgh');
+    expect(blobProperties.contentLength).toBe(16);
+    expect(await read(downloadBlocks({ startByte: 12, endByte: 40 }, getBlobClient(content), context, null, { blockSize: 5 }))).toBe('cdefghij');
+});
+
+test('The ranges split between two content lengths read each line once', async () => {
+    const lines = [];
+    for (let i = 0; i < 60; i += 1) {
+        lines.push('line ' + i + ' ' + 'x'.repeat((i * 37) % 90));
+    }
+    // a line longer than the bytes read at a time to complete the last line of a range
+    lines.splice(30, 0, 'long ' + 'y'.repeat(150 * 1024));
+    const content = Buffer.from(lines.join('\n') + '\n');
+    const client = getBlobClient(content);
+    for (const targetBytes of [100, 1000, 64 * 1024]) {
+        const [tasks] = getNewTask(-1, [content.length], {}, { lineRecords: true }, targetBytes);
+        expect(tasks.length).toBe(Math.ceil(content.length / targetBytes));
+        let text = '';
+        for (const task of tasks) {
+            text += await read(downloadAlignedBlocks(task, client, context, {}));
+        }
+        expect(text).toBe(content.toString('utf8'));
+    }
+});
+
+test('A range in which no line starts is empty and the last line may end at the end of the blob', async () => {
+    const content = Buffer.from('a'.repeat(50) + '\nlast line without line break');
+    const client = getBlobClient(content);
+    expect(await read(downloadAlignedBlocks({ startByte: 10, endByte: 19, alignStart: true, alignEnd: true }, client, context, {}))).toBe('');
+    expect(await read(downloadAlignedBlocks({ startByte: 40, endByte: 59, alignStart: true, alignEnd: true }, client, context, {}))).toBe('last line without line break');
+    expect(await read(downloadAlignedBlocks({ startByte: 0, endByte: 9, alignEnd: true }, client, context, {}))).toBe('a'.repeat(50) + '\n');
+});
@@ -0,0 +1,126 @@
+jest.mock('@azure/data-tables', () => ({
+    odata: (strings, ...values) => strings.reduce((filter, part, i) => filter + part + (i < values.length ? `'${values[i]}'` : ''), '')
+}), { virtual: true });
+
+const { getOffset, readOffsetEntities, writeOffsetEntities } = require('../target/producer_build/BlobTaskProducer/offsettable');
+
+const context = { log: () => {} };
+
+function getWrites(count, etag) {
+    const writes = [];
+    for (let i = 0; i < count; i += 1) {
+        writes.push({ entity: { partitionKey: 'c', rowKey: 'f' + i, offset: { type: 'Int64', value: String(i) } }, etag: etag });
+    }
+    return writes;
+}
+
+// table client whose transactions fail with the error returned by getError for the first entity it rejects
+function getTransactionClient(getError) {
+    const client = { transactions: [] };
+    client.submitTransaction = async function (actions) {
+        const rowKeys = actions.map((action) => action[1].rowKey);
+        client.transactions.push(rowKeys);
+        for (let i = 0; i < rowKeys.length; i += 1) {
+            const error = getError(rowKeys[i], i);
+            if (error) {
+                throw error;
+            }
+        }
+        return { subResponses: rowKeys.map((rowKey) => ({ rowKey: rowKey, etag: 'etag-' + rowKey })) };
+    };
+    return client;
+}
+
+test('Offsets are read from strings and typed Int64 values', () => {
+    expect(getOffset({ offset: '511' })).toBe(511);
+    expect(getOffset({ offset: { type: 'Int64', value: '511' } })).toBe(511);
+});
+
+test('The entity failing a transaction is removed and the others are written again', async () => {
+    const client = getTransactionClient((rowKey, index) => rowKey === 'f3' ? { statusCode: 412, message: index + ':The update condition specified in the request was not satisfied.' } : null);
+    const result = await writeOffsetEntities(client, getWrites(5, 'etag'));
+    expect(client.transactions).toEqual([['f0', 'f1', 'f2', 'f3', 'f4'], ['f0', 'f1', 'f2', 'f4']]);
+    expect(result.written).toEqual(['f0', 'f1', 'f2', 'f4']);
+    expect(result.conflicts).toEqual(['f3']);
+    expect(result.failed).toEqual([]);
+    expect(result.etags).toEqual({ f0: 'etag-f0', f1: 'etag-f1', f2: 'etag-f2', f4: 'etag-f4' });
+});
+
+test('The index of the failing entity is read from the odata error of the transaction', async () => {
+    const client = getTransactionClient((rowKey, index) => rowKey === 'f1' || rowKey === 'f2' ? {
+        statusCode: 409,
+        details: { odataError: { message: { value: index + ':The specified entity already exists.' } } }
+    } : null);
+    const result = await writeOffsetEntities(client, getWrites(4, null));
+    expect(client.transactions).toEqual([['f0', 'f1', 'f2', 'f3'], ['f0', 'f2', 'f3'], ['f0', 'f3']]);
+    expect(result.written).toEqual(['f0', 'f3']);
+    expect(result.conflicts).toEqual(['f1', 'f2']);
+});
+
+test('Each entity is written on its own when the entity failing the transaction is unknown', async () => {
+    const client = getTransactionClient((rowKey) => rowKey === 'f2' ? { statusCode: 500, message: 'Internal error' } : null);
+    const result = await writeOffsetEntities(client, getWrites(3, 'etag'));
+    expect(client.transactions).toEqual([['f0', 'f1', 'f2'], ['f0'], ['f1'], ['f2']]);
+    expect(result.written).toEqual(['f0', 'f1']);
+    expect(result.conflicts).toEqual([]);
+    expect(result.failed).toEqual([{ rowKey: 'f2', error: { statusCode: 500, message: 'Internal error' } }]);
+
+    // an index out of the transaction is not trusted either
+    const outOfRange = getTransactionClient((rowKey, index) => rowKey === 'f1' && index > 0 ? { statusCode: 400, message: '7:Bad request' } : null);
+    const retried = await writeOffsetEntities(outOfRange, getWrites(3, 'etag'));
+    expect(outOfRange.transactions).toEqual([['f0', 'f1', 'f2'], ['f0'], ['f1'], ['f2']]);
+    expect(retried.written).toEqual(['f0', 'f1', 'f2']);
+});
+
+test('Writes are split in transactions of 100 entities', async () => {
+    const client = getTransactionClient(() => null);
+    const result = await writeOffsetEntities(client, getWrites(250, 'etag'));
+    expect(client.transactions.map((rowKeys) => rowKeys.length)).toEqual([100, 100, 50]);
+    expect(result.written.length).toBe(250);
+});
+
+test('Entities are read with at most 14 rowKeys per filter', async () => {
+    const filters = [];
+    const client = {
+        listEntities: function (options) {
+            filters.push(options.queryOptions.filter);
+            const rowKeys = options.queryOptions.filter.match(/RowKey eq '[^']*'/g).map((match) => match.slice(11, -1));
+            return (async function* () {
+                for (const rowKey of rowKeys.filter((rowKey) => rowKey !== 'f7')) {
+                    yield { partitionKey: 'c', rowKey: rowKey, offset: '10' };
+                }
+            })();
+        }
+    };
+    const rowKeys = getWrites(30).map((write) => write.entity.rowKey);
+    const entities = await readOffsetEntities(client, 'c', rowKeys, context);
+    expect(filters.length).toBe(3);
+    expect(filters[0].startsWith("PartitionKey eq 'c' and (RowKey eq 'f0' or ")).toBe(true);
+    expect(entities.size).toBe(29);
+    expect(entities.has('f7')).toBe(false);
+});
+
+test('The table is created when it does not exist', async () => {
+    let created = 0;
+    const client = {
+        listEntities: function () {
+            return (async function* () {
+                throw { statusCode: 404, code: 'TableNotFound' };
+            })();
+        },
+        createTable: async function () {
+            created += 1;
+        }
+    };
+    const entities = await readOffsetEntities(client, 'c', ['f0', 'f1'], context);
+    expect(created).toBe(1);
+    expect(entities.size).toBe(0);
+
+    client.listEntities = function () {
+        return (async function* () {
+            throw { statusCode: 503, code: 'ServerBusy' };
+        })();
+    };
+    await expect(readOffsetEntities(client, 'c', ['f0'], context)).rejects.toEqual({ statusCode: 503, code: 'ServerBusy' });
+    expect(created).toBe(1);
+});
@@ -0,0 +1,79 @@
+const { getNewTask, getNewCompressedTask } = require('../target/producer_build/BlobTaskProducer/taskplanner');
+
+const metadata = { url: 'https://sa.blob.core.windows.net/c/f.log', containerName: 'c', blobName: 'f.log', storageName: 'sa' };
+const lineFormat = { name: 'log', lineRecords: true };
+const jsonFormat = { name: 'json', jsonRecords: true };
+
+function getRanges(tasks) {
+    return tasks.map((task) => [task.startByte, task.endByte, !!task.alignStart, !!task.alignEnd]);
+}
+
+test('Content lengths are sorted as numbers', () => {
+    // sorted as strings, 900 would be the last content length
+    let [tasks, lastoffset] = getNewTask(-1, [900, 10000], metadata, lineFormat, 32 * 1024 * 1024);
+    expect(getRanges(tasks)).toEqual([[0, 9999, false, false]]);
+    expect(lastoffset).toBe(9999);
+
+    [tasks, lastoffset] = getNewTask(-1, ['10000', '900'], metadata, jsonFormat, 32 * 1024 * 1024);
+    expect(getRanges(tasks)).toEqual([[0, 9999, false, false]]);
+    expect(lastoffset).toBe(9999);
+    expect(tasks[0]).toMatchObject(metadata);
+});
+
+test('Growth events are merged into ranges of up to targetBytes ending at content lengths', () => {
+    let [tasks, lastoffset] = getNewTask(-1, [100, 200, 300], metadata, jsonFormat, 1000);
+    expect(getRanges(tasks)).toEqual([[0, 299, false, false]]);
+    expect(lastoffset).toBe(299);
+
+    [tasks, lastoffset] = getNewTask(-1, [1600, 400, 1200, 800], metadata, jsonFormat, 1000);
+    expect(getRanges(tasks)).toEqual([[0, 799, false, false], [800, 1599, false, false]]);
+    expect(lastoffset).toBe(1599);
+});
+
+test('Growth larger than targetBytes is split only for the formats with line records', () => {
+    let [tasks, lastoffset] = getNewTask(-1, [2500], metadata, lineFormat, 1000);
+    expect(getRanges(tasks)).toEqual([[0, 999, false, true], [1000, 1999, true, true], [2000, 2499, true, false]]);
+    expect(lastoffset).toBe(2499);
+
+    [tasks, lastoffset] = getNewTask(99, [600, 2600], metadata, lineFormat, 1000);
+    expect(getRanges(tasks)).toEqual([[100, 599, false, false], [600, 1599, false, true], [1600, 2599, true, false]]);
+    expect(lastoffset).toBe(2599);
+
+    [tasks, lastoffset] = getNewTask(-1, [2500], metadata, jsonFormat, 1000);
+    expect(getRanges(tasks)).toEqual([[0, 2499, false, false]]);
+    expect(lastoffset).toBe(2499);
+});
+
+test('Duplicate and already read content lengths do not create tasks', () => {
+    let [tasks, lastoffset] = getNewTask(-1, [500, 500, '500'], metadata, lineFormat, 1000);
+    expect(getRanges(tasks)).toEqual([[0, 499, false, false]]);
+    expect(lastoffset).toBe(499);
+
+    [tasks, lastoffset] = getNewTask(499, [500, 500], metadata, lineFormat, 1000);
+    expect(tasks).toEqual([]);
+    expect(lastoffset).toBe(499);
+
+    [tasks, lastoffset] = getNewTask(499, [300, 500, 800], metadata, lineFormat, 1000);
+    expect(getRanges(tasks)).toEqual([[500, 799, false, false]]);
+    expect(lastoffset).toBe(799);
+});
+
+test('A blob smaller than its offset was rewritten and is read from its start', () => {
+    let [tasks, lastoffset] = getNewTask(9999, [400], metadata, jsonFormat, 1000);
+    expect(getRanges(tasks)).toEqual([[0, 399, false, false]]);
+    expect(lastoffset).toBe(399);
+
+    [tasks, lastoffset] = getNewCompressedTask(999, [300], metadata);
+    expect(getRanges(tasks)).toEqual([[0, 299, false, false]]);
+    expect(lastoffset).toBe(299);
+});
+
+test('A single task reads all the new versions of a compressed blob', () => {
+    let [tasks, lastoffset] = getNewCompressedTask(99, [50, 3000, 300], metadata);
+    expect(getRanges(tasks)).toEqual([[100, 2999, false, false]]);
+    expect(lastoffset).toBe(2999);
+
+    [tasks, lastoffset] = getNewCompressedTask(2999, [3000], metadata);
+    expect(tasks).toEqual([]);
+    expect(lastoffset).toBe(2999);
+});
@@ -30,22 +30,21 @@ module.exports = function (context, eventHubMessages) {
 
 
         function failureHandler(msgArray,ctx) {
-            ctx.log.error("Failed to send to Sumo, backup to storageaccount now" + ' messagesAttempted: ' + this.messagesAttempted  + ' messagesReceived: ' + this.
-messagesReceived);
-            if (this.messagesAttempted === this.messagesReceived) {
-                context.bindings.outputBlob = messageArray.map(function(x) { return JSON.stringify(x);}).join("\n");
-                context.done();
-            }
+            ctx.log.error("Failed to send to Sumo" + ' messagesAttempted: ' + this.messagesAttempted  + ' messagesReceived: ' + this.messagesReceived);
         }
         function successHandler(ctx) {
              ctx.log('Successfully sent chunk to Sumo' + ' messagesAttempted: ' + this.messagesAttempted  + ' messagesReceived: ' + this.messagesReceived);
-            if (this.messagesAttempted === this.messagesReceived) {
-                ctx.log('Sent all data to Sumo. Exit now.');
-                context.done();
-            }
         }
         context.log("Flushing the rest of the buffers:");
-        sumoClient.flushAll();
+        sumoClient.flushAll().then(function (stats) {
+            if (stats.messagesFailed > 0) {
+                context.log.error("Failed to send to Sumo, backup to storageaccount now" + ' messagesFailed: ' + stats.messagesFailed  + ' messagesReceived: ' + stats.messagesReceived);
+                context.bindings.outputBlob = messageArray.map(function(x) { return JSON.stringify(x);}).join("\n");
+            } else {
+                context.log('Sent all data to Sumo. Exit now.');
+            }
+            context.done();
+        });
     } else {
         context.log("No messages to send");
         context.log(eventHubMessages);
@@ -5,13 +5,22 @@
 var Transformer = require('./datatransformer.js').Transformer;
 var SumoClient = require('./sumoclient.js').SumoClient;
 var SumoMetricClient = require('./sumometricclient.js').SumoMetricClient;
+var SendScheduler = require('./sendscheduler.js').SendScheduler;
 var sumoUtils = require('./sumoutils.js');
+var boundaryScanner = require('./boundaryscanner.js');
+var formatRegistry = require('./formatregistry.js');
 
 module.exports = {
     "p_retryMax" : sumoUtils.p_retryMax,
     "p_wait" : sumoUtils.p_wait,
     "p_retryTillTimeout" : sumoUtils.p_retryTillTimeout,
+    RetryPolicy:sumoUtils.RetryPolicy,
+    boundaryIndexOf:boundaryScanner.boundaryIndexOf,
+    boundaryLastIndexOf:boundaryScanner.boundaryLastIndexOf,
+    FormatRegistry:formatRegistry.FormatRegistry,
+    defaultFormatRegistry:formatRegistry.defaultRegistry,
     SumoClient:SumoClient,
     SumoMetricClient:SumoMetricClient,
+    SendScheduler:SendScheduler,
     Transformer:Transformer
 }
@@ -0,0 +1,145 @@
+/*jshint esversion: 6 */
+/**
+ * Incremental RFC4180 CSV parser. Text is written in pieces of any size and each complete row is passed to a callback as
+ * an array of fields, so rows can be processed as the data is downloaded without building the whole table.
+ * Quoted fields may contain delimiters, line breaks and escaped quotes (""), rows end with CRLF, LF or CR.
+ * @param delimiter field delimiter, defaults to ","
+ * @constructor
+ */
+function CsvParser(delimiter) {
+    this.delimiter = delimiter || ',';
+    this.delimiterCode = this.delimiter.charCodeAt(0);
+    this.row = [];
+    this.field = '';
+    this.rowStarted = false;
+    this.inQuotes = false;
+    // a quote was the last character of a quoted field in the previous piece, it either closes the field or escapes a quote
+    this.quotePending = false;
+    // a CR was the last character of the previous piece, a LF starting the next one belongs to the same line break
+    this.crPending = false;
+}
+
+var QUOTE = 34;
+var CR = 13;
+var LF = 10;
+
+CsvParser.prototype._endRow = function(onRow) {
+    this.row.push(this.field);
+    let row = this.row;
+    this.row = [];
+    this.field = '';
+    this.rowStarted = false;
+    onRow(row);
+};
+
+/**
+ * Parse a piece of text
+ * @param {string} text - next piece of the csv data
+ * @param {function} onRow - called with the fields of each complete row
+ */
+CsvParser.prototype.write = function(text, onRow) {
+    let i = 0;
+    let n = text.length;
+    if (n === 0) {
+        return;
+    }
+    if (this.crPending) {
+        this.crPending = false;
+        if (text.charCodeAt(0) === LF) {
+            i = 1;
+        }
+    }
+    if (this.quotePending) {
+        this.quotePending = false;
+        if (text.charCodeAt(i) === QUOTE) {
+            this.field += '"';
+            i += 1;
+        } else {
+            this.inQuotes = false;
+        }
+    }
+    while (i < n) {
+        if (this.inQuotes) {
+            let quoteIdx = text.indexOf('"', i);
+            if (quoteIdx === -1) {
+                this.field += text.substring(i);
+                return;
+            }
+            this.field += text.substring(i, quoteIdx);
+            i = quoteIdx + 1;
+            if (i === n) {
+                this.quotePending = true;
+                return;
+            }
+            if (text.charCodeAt(i) === QUOTE) {
+                this.field += '"';
+                i += 1;
+            } else {
+                this.inQuotes = false;
+            }
+            continue;
+        }
+        let code = text.charCodeAt(i);
+        if (code === this.delimiterCode) {
+            this.row.push(this.field);
+            this.field = '';
+            this.rowStarted = true;
+            i += 1;
+        } else if (code === LF || code === CR) {
+            this._endRow(onRow);
+            i += 1;
+            if (code === CR) {
+                if (i === n) {
+                    this.crPending = true;
+                } else if (text.charCodeAt(i) === LF) {
+                    i += 1;
+                }
+            }
+        } else if (code === QUOTE && this.field.length === 0) {
+            this.inQuotes = true;
+            this.rowStarted = true;
+            i += 1;
+        } else {
+            // copy the run of plain characters at once
+            let start = i;
+            i += 1;
+            while (i < n) {
+                code = text.charCodeAt(i);
+                if (code === this.delimiterCode || code === LF || code === CR || code === QUOTE) {
+                    break;
+                }
+                i += 1;
+            }
+            if (code === QUOTE && i < n) {
+                // a quote inside an unquoted field is kept as is
+                i += 1;
+            }
+            this.field += text.substring(start, i);
+            this.rowStarted = true;
+        }
+    }
+};
+
+/**
+ * Signal the end of the data, the last row is passed to onRow even without a final line break
+ * @param {function} onRow - called with the fields of the last row
+ */
+CsvParser.prototype.end = function(onRow) {
+    this.quotePending = false;
+    this.crPending = false;
+    this.inQuotes = false;
+    if (this.rowStarted || this.field.length > 0) {
+        this._endRow(onRow);
+    }
+};
+
+/**
+ * @returns {boolean} true if no row is partially parsed
+ */
+CsvParser.prototype.isAtRowStart = function() {
+    return !this.rowStarted && this.field.length === 0 && !this.inQuotes && !this.quotePending;
+};
+
+module.exports = {
+    CsvParser:CsvParser
+};
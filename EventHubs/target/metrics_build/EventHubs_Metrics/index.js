@@ -62,21 +62,20 @@ module.exports = function (context, eventHubMessages) {
         // handlers for success and failures
         function failureHandler(msgArray,ctx) {
             ctx.log.error("Failed to send metrics to Sumo");
-            if (this.messagesAttempted === this.messagesReceived) {
-                context.bindings.outputBlob = messageArray.map(function(x) { return JSON.stringify(x);}).join("\n");
-                context.done();
-            }
         }
         function successHandler(ctx) {
             ctx.log('Successfully sent chunk to Sumo');
-            if (this.messagesAttempted === this.messagesReceived) {
-                ctx.log('Sent all metric data to Sumo. Exit now.');
-                context.done();
-            }
         }
 
         context.log("Flushing the rest of the buffers:");
-        sumoMetricClient.flushAll();
+        sumoMetricClient.flushAll().then(function (stats) {
+            if (stats.messagesFailed > 0) {
+                context.bindings.outputBlob = messageArray.map(function(x) { return JSON.stringify(x);}).join("\n");
+            } else {
+                context.log('Sent all metric data to Sumo. Exit now.');
+            }
+            context.done();
+        });
     } else {
         context.log("No messages to send");
         context.log(eventHubMessages);
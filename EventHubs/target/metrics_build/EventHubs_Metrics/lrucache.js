@@ -0,0 +1,65 @@
+/*jshint esversion: 6 */
+/**
+ * Least recently used cache with a max number of entries, the Map insertion order is used as the recency order.
+ * Meant to be created at module level so that entries are reused across invocations on a warm instance.
+ * @param maxEntries max number of entries, the least recently used entry is evicted beyond it
+ * @param ttl optional time to live of the entries in millisecs, an entry set before is not returned anymore
+ * @constructor
+ */
+function LRUCache(maxEntries, ttl) {
+    this.maxEntries = Math.max(1, Number(maxEntries) || 1);
+    this.ttl = Number(ttl) || 0;
+    this.entries = new Map();
+}
+
+/**
+ * @param key
+ * @returns {*} the value of the entry, undefined if not found or expired
+ */
+LRUCache.prototype.get = function(key) {
+    let entry = this.entries.get(key);
+    if (entry === undefined) {
+        return undefined;
+    }
+    this.entries.delete(key);
+    if (entry.expiresAt !== 0 && entry.expiresAt <= Date.now()) {
+        return undefined;
+    }
+    // move the entry to the most recently used end
+    this.entries.set(key, entry);
+    return entry.value;
+};
+
+LRUCache.prototype.set = function(key, value) {
+    this.entries.delete(key);
+    this.entries.set(key, {value: value, expiresAt: this.ttl > 0 ? Date.now() + this.ttl : 0});
+    if (this.entries.size > this.maxEntries) {
+        this.entries.delete(this.entries.keys().next().value);
+    }
+};
+
+/**
+ * @param key
+ * @param {function} create - called with the key to create the value if the key is not in the cache
+ * @returns {*} the value of the entry
+ */
+LRUCache.prototype.getOrCreate = function(key, create) {
+    let value = this.get(key);
+    if (value === undefined) {
+        value = create(key);
+        this.set(key, value);
+    }
+    return value;
+};
+
+LRUCache.prototype.delete = function(key) {
+    return this.entries.delete(key);
+};
+
+LRUCache.prototype.getSize = function() {
+    return this.entries.size;
+};
+
+module.exports = {
+    LRUCache:LRUCache
+};
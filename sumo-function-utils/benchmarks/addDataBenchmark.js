@@ -0,0 +1,51 @@
+/*jshint esversion: 6 */
+/**
+ * Measures the throughput of SumoClient.addData when assigning messages to buckets, compared to computing the bucket key
+ * and the headers of every message as addData used to do.
+ * usage: node benchmarks/addDataBenchmark.js [messageCount] [metadataOverrideCount]
+ */
+var sumoFnUtils = require('../lib/mainindex');
+var bucket = require('../lib/messagebucket');
+
+var messageCount = parseInt(process.argv[2] || '1000000', 10);
+var overrideCount = parseInt(process.argv[3] || '10', 10);
+var context = {'log': function () {}};
+context.log.verbose = context.log.error = context.log;
+var options = {'urlString': 'http://127.0.0.1/receiver/v1/http/benchmark', 'metadata': {'sourceCategory': 'benchmark'}, 'MaxAttempts': 1};
+
+function generateMessages() {
+    let messages = [];
+    for (let i = 0; i < messageCount; i++) {
+        // one message out of two uses the client default headers
+        if (i % 2 === 0 || overrideCount === 0) {
+            messages.push({'value': i});
+        } else {
+            messages.push({'_sumo_metadata': {'category': 'category' + (i % overrideCount), 'sourceName': 'benchmark'}, 'value': i});
+        }
+    }
+    return messages;
+}
+
+// bucket assignment as done before the bucket keys were cached
+function legacyAddData(sumoClient, messages) {
+    messages.forEach(function (message) {
+        let metaKey = sumoClient.generateLogBucketKey(message);
+        if (!sumoClient.dataMap.has(metaKey)) {
+            sumoClient.dataMap.set(metaKey, new bucket.MessageBucket(sumoClient.generateHeaders(message)));
+        }
+        sumoClient.dataMap.get(metaKey).add(message);
+    });
+}
+
+function run(name, addData) {
+    let sumoClient = new sumoFnUtils.SumoClient(options, context, function () {}, function () {});
+    let messages = generateMessages();
+    let start = process.hrtime.bigint();
+    addData(sumoClient, messages);
+    let elapsedMs = Number(process.hrtime.bigint() - start) / 1e6;
+    console.log(name + ': ' + messageCount + ' messages, ' + sumoClient.dataMap.size + ' buckets, ' + elapsedMs.toFixed(1) +
+        ' ms, ' + Math.round(messageCount / elapsedMs * 1000) + ' msgs/sec');
+}
+
+run('legacy', legacyAddData);
+run('cached', (sumoClient, messages) => sumoClient.addData(messages));
@@ -0,0 +1,67 @@
+/*jshint esversion: 6 */
+/**
+ * Compares the boundary search done by the readers before boundaryscanner (substring + search for the first boundary,
+ * substring + match + lastIndexOf for the last one) with boundaryIndexOf/boundaryLastIndexOf on synthetic JSON and log
+ * fixtures.
+ * usage: node benchmarks/boundaryScanBenchmark.js [sizeMB...]
+ */
+var boundaryScanner = require('../lib/boundaryscanner');
+
+var sizesMB = process.argv.length > 2 ? process.argv.slice(2).map(Number) : [50, 200];
+
+function legacyIndexOf(string, regex, startpos) {
+    var indexOf = string.substring(startpos || 0).search(regex);
+    return (indexOf >= 0) ? (indexOf + (startpos || 0)) : indexOf;
+}
+
+function legacyLastIndexOf(string, regex, startpos) {
+    var stringToWorkWith = string.substring(startpos, string.length);
+    var match = stringToWorkWith.match(regex);
+    return match ? string.lastIndexOf(match.slice(-1)) : -1;
+}
+
+// records of about 200 bytes, the range starts and ends in the middle of a record as a blob range usually does
+function generateFixture(sizeBytes, recordFn) {
+    let records = [];
+    let size = 0;
+    for (let i = 0; size < sizeBytes; i++) {
+        let record = recordFn(i);
+        records.push(record);
+        size += record.length;
+    }
+    let data = records.join('');
+    return data.substring(57, data.length - 93);
+}
+
+var fixtures = {
+    'json': {
+        regex: /{\s*"time":/gim,
+        recordFn: (i) => `{"time":"2024-05-07T10:14:${i % 60}.000Z","systemId":"5f1c${i % 997}","category":"NetworkSecurityGroupFlowEvent","properties":{"Version":2,"flows":[]}},\n`
+    },
+    'log': {
+        regex: /\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2}/gim,
+        recordFn: (i) => `2024-05-07 10:14:${String(i % 60).padStart(2, '0')} INFO [worker-${i % 16}] request ${i} completed in ${i % 997} ms user=user${i % 113} status=200 bytes=${i % 65536}\n`
+    }
+};
+
+function time(fn) {
+    let start = process.hrtime.bigint();
+    let result = fn();
+    return [result, Number(process.hrtime.bigint() - start) / 1e6];
+}
+
+sizesMB.forEach(function (sizeMB) {
+    Object.keys(fixtures).forEach(function (name) {
+        let fixture = fixtures[name];
+        let data = generateFixture(sizeMB * 1024 * 1024, fixture.recordFn);
+        let [legacy, legacyMs] = time(() => {
+            let firstIdx = legacyIndexOf(data, fixture.regex);
+            return [firstIdx, legacyLastIndexOf(data, fixture.regex, firstIdx + 1)];
+        });
+        let [scanned, scannedMs] = time(() => {
+            let firstIdx = boundaryScanner.boundaryIndexOf(data, fixture.regex);
+            return [firstIdx, boundaryScanner.boundaryLastIndexOf(data, fixture.regex, firstIdx + 1)];
+        });
+        console.log(`${name} ${sizeMB}MB: legacy ${legacyMs.toFixed(1)} ms, boundaryscanner ${scannedMs.toFixed(1)} ms, same boundaries: ${legacy[0] === scanned[0] && legacy[1] === scanned[1]}`);
+    });
+});
@@ -0,0 +1,180 @@
+/*jshint esversion: 6 */
+/**
+ * Byte level tokenizer splitting a stream of top level JSON objects ({..},{..} or one object per line) into records, so
+ * that each record can be parsed on its own as the data is downloaded instead of parsing the whole range at once.
+ * Only the structural characters, which are ASCII, are looked at, so multibyte UTF-8 characters never need decoding.
+ * Unexpected bytes between records (e.g. the end of a truncated record at the start of the range) are skipped until the
+ * next match of syncRegex, or the next "{" if it is not set, and a record not closed when the data ends is left out.
+ */
+
+var QUOTE = 0x22;
+var BACKSLASH = 0x5c;
+var LBRACE = 0x7b;
+var RBRACE = 0x7d;
+var LBRACKET = 0x5b;
+var RBRACKET = 0x5d;
+var COMMA = 0x2c;
+var SPACE = 0x20;
+var TAB = 0x09;
+var LF = 0x0a;
+var CR = 0x0d;
+// bytes kept at the end of a skipped buffer, so that a syncRegex match split between two buffers is found
+var SKIP_TAIL_BYTES = 256;
+
+/**
+ * @param options - optional syncRegex, the regex matching the start of a record, e.g. /{\s*"time":/
+ * @constructor
+ */
+function JsonRecordTokenizer(options) {
+    options = options || {};
+    this.syncRegex = options.syncRegex ? new RegExp(options.syncRegex.source || options.syncRegex, 'g') : null;
+    this.depth = 0;
+    this.inString = false;
+    this.escaped = false;
+    // pieces of the current record received in the previous buffers
+    this.parts = [];
+    // bytes written before the current buffer
+    this.offset = 0;
+    // offset of the start of the current record, -1 between records
+    this.recordStart = -1;
+    // offset after the last complete record and the separators following it
+    this.consumed = 0;
+    this.numRecords = 0;
+    this.skipping = false;
+    this.skippedBytes = 0;
+    this.skipTail = null;
+}
+
+/*
+    Skips bytes from index i until the next record start, returns the index of the record start or the buffer length
+ */
+JsonRecordTokenizer.prototype._skip = function(buffer, i) {
+    let n = buffer.length;
+    let idx = -1;
+    if (this.syncRegex) {
+        // latin1 maps each byte to a single character, so that the match index is a byte index
+        this.syncRegex.lastIndex = 0;
+        let match = this.syncRegex.exec(buffer.toString('latin1', i));
+        idx = match ? i + match.index : -1;
+    } else {
+        idx = buffer.indexOf(LBRACE, i);
+    }
+    if (idx === -1) {
+        let tailStart = Math.max(i, n - SKIP_TAIL_BYTES);
+        this.skippedBytes += tailStart - i;
+        this.skipTail = buffer.subarray(tailStart);
+        return n;
+    }
+    this.skippedBytes += idx - i;
+    this.skipping = false;
+    return idx;
+};
+
+/**
+ * @param {Buffer} buffer - next bytes of the data
+ * @param {function} onRecord - called with the text of each complete record, its start and end offset in the data
+ */
+JsonRecordTokenizer.prototype.write = function(buffer, onRecord) {
+    if (this.skipTail) {
+        // scan the end of the previous buffer again with the new one
+        this.offset -= this.skipTail.length;
+        buffer = Buffer.concat([this.skipTail, buffer]);
+        this.skipTail = null;
+    }
+    let n = buffer.length;
+    let i = 0;
+    let segStart = this.recordStart >= 0 ? 0 : -1;
+    while (i < n) {
+        if (this.skipping) {
+            i = this._skip(buffer, i);
+            continue;
+        }
+        if (this.depth === 0) {
+            let b = buffer[i];
+            if (b === LBRACE) {
+                this.depth = 1;
+                this.recordStart = this.offset + i;
+                segStart = i;
+                i += 1;
+            } else if (b === COMMA || b === SPACE || b === LF || b === CR || b === TAB) {
+                i += 1;
+                this.consumed = this.offset + i;
+            } else {
+                this.skipping = true;
+            }
+            continue;
+        }
+        let depth = this.depth;
+        let inString = this.inString;
+        let escaped = this.escaped;
+        for (; i < n; i++) {
+            let b = buffer[i];
+            if (inString) {
+                if (escaped) {
+                    escaped = false;
+                } else if (b === BACKSLASH) {
+                    escaped = true;
+                } else if (b === QUOTE) {
+                    inString = false;
+                }
+            } else if (b === QUOTE) {
+                inString = true;
+            } else if (b === LBRACE || b === LBRACKET) {
+                depth += 1;
+            } else if (b === RBRACE || b === RBRACKET) {
+                depth -= 1;
+                if (depth === 0) {
+                    i += 1;
+                    break;
+                }
+            }
+        }
+        this.depth = depth;
+        this.inString = inString;
+        this.escaped = escaped;
+        if (depth === 0) {
+            let text;
+            if (this.parts.length > 0) {
+                this.parts.push(buffer.subarray(segStart, i));
+                text = Buffer.concat(this.parts).toString('utf8');
+                this.parts = [];
+            } else {
+                text = buffer.toString('utf8', segStart, i);
+            }
+            let recordStart = this.recordStart;
+            this.recordStart = -1;
+            segStart = -1;
+            this.consumed = this.offset + i;
+            this.numRecords += 1;
+            onRecord(text, recordStart, this.consumed);
+        }
+    }
+    if (segStart >= 0) {
+        this.parts.push(buffer.subarray(segStart));
+    }
+    this.offset += n;
+};
+
+/**
+ * Signal the end of the data
+ * @returns {{numRecords: number, consumed: number, skippedBytes: number, incompleteBytes: number}} - consumed is the
+ * offset after the last complete record and its separators, incompleteBytes the length of the record left out at the end
+ */
+JsonRecordTokenizer.prototype.end = function() {
+    if (this.skipTail) {
+        this.skippedBytes += this.skipTail.length;
+        this.skipTail = null;
+    }
+    let incompleteBytes = this.recordStart >= 0 ? this.offset - this.recordStart : 0;
+    this.parts = [];
+    return {
+        numRecords: this.numRecords,
+        consumed: this.consumed,
+        skippedBytes: this.skippedBytes,
+        incompleteBytes: incompleteBytes
+    };
+};
+
+module.exports = {
+    JsonRecordTokenizer:JsonRecordTokenizer
+};
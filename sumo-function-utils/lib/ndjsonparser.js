@@ -0,0 +1,129 @@
+/*jshint esversion: 6 */
+/**
+ * Parser of newline delimited JSON (e.g. the .blob files of the Application Insights continuous export) fed with the
+ * bytes of the data as it is downloaded. Each line is parsed on its own, so a malformed line is reported with its
+ * position and skipped instead of failing the whole range. NUL characters (e.g. padding at the end of a file) and blank
+ * lines are ignored.
+ */
+
+var LF = 0x0a;
+var NUL_CHARS = /\u0000/g;
+var BLANK = /^\s*$/;
+
+/**
+ * @param options - optional onError(error, start, end), called with the error and the offsets in the data of each line
+ * which cannot be parsed
+ * @constructor
+ */
+function NdjsonParser(options) {
+    options = options || {};
+    this.onError = options.onError || function () {};
+    // pieces of the current line received in the previous buffers
+    this.parts = [];
+    this.partsLength = 0;
+    // bytes written before the current buffer
+    this.offset = 0;
+    // offset after the last line break
+    this.consumed = 0;
+    this.numRecords = 0;
+    this.badLines = 0;
+    this.skippedBytes = 0;
+}
+
+/*
+    Parses the line from start to end (excluding the line break) of data, returns true or the parse error
+ */
+NdjsonParser.prototype._parseLine = function(data, start, end, onRecord) {
+    let text = data.toString('utf8', start, end);
+    if (text.indexOf('\u0000') !== -1) {
+        text = text.replace(NUL_CHARS, '');
+    }
+    if (BLANK.test(text)) {
+        return true;
+    }
+    let record;
+    try {
+        record = JSON.parse(text);
+    } catch (error) {
+        return error;
+    }
+    this.numRecords += 1;
+    onRecord(record);
+    return true;
+};
+
+NdjsonParser.prototype._badLine = function(error, start, end) {
+    this.badLines += 1;
+    this.skippedBytes += end - start;
+    this.onError(error, start, end);
+};
+
+/**
+ * @param {Buffer} buffer - next bytes of the data
+ * @param {function} onRecord - called with each parsed record
+ */
+NdjsonParser.prototype.write = function(buffer, onRecord) {
+    let start = 0;
+    let lineBreak = buffer.indexOf(LF);
+    if (lineBreak !== -1 && this.partsLength > 0) {
+        // line started in the previous buffers
+        this.parts.push(buffer.subarray(0, lineBreak));
+        let line = Buffer.concat(this.parts);
+        let lineStart = this.offset - this.partsLength;
+        this.parts = [];
+        this.partsLength = 0;
+        let result = this._parseLine(line, 0, line.length, onRecord);
+        if (result !== true) {
+            this._badLine(result, lineStart, this.offset + lineBreak);
+        }
+        start = lineBreak + 1;
+        lineBreak = buffer.indexOf(LF, start);
+    }
+    while (lineBreak !== -1) {
+        let result = this._parseLine(buffer, start, lineBreak, onRecord);
+        if (result !== true) {
+            this._badLine(result, this.offset + start, this.offset + lineBreak);
+        }
+        start = lineBreak + 1;
+        lineBreak = buffer.indexOf(LF, start);
+    }
+    if (start > 0) {
+        this.consumed = this.offset + start;
+    }
+    if (start < buffer.length) {
+        this.parts.push(buffer.subarray(start));
+        this.partsLength += buffer.length - start;
+    }
+    this.offset += buffer.length;
+};
+
+/**
+ * Signal the end of the data, the last line is parsed even without a line break
+ * @returns {{numRecords: number, consumed: number, skippedBytes: number, incompleteBytes: number, badLines: number}} -
+ * consumed is the offset after the last complete line, incompleteBytes the length of the last line if it has no line
+ * break and cannot be parsed, as it may be completed later
+ */
+NdjsonParser.prototype.end = function(onRecord) {
+    let incompleteBytes = 0;
+    if (this.partsLength > 0) {
+        let line = Buffer.concat(this.parts);
+        if (this._parseLine(line, 0, line.length, onRecord) === true) {
+            this.consumed = this.offset;
+        } else {
+            incompleteBytes = line.length;
+        }
+        this.parts = [];
+        this.partsLength = 0;
+    }
+    return {
+        numRecords: this.numRecords,
+        consumed: this.consumed,
+        skippedBytes: this.skippedBytes,
+        incompleteBytes: incompleteBytes,
+        badLines: this.badLines
+    };
+};
+
+module.exports = {
+    NdjsonParser:NdjsonParser
+};
@@ -2,14 +2,27 @@
 /**
  * Created by duc on 6/30/17.
  */
+var http = require('node:http');
 var https = require('node:https');
 var zlib = require('node:zlib');
 var url = require('node:url');
 
 var bucket = require('./messagebucket');
+var scheduler = require('./sendscheduler');
 var sumoutils = require('./sumoutils.js');
 var httpAgent = new https.Agent();
 httpAgent.maxSockets = 200;
+// plain http is only used when the endpoint is not https, e.g. a local stub in tests and benchmarks
+var plainHttpAgent = new http.Agent();
+plainHttpAgent.maxSockets = 200;
+// Sumo HTTP sources prefer requests of about 1MB of uncompressed data
+var DEFAULT_MAX_PAYLOAD_BYTES = 1024 * 1024;
+var DEFAULT_MAX_PIPELINED_REQUESTS = 4;
+var DEFAULT_MAX_CONCURRENT_REQUESTS = 20;
+// retries have to fit in the function timeout (10 min by default)
+var DEFAULT_RETRY_TIME_BUDGET = 5 * 60 * 1000;
+// number of distinct _sumo_metadata overrides memoized per client
+var MAX_CACHED_BUCKET_KEYS = 1000;
 
 var metadataMap  = {"sourceCategory":"X-Sumo-Category","sourceName":"X-Sumo-Name","sourceHost":"X-Sumo-Host", "sourceFields": "X-Sumo-Fields"};
 /**
@@ -17,10 +30,15 @@ var metadataMap  = {"sourceCategory":"X-Sumo-Category","sourceName":"X-Sumo-Name
  * of messages sent successfully to Sumo and develop their own failure handling for those failed to be sent (out of this batch). It is of course
  * totally fine to use a single client for multiple batches for a best effort delivery option.
  * @param options contains information needed for the client including: the endpoint (via the parameter urlString),  max number of retries, a generateBucketKey function (optional)
+ * and the streaming flush settings (streaming_flush, max_payload_bytes, max_compressed_payload_bytes, max_pipelined_requests).
+ * Requests go through a send scheduler limited to max_concurrent_requests in flight, a SendScheduler can be shared between
+ * clients with the send_scheduler option. addData returns false once max_queued_requests are queued, see waitForCapacity.
+ * A bucket is flushed as soon as it holds max_bucket_messages messages or max_bucket_bytes bytes of serialized messages, or
+ * max_bucket_age_ms after its first message was added.
  * @param context must support method "log".
  * @param flush_failure_callback is a callback function used to handle failures (after all attempts)
- * @param success_callback is a callback function when each batch is sent successfully to Sumo. It should contain some logic to determine all data sent to the client
- * has been attempted to sent to Sumo (either successfully or over max retries).
+ * @param success_callback is a callback function when each batch is sent successfully to Sumo. Callers should rather wait for
+ * the promise returned by flushAll or close which resolves with the delivery stats once all the data has been attempted.
  * @constructor
  */
 function SumoClient(options, context, flush_failure_callback, success_callback) {
@@ -30,6 +48,9 @@ function SumoClient(options, context, flush_failure_callback, success_callback)
         myOptions.hostname = urlObj.hostname;
         myOptions.path = urlObj.pathname;
         myOptions.protocol = urlObj.protocol;
+        if (urlObj.port) {
+            myOptions.port = urlObj.port;
+        }
     }
     myOptions.method ='POST';
     this.options = myOptions;
@@ -39,15 +60,36 @@ function SumoClient(options, context, flush_failure_callback, success_callback)
     this.messagesSent = 0;
     this.messagesAttempted = 0;
     this.messagesFailed = 0;
+    // number of responses other than 200 by status code, including the retried ones, e.g. {429: 2}
+    this.failedStatusCodes = {};
     this.dataMap = new Map();
     this.context = context || console;
     this.generateBucketKey = options.generateBucketKey || this.generateLogBucketKey ;
     this.MaxAttempts = (this.options.MaxAttempts === undefined ? 3 : this.options.MaxAttempts);
     this.RetryInterval = this.options.RetryInterval || 3000; // 3 secs
-    this.failure_callback = flush_failure_callback;
-    this.success_callback = success_callback;
+    // exponential backoff with jitter starting at RetryInterval, capped by MaxRetryInterval and RetryTimeBudget
+    this.retryPolicy = new sumoutils.RetryPolicy({
+        maxAttempts: this.MaxAttempts,
+        baseDelay: this.RetryInterval,
+        maxDelay: this.options.MaxRetryInterval,
+        timeBudget: (this.options.RetryTimeBudget === undefined ? DEFAULT_RETRY_TIME_BUDGET : this.options.RetryTimeBudget)
+    });
+    this.failure_callback = flush_failure_callback || FlushFailureHandler;
+    this.success_callback = success_callback || function () {};
     this._timerID = null;
     this._timerInterval = null;
+    // in-progress streaming flushes keyed by metaKey, a bucket is only ever streamed by one flush at a time
+    this._activeStreams = new Map();
+    // bucket key and headers of messages without _sumo_metadata, and of each override seen so far
+    this._defaultBucketKey = null;
+    this._bucketKeyCache = new Map();
+    // age timers of the buckets keyed by metaKey, only used with max_bucket_age_ms
+    this._bucketTimers = new Map();
+    // flushes not settled yet and delivery stats keyed by metaKey
+    this._pendingFlushes = new Map();
+    this.bucketStats = new Map();
+    this.scheduler = this.options.send_scheduler || new scheduler.SendScheduler(this.options.max_concurrent_requests || DEFAULT_MAX_CONCURRENT_REQUESTS);
+    this.maxQueuedRequests = this.options.max_queued_requests || 2 * this.scheduler.maxInFlight;
     if (this.options.timerinterval)  {
         this.enableTimer(this.options.timerinterval);
     }
@@ -108,124 +150,554 @@ SumoClient.prototype.generateLogBucketKey = function(message) {
     return JSON.stringify(this.generateHeaders(message, false));
 };
 
+/**
+ * Canonical form of a _sumo_metadata override, cheap to compute and independent of the property order
+ * @param metadataOverride the _sumo_metadata of a message
+ * @returns {string}
+ */
+function canonicalMetadata(metadataOverride) {
+    let properties = Object.getOwnPropertyNames(metadataOverride).sort();
+    let canonical = '';
+    for (let i = 0; i < properties.length; i++) {
+        let value = metadataOverride[properties[i]];
+        canonical += properties[i] + '\u0000' + ((value instanceof Object) ? JSON.stringify(value) : String(value)) + '\u0001';
+    }
+    return canonical;
+}
+
+/**
+ * Memoized version of generateLogBucketKey/generateHeaders. Headers only depend on the client options and on the
+ * _sumo_metadata of the message so they are computed once for messages without metadata and once per distinct override.
+ * @param message input message
+ * @return {Object} the bucket key and the headers object of the message
+ */
+SumoClient.prototype.getBucketKey = function(message) {
+    if (!(message instanceof Object) || !message.hasOwnProperty('_sumo_metadata')) {
+        if (this._defaultBucketKey === null) {
+            let headers = this.generateHeaders({}, false);
+            this._defaultBucketKey = {key: JSON.stringify(headers), headers: headers};
+        }
+        return this._defaultBucketKey;
+    }
+    let canonical = canonicalMetadata(message._sumo_metadata);
+    let bucketKey = this._bucketKeyCache.get(canonical);
+    if (bucketKey === undefined) {
+        if (this._bucketKeyCache.size >= MAX_CACHED_BUCKET_KEYS) {
+            this._bucketKeyCache.clear();
+        }
+        let headers = this.generateHeaders(message, false);
+        bucketKey = {key: JSON.stringify(headers), headers: headers};
+        this._bucketKeyCache.set(canonical, bucketKey);
+    }
+    return bucketKey;
+};
+
+/**
+ * Return the bucket for a message, the bucket is created if needed
+ * @param message input message
+ * @param bucketKey optional result of getBucketKey for the message
+ * @return {MessageBucket}
+ */
+SumoClient.prototype.getBucket = function(message, bucketKey) {
+    bucketKey = bucketKey || this.getBucketKey(message);
+    let targetBucket = this.dataMap.get(bucketKey.key);
+    if (targetBucket === undefined) {
+        targetBucket = new bucket.MessageBucket(bucketKey.headers);
+        this.dataMap.set(bucketKey.key, targetBucket);
+        // as generateHeaders does, the metadata is removed from the message creating the bucket
+        if (message instanceof Object && message.hasOwnProperty('_sumo_metadata')) {
+            delete message._sumo_metadata;
+        }
+    }
+    return targetBucket;
+};
+
+/**
+ * Flush a bucket which reached max_bucket_messages or max_bucket_bytes, or start its age timer when max_bucket_age_ms is set.
+ * Should be called after each message added to the bucket.
+ * @param {string} metaKey - key to identify the buffer from the internal map
+ * @param {MessageBucket} targetBucket - the bucket the message was added to
+ */
+SumoClient.prototype.checkBucketThresholds = function(metaKey, targetBucket) {
+    let maxMessages = this.options.max_bucket_messages;
+    let maxBytes = this.options.max_bucket_bytes;
+    if ((maxMessages && targetBucket.getSize() >= maxMessages) || (maxBytes && targetBucket.getBytes() >= maxBytes)) {
+        this.flushBucketToSumo(metaKey);
+    } else if (this.options.max_bucket_age_ms && !this._bucketTimers.has(metaKey)) {
+        var self = this;
+        this._bucketTimers.set(metaKey, setTimeout(function () {
+            self._bucketTimers.delete(metaKey);
+            self.flushBucketToSumo(metaKey);
+        }, this.options.max_bucket_age_ms));
+    }
+};
+
+SumoClient.prototype.clearBucketTimer = function(metaKey) {
+    let timerID = this._bucketTimers.get(metaKey);
+    if (timerID !== undefined) {
+        clearTimeout(timerID);
+        this._bucketTimers.delete(metaKey);
+    }
+};
+
+/**
+ * Keep track of a flush until it settles so that flushAll can wait for it
+ * @param {Promise} flushPromise - promise of a flush
+ * @returns {Promise} - settles with the flush, errors (thrown by the callbacks) are logged instead of rejecting
+ */
+SumoClient.prototype.trackFlush = function(flushPromise) {
+    var self = this;
+    let settled = this._pendingFlushes.get(flushPromise);
+    if (settled === undefined) {
+        settled = flushPromise.catch(function (err) {
+            self.context.log.error("Error while flushing to Sumo: " + err);
+        }).then(function () {
+            self._pendingFlushes.delete(flushPromise);
+        });
+        this._pendingFlushes.set(flushPromise, settled);
+    }
+    return settled;
+};
+
+SumoClient.prototype.recordBucketStats = function(metaKey, sent, failed) {
+    let stats = this.bucketStats.get(metaKey);
+    if (stats === undefined) {
+        stats = {'metaKey': metaKey, 'messagesSent': 0, 'messagesFailed': 0};
+        this.bucketStats.set(metaKey, stats);
+    }
+    stats.messagesSent += sent;
+    stats.messagesFailed += failed;
+};
+
+/**
+ * @returns {Object} delivery stats of the client with the stats of each bucket
+ */
+SumoClient.prototype.getStats = function() {
+    return {
+        'messagesReceived': this.messagesReceived,
+        'messagesAttempted': this.messagesAttempted,
+        'messagesSent': this.messagesSent,
+        'messagesFailed': this.messagesFailed,
+        'failedStatusCodes': Object.assign({}, this.failedStatusCodes),
+        'buckets': Array.from(this.bucketStats.values(), (stats) => Object.assign({}, stats))
+    };
+};
+
+/**
+ * Wait for all the flushes in progress, including the ones started while waiting
+ * @returns {Promise} - resolves with the delivery stats, see getStats
+ */
+SumoClient.prototype.whenFlushed = function() {
+    var self = this;
+    if (this._pendingFlushes.size === 0) {
+        return Promise.resolve(this.getStats());
+    }
+    return Promise.all(Array.from(this._pendingFlushes.values())).then(function () {
+        return self.whenFlushed();
+    });
+};
+
 SumoClient.prototype.emptyBufferToSumo = function(metaKey) {
     let targetBuffer = this.dataMap.get(metaKey);
     if (targetBuffer) {
-        let message;
-        while ((message = targetBuffer.pop())) {
-        }
+        targetBuffer.drain();
     }
 };
 
 
+/**
+ * Send a single payload to Sumo, messageArray is the list of messages contained in data
+ * @param {Object} curOptions - request options including headers
+ * @param {Array} messageArray - messages in the payload, used to keep track of the delivery status
+ * @param {string|Buffer} data - payload, compressed if Content-Encoding is set
+ * @returns {Promise}
+ */
+SumoClient.prototype.httpSend = function(curOptions, messageArray, data) {
+    var self = this;
+    var transport = (curOptions.protocol === 'http:') ? http : https;
+    return new Promise( (resolve,reject) => {
+        var req = transport.request(curOptions, function (res) {
+            var body = '';
+            res.setEncoding('utf8');
+            res.on('data', function (chunk) {
+                body += chunk; // don't really do anything with body
+            });
+            res.on('end', function () {
+                if (res.statusCode == 200) {
+                    self.messagesSent += messageArray.length;
+                    self.messagesAttempted += messageArray.length;
+                    resolve(body);
+                    // TODO: anything here?
+                } else {
+                    self.failedStatusCodes[res.statusCode] = (self.failedStatusCodes[res.statusCode] || 0) + 1;
+                    reject({'error':"statusCode: " + res.statusCode + " statusMessage: " + res.statusMessage + " body: " + body, 'res':null, 'statusCode':res.statusCode, 'retryAfter':res.headers['retry-after']});
+                }
+                // TODO: finalizeContext();
+            });
+        });
+
+        req.on('error', function (e) {
+            reject({'error':e,'res':null});
+            // TODO: finalizeContext();
+        });
+        req.write(data);
+        req.end();
+    });
+};
+
+/**
+ * Queue a payload in the send scheduler, it is sent with up to MaxAttempts (following the retry policy) once a slot is available
+ * @param {string} metaKey - key of the bucket the payload comes from, used for fair scheduling across buckets
+ * @param {Object} curOptions - request options including headers
+ * @param {Array} messageArray - messages in the payload
+ * @param {string|Buffer} data - payload
+ * @returns {Promise} - resolves once the payload is sent, rejects after the last failed attempt
+ */
+SumoClient.prototype.scheduleSend = function(metaKey, curOptions, messageArray, data) {
+    var self = this;
+    return this.scheduler.schedule(metaKey, function () {
+        return self.retryPolicy.execute(self.httpSend.bind(self),[curOptions,messageArray,data], self.context);
+    });
+};
+
+/**
+ * Wait until the number of queued requests drops below max_queued_requests, to be used when addData returns false
+ * @returns {Promise}
+ */
+SumoClient.prototype.waitForCapacity = function() {
+    return this.scheduler.whenBelow(this.maxQueuedRequests - 1);
+};
+
+/**
+ * Build the request options used to send a payload
+ * @param {Object} headers - headers of the bucket the payload comes from
+ * @returns {Object} request options, headers are copied so the bucket headers are left untouched
+ */
+SumoClient.prototype.getRequestOptions = function(headers) {
+    let curOptions = Object.assign({agent: (this.options.protocol === 'http:') ? plainHttpAgent : httpAgent},this.options);
+    curOptions.headers = Object.assign({}, headers);
+    if (curOptions.compress_data) {
+        curOptions.headers['Content-Encoding'] = 'gzip';
+    }
+    return curOptions;
+};
+
 /**
  * Flush a whole message bucket to sumo, compress data if needed and with up to MaxAttempts
+ * When streaming_flush is set the bucket is streamed as size bounded requests instead, see streamBucketToSumo.
  * @param {string} metaKey - key to identify the buffer from the internal map
+ * @returns {Promise} - resolves once the messages of the bucket have been attempted, never rejects
  */
 SumoClient.prototype.flushBucketToSumo = function(metaKey) {
+    this.clearBucketTimer(metaKey);
+    if (this.options.streaming_flush) {
+        return this.trackFlush(this.streamBucketToSumo(metaKey));
+    }
     let targetBuffer = this.dataMap.get(metaKey);
     var self = this;
-    let curOptions = Object.assign({agent: httpAgent},this.options);
     this.context.log.verbose("Flush buffer for metaKey:"+metaKey);
 
-    function httpSend(messageArray,data) {
-        return new Promise( (resolve,reject) => {
-            var req = https.request(curOptions, function (res) {
-                var body = '';
-                res.setEncoding('utf8');
-                res.on('data', function (chunk) {
-                    body += chunk; // don't really do anything with body
-                });
-                res.on('end', function () {
-                    if (res.statusCode == 200) {
-                        self.messagesSent += messageArray.length;
-                        self.messagesAttempted += messageArray.length;
-                        resolve(body);
-                        // TODO: anything here?
+    if (targetBuffer && targetBuffer.getSize() > 0) {
+        let curOptions = this.getRequestOptions(targetBuffer.getHeadersObject());
+        // messages are serialized in place in the drained array
+        let msgArray = targetBuffer.drain();
+        for (let i = 0; i < msgArray.length; i++) {
+            if (msgArray[i] instanceof Object) {
+                msgArray[i] = JSON.stringify(msgArray[i]);
+            }
+        }
+
+        function onSuccess() {
+            self.recordBucketStats(metaKey, msgArray.length, 0);
+            self.success_callback(self.context);
+        }
+
+        function onFailure(errorMessage) {
+            self.messagesFailed += msgArray.length;
+            self.messagesAttempted += msgArray.length;
+            self.recordBucketStats(metaKey, 0, msgArray.length);
+            self.context.log.error(errorMessage + ' messagesAttempted: ' + self.messagesAttempted  + ' messagesReceived: ' + self.messagesReceived);
+            self.failure_callback(msgArray,self.context);
+        }
+
+        if (curOptions.compress_data) {
+            return this.trackFlush(new Promise(function (resolve) {
+                zlib.gzip(msgArray.join('\n'),function(gziperr, compressed_data){
+                    if (!gziperr)  {
+                        self.context.log.verbose("gzip successful");
+                        resolve(self.scheduleSend(metaKey,curOptions,msgArray,compressed_data).then(()=> {
+                            self.context.log.verbose("Successfully sent to Sumo after "+self.MaxAttempts);
+                            onSuccess();
+                        }).catch((err) => {
+                            onFailure("Failed to send after maxattempts: " + self.MaxAttempts + " error: " + JSON.stringify(err));
+                        }));
                     } else {
-                        reject({'error':"statusCode: " + res.statusCode + " statusMessage: " + res.statusMessage + " body: " + body, 'res':null});
+                        self.context.log("Failed to gzip data gziperr: ", gziperr);
+                        onFailure("Failed to gzip: " + JSON.stringify(gziperr));
+                        resolve();
                     }
-                    // TODO: finalizeContext();
                 });
-            });
+            }));
+        }  else {
+            return this.trackFlush(self.scheduleSend(metaKey,curOptions,msgArray,msgArray.join('\n')).then(()=> {
+                onSuccess();
+            }).catch((err) => {
+                onFailure("Failed to send to Sumo after maxattempts: " + self.MaxAttempts + " " + JSON.stringify(err));
+            }));
+        }
+    }
+    return Promise.resolve();
+};
 
-            req.on('error', function (e) {
-                reject({'error':e,'res':null});
-                // TODO: finalizeContext();
-            });
-            req.write(data);
-            req.end();
+/**
+ * Accumulates the serialized messages of a single request, gzipping them on the fly when compression is enabled.
+ * @param {boolean} compress - whether the payload is gzipped
+ * @constructor
+ */
+function PayloadWriter(compress) {
+    var self = this;
+    this.messages = [];
+    this.rawBytes = 0;
+    this.compressedBytes = 0;
+    this.parts = [];
+    this.gzip = null;
+    if (compress) {
+        this.gzip = zlib.createGzip();
+        this.gzip.on('data', function (part) {
+            self.parts.push(part);
+            self.compressedBytes += part.length;
         });
     }
+}
 
-    if (targetBuffer) {
-        curOptions.headers = targetBuffer.getHeadersObject();
-        let msgArray = [];
-        let message;
-        while (targetBuffer.getSize()>0) {
-            message = targetBuffer.remove();
-            if (message instanceof Object) {
-                msgArray.push(JSON.stringify(message));
-            } else {
-                msgArray.push(message);
-            }
-        }
+/**
+ * Append a serialized message to the payload
+ * @param {string} line - serialized message
+ * @returns {Promise|null} a promise to wait on when the gzip stream asks for backpressure, null otherwise
+ */
+PayloadWriter.prototype.write = function(line) {
+    let data = (this.messages.length > 0) ? '\n' + line : line;
+    this.messages.push(line);
+    this.rawBytes += Buffer.byteLength(data);
+    if (this.gzip && !this.gzip.write(data)) {
+        let gzip = this.gzip;
+        return new Promise(function (resolve) { gzip.once('drain', resolve); });
+    }
+    return null;
+};
 
-        if (curOptions.compress_data) {
-            curOptions.headers['Content-Encoding'] = 'gzip';
-            return zlib.gzip(msgArray.join('\n'),function(gziperr, compressed_data){
-                if (!gziperr)  {
-                    self.context.log.verbose("gzip successful");
-                    return sumoutils.p_retryMax(httpSend,self.MaxAttempts,self.RetryInterval,[msgArray,compressed_data], self.context).then(()=> {
-                        self.context.log.verbose("Successfully sent to Sumo after "+self.MaxAttempts);
-                        self.success_callback(self.context);
-                    }).catch((err) => {
-                        self.messagesFailed += msgArray.length;
-                        self.messagesAttempted += msgArray.length;
-                        self.context.log.error("Failed to send after maxattempts: " + self.MaxAttempts + " error: " + JSON.stringify(err) + ' messagesAttempted: ' + self.messagesAttempted  + ' messagesReceived: ' + self.messagesReceived);
-                        self.failure_callback(msgArray,self.context);
-                    });
+PayloadWriter.prototype.isFull = function(maxPayloadBytes, maxCompressedPayloadBytes) {
+    return (this.rawBytes >= maxPayloadBytes) || (this.gzip !== null && maxCompressedPayloadBytes > 0 && this.compressedBytes >= maxCompressedPayloadBytes);
+};
 
-                } else {
-                    self.context.log("Failed to gzip data gziperr: ", gziperr);
-                    self.messagesFailed += msgArray.length;
-                    self.messagesAttempted += msgArray.length;
-                    self.context.log.error("Failed to gzip: " + JSON.stringify(e) + ' messagesAttempted: ' + self.messagesAttempted  + ' messagesReceived: ' + self.messagesReceived);
-                    self.failure_callback(msgArray,self.context);
+/**
+ * Close the payload
+ * @returns {Promise} - resolves to the payload, a Buffer when compressed and a string otherwise
+ */
+PayloadWriter.prototype.end = function() {
+    var self = this;
+    if (!this.gzip) {
+        return Promise.resolve(this.messages.join('\n'));
+    }
+    return new Promise(function (resolve, reject) {
+        self.gzip.once('error', reject);
+        self.gzip.once('end', function () {
+            resolve(Buffer.concat(self.parts, self.compressedBytes));
+        });
+        self.gzip.end();
+    });
+};
+
+/**
+ * Stream a message bucket to Sumo as a sequence of size bounded requests. Messages are serialized in order into a payload
+ * (gzipped on the fly if compress_data is set) which is cut into a new request once it reaches max_payload_bytes of raw data
+ * or max_compressed_payload_bytes of compressed data. Up to max_pipelined_requests requests of the bucket are kept queued or in
+ * flight so the memory used is bounded by a few payloads rather than by the size of the bucket.
+ * @param {string} metaKey - key to identify the buffer from the internal map
+ * @returns {Promise} - resolves once all the messages of the bucket have been attempted
+ */
+SumoClient.prototype.streamBucketToSumo = function(metaKey) {
+    let targetBuffer = this.dataMap.get(metaKey);
+    var self = this;
+    if (!targetBuffer) {
+        return Promise.resolve();
+    }
+    if (this._activeStreams.has(metaKey)) {
+        // the running flush keeps draining the bucket until it is empty
+        return this._activeStreams.get(metaKey);
+    }
+    this.context.log.verbose("Stream buffer for metaKey:"+metaKey);
+    let curOptions = this.getRequestOptions(targetBuffer.getHeadersObject());
+    let maxPayloadBytes = this.options.max_payload_bytes || DEFAULT_MAX_PAYLOAD_BYTES;
+    let maxCompressedPayloadBytes = this.options.max_compressed_payload_bytes || 0;
+    let maxPipelinedRequests = this.options.max_pipelined_requests || DEFAULT_MAX_PIPELINED_REQUESTS;
+    let inFlight = new Set();
+
+    function failPayload(msgArray, err) {
+        self.messagesFailed += msgArray.length;
+        self.messagesAttempted += msgArray.length;
+        self.recordBucketStats(metaKey, 0, msgArray.length);
+        self.context.log.error("Failed to send after maxattempts: " + self.MaxAttempts + " error: " + JSON.stringify(err) + ' messagesAttempted: ' + self.messagesAttempted  + ' messagesReceived: ' + self.messagesReceived);
+        self.failure_callback(msgArray,self.context);
+    }
+
+    function sendPayload(msgArray, data) {
+        let request = self.scheduleSend(metaKey,curOptions,msgArray,data).then(()=> {
+            self.recordBucketStats(metaKey, msgArray.length, 0);
+            self.success_callback(self.context);
+        }).catch((err) => {
+            failPayload(msgArray, err);
+        }).then(() => {
+            inFlight.delete(request);
+        });
+        inFlight.add(request);
+    }
+
+    async function cutPayload(writer) {
+        let data;
+        try {
+            data = await writer.end();
+        } catch (gziperr) {
+            failPayload(writer.messages, gziperr);
+            return;
+        }
+        while (inFlight.size >= maxPipelinedRequests) {
+            await Promise.race(inFlight);
+        }
+        sendPayload(writer.messages, data);
+    }
+
+    async function streamLoop() {
+        let writer = null;
+        let messages, message, pending;
+        while (true) {
+            while (targetBuffer.getSize()>0) {
+                messages = targetBuffer.drain();
+                for (let i = 0; i < messages.length; i++) {
+                    message = messages[i];
+                    // drop the reference as soon as the message is serialized
+                    messages[i] = undefined;
+                    writer = writer || new PayloadWriter(curOptions.compress_data);
+                    pending = writer.write((message instanceof Object) ? JSON.stringify(message) : message);
+                    if (pending) {
+                        await pending;
+                    }
+                    if (writer.isFull(maxPayloadBytes, maxCompressedPayloadBytes)) {
+                        await cutPayload(writer);
+                        writer = null;
+                    }
                 }
-            });
-        }  else {
-            return sumoutils.p_retryMax(httpSend,self.MaxAttempts,self.RetryInterval,[msgArray,msgArray.join('\n')], self.context).then(()=> {
-              self.success_callback(self.context);
-            }).catch((err) => {
-                self.messagesFailed += msgArray.length;
-                self.messagesAttempted += msgArray.length;
-                self.context.log.error("Failed to send to Sumo after maxattempts: " + self.MaxAttempts + " " + JSON.stringify(err) + ' messagesAttempted: ' + self.messagesAttempted  + ' messagesReceived: ' + self.messagesReceived);
-                self.failure_callback(msgArray,self.context);
-            });
+            }
+            if (writer) {
+                await cutPayload(writer);
+                writer = null;
+            }
+            await Promise.all(inFlight);
+            if (targetBuffer.getSize() === 0) {
+                // removed synchronously with the emptiness check so that no message is left behind by a concurrent flush
+                self._activeStreams.delete(metaKey);
+                return;
+            }
         }
     }
+
+    let streamPromise = streamLoop().catch(function (err) {
+        self._activeStreams.delete(metaKey);
+        self.context.log.error("Failed to stream buffer for metaKey: " + metaKey + " error: " + err);
+    });
+    this._activeStreams.set(metaKey, streamPromise);
+    return streamPromise;
+};
+
+/**
+ * Send a message or an array of messages right away as a single request, bypassing the buckets. Unlike addData the caller
+ * gets the delivery status of this request, so several requests can be kept in flight while tracking which ones succeeded.
+ * The headers are the ones of the first message.
+ * @param data message or array of messages
+ * @returns {Promise} - resolves to true once sent, false after the last failed attempt
+ */
+SumoClient.prototype.send = function(data) {
+    var self = this;
+    let msgArray = (data instanceof Array) ? data : [data];
+    if (msgArray.length === 0) {
+        return Promise.resolve(true);
+    }
+    let bucketKey = this.getBucketKey(msgArray[0]);
+    let curOptions = this.getRequestOptions(bucketKey.headers);
+    this.messagesReceived += msgArray.length;
+    let lines = msgArray.map(function (message) {
+        if (message instanceof Object) {
+            delete message._sumo_metadata;
+            return JSON.stringify(message);
+        }
+        return message;
+    });
+    let payload = new Promise(function (resolve, reject) {
+        if (!curOptions.compress_data) {
+            return resolve(lines.join('\n'));
+        }
+        zlib.gzip(lines.join('\n'), function (gziperr, compressed_data) {
+            return gziperr ? reject(gziperr) : resolve(compressed_data);
+        });
+    });
+    let sent = payload.then(function (data) {
+        return self.scheduleSend(bucketKey.key, curOptions, lines, data);
+    }).then(function () {
+        self.recordBucketStats(bucketKey.key, lines.length, 0);
+        self.success_callback(self.context);
+        return true;
+    }, function (err) {
+        self.messagesFailed += lines.length;
+        self.messagesAttempted += lines.length;
+        self.recordBucketStats(bucketKey.key, 0, lines.length);
+        self.context.log.error("Failed to send after maxattempts: " + self.MaxAttempts + " error: " + JSON.stringify(err) + ' messagesAttempted: ' + self.messagesAttempted  + ' messagesReceived: ' + self.messagesReceived);
+        self.failure_callback(lines, self.context);
+        return false;
+    });
+    this.trackFlush(sent);
+    return sent;
 };
 
 /**
  * Flush all internal buckets to Sumo
+ * @returns {Promise} - resolves with the delivery stats (see getStats) once all the messages added so far have been attempted
  */
 SumoClient.prototype.flushAll = function() {
     var self = this;
     this.dataMap.forEach( function(buffer,key,dataMap) {
         self.flushBucketToSumo(key);
     });
+    return this.whenFlushed();
+};
+
+/**
+ * Stop the flush timers and flush all internal buckets, the client should not be used afterwards
+ * @returns {Promise} - resolves with the delivery stats, see getStats
+ */
+SumoClient.prototype.close = function() {
+    this.disableTimer();
+    return this.flushAll();
 };
 
+/**
+ * Add one message or an array of messages to the client
+ * @param data message or array of messages
+ * @returns {boolean} false when max_queued_requests are waiting to be sent, callers should then wait for waitForCapacity()
+ * before adding more data
+ */
 SumoClient.prototype.addData = function(data) {
     var self = this;
 
     function submitMessage(message) {
-        let metaKey = self.generateLogBucketKey(message);
-        if (!self.dataMap.has(metaKey)) {
-            self.dataMap.set(metaKey, new bucket.MessageBucket(self.generateHeaders(message)));
+        let bucketKey = self.getBucketKey(message);
+        let targetBucket = self.getBucket(message, bucketKey);
+        if (self.options.max_bucket_bytes && message instanceof Object) {
+            // serialized when added so that the bucket keeps track of its byte size
+            targetBucket.add(JSON.stringify(message));
+        } else {
+            targetBucket.add(message);
         }
-        self.dataMap.get(metaKey).add(message);
+        self.checkBucketThresholds(bucketKey.key, targetBucket);
     }
 
     if (data instanceof Array) {
@@ -237,6 +709,7 @@ SumoClient.prototype.addData = function(data) {
         self.messagesReceived +=1;
         submitMessage(data);
     }
+    return this.scheduler.getQueuedCount() < this.maxQueuedRequests;
 };
 
 /**
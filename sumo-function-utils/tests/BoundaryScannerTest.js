@@ -0,0 +1,37 @@
+/**
+ * Tests for the record boundary scanning functions
+ */
+
+var boundaryScanner = require('../lib/boundaryscanner');
+var chai = require('chai');
+var expect = chai.expect;
+var mocha = require('mocha');
+chai.should();
+
+describe('BoundaryScannerTest',function () {
+    var logRegex = /\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2}/gim;
+    var jsonRegex = '{\\s*"time":';
+
+    it('it should find the first and the last boundary', function () {
+        var data = 'prefix 2024-05-07 10:14:34 first\n2024-05-07 10:14:35 second\n2024-05-07  10:14:36 third';
+        expect(boundaryScanner.boundaryIndexOf(data, logRegex)).to.equal(7);
+        expect(boundaryScanner.boundaryLastIndexOf(data, logRegex)).to.equal(data.indexOf('2024-05-07  10:14:36'));
+        expect(boundaryScanner.boundaryIndexOf(data, logRegex, 8)).to.equal(data.indexOf('2024-05-07 10:14:35'));
+        expect(boundaryScanner.boundaryLastIndexOf(data, logRegex, data.length - 3)).to.equal(-1);
+        expect(boundaryScanner.boundaryIndexOf('no boundary', logRegex)).to.equal(-1);
+        expect(boundaryScanner.boundaryLastIndexOf('', logRegex)).to.equal(-1);
+    });
+
+    it('it should return the last match whatever the text of the other matches', function () {
+        // the last occurrence of the text of the second match is not the last boundary
+        var data = '{"time":1},{ "time":2},{"time":3}';
+        expect(boundaryScanner.boundaryLastIndexOf(data, jsonRegex, 1)).to.equal(23);
+        expect(boundaryScanner.boundaryIndexOf(data, jsonRegex, 1)).to.equal(11);
+    });
+
+    it('it should find the last boundary far from the end of the data', function () {
+        var data = '{"time": 1}' + ' '.repeat(1024 * 1024);
+        expect(boundaryScanner.boundaryLastIndexOf(data, jsonRegex)).to.equal(0);
+        expect(boundaryScanner.boundaryLastIndexOf(data, jsonRegex, 1)).to.equal(-1);
+    });
+});
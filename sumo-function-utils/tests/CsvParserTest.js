@@ -0,0 +1,48 @@
+/**
+ * Tests for the incremental csv parser
+ */
+
+var csvParser = require('../lib/csvparser');
+var chai = require('chai');
+var expect = chai.expect;
+var mocha = require('mocha');
+chai.should();
+
+function parsePieces(pieces) {
+    var rows = [];
+    var parser = new csvParser.CsvParser(',');
+    var onRow = function (row) { rows.push(row); };
+    pieces.forEach(function (piece) {
+        parser.write(piece, onRow);
+    });
+    parser.end(onRow);
+    return rows;
+}
+
+describe('CsvParserTest',function () {
+    var data = 'id,"name","note"\r\n1,"Smith, J","said ""hi""\nand left"\r\n2,,""\n3,plain,last';
+    var expected = [
+        ['id', 'name', 'note'],
+        ['1', 'Smith, J', 'said "hi"\nand left'],
+        ['2', '', ''],
+        ['3', 'plain', 'last']
+    ];
+
+    it('it should parse quoted fields, escaped quotes and line breaks', function () {
+        expect(parsePieces([data])).to.deep.equal(expected);
+        expect(parsePieces(['a,b\n'])).to.deep.equal([['a', 'b']]);
+        expect(parsePieces(['a,b,\r'])).to.deep.equal([['a', 'b', '']]);
+    });
+
+    it('it should parse the same rows whatever the size of the pieces', function () {
+        for (var size = 1; size <= data.length; size++) {
+            var pieces = [];
+            for (var i = 0; i < data.length; i += size) {
+                pieces.push(data.substring(i, i + size));
+            }
+            expect(parsePieces(pieces)).to.deep.equal(expected);
+        }
+        // line break split between pieces
+        expect(parsePieces(['a\r', '\nb'])).to.deep.equal([['a'], ['b']]);
+    });
+});
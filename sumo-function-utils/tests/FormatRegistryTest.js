@@ -0,0 +1,69 @@
+/**
+ * Tests for the registry of the blob formats
+ */
+
+var formatregistry = require('../lib/formatregistry');
+var FormatRegistry = formatregistry.FormatRegistry;
+var LineRecordParser = formatregistry.LineRecordParser;
+var registry = formatregistry.defaultRegistry;
+var chai = require('chai');
+var expect = chai.expect;
+var mocha = require('mocha');
+chai.should();
+
+function formatName(task, head) {
+    var format = registry.getFormat(task, head);
+    return format === null ? null : format.name;
+}
+
+describe('FormatRegistryTest',function () {
+
+    it('it should select the format by container, extension and content', function () {
+        expect(formatName({blobName: "dir/app.log"})).to.equal("log");
+        expect(formatName({blobName: "dir/app.txt"})).to.equal("log");
+        expect(formatName({blobName: "dir/rows.csv"})).to.equal("csv");
+        expect(formatName({blobName: "dir/app.json"})).to.equal("json");
+        expect(formatName({blobName: "dir/app.zip"})).to.equal(null);
+        expect(formatName({blobName: "dir.v2/app"})).to.equal("log");
+        expect(formatName({blobName: "dir/app"}, ' {"time": 1}')).to.equal("json");
+        expect(formatName({blobName: "dir/app"}, '2024-08-19 18:00:06 msg')).to.equal("log");
+        expect(formatName({blobName: "h/PT1H.json", containerName: "insights-logs-networksecuritygroupflowevent"})).to.equal("nsg");
+        expect(formatName({blobName: "h/PT1H.json", containerName: "insights-logs-flowlogflowevent"})).to.equal("vnetflowlogs");
+        expect(formatName({blobName: "h/PT1H.log", containerName: "insights-logs-flowlogflowevent"})).to.equal("log");
+        expect(registry.isSupportedBlob("/blobServices/default/containers/c/blobs/app.csv")).to.equal(true);
+        expect(registry.isSupportedBlob("/blobServices/default/containers/c/blobs/app.zip")).to.equal(false);
+
+        var custom = new FormatRegistry().register({name: "custom", extensions: ["log"]});
+        expect(custom.getFormat({blobName: "app.log"}).name).to.equal("custom");
+        expect(custom.getFormat({blobName: "app"})).to.equal(null);
+    });
+
+    it('it should resolve compressed blobs to the format of the decompressed data', function () {
+        var zlib = require('zlib');
+        var format = registry.getFormat({blobName: "dir/app.csv.gz"});
+        expect(format.name).to.equal("csv");
+        expect(format.compression.name).to.equal("gzip");
+        expect(format.compression.isMemberStart(zlib.gzipSync("a,b\n"))).to.equal(true);
+        expect(format.compression.isMemberStart(Buffer.from("a,b\n"))).to.equal(false);
+        expect(registry.getFormat({blobName: "dir/app.gz"}).name).to.equal("log");
+        expect(registry.getFormat({blobName: "h/PT1H.json.gz", containerName: "insights-logs-networksecuritygroupflowevent"}).name).to.equal("nsg");
+        expect(registry.getFormat({blobName: "dir/app.zz"}).compression.isMemberStart(zlib.deflateSync("x"))).to.equal(true);
+        expect(registry.getFormat({blobName: "dir/app.tar.gz"})).to.equal(null);
+        expect(registry.getFormat({blobName: "dir/app.log"}).compression).to.equal(undefined);
+    });
+
+    it('it should emit complete lines whatever the size of the pieces', function () {
+        var data = Buffer.from("line 1\nline é2\nline 3");
+        for (var size = 1; size <= data.length; size++) {
+            var blocks = [];
+            var parser = new LineRecordParser();
+            for (var i = 0; i < data.length; i += size) {
+                parser.write(data.subarray(i, i + size), function (text) { blocks.push(text); });
+            }
+            var stats = parser.end(function (text) { blocks.push(text); });
+            expect(blocks.join("\n")).to.equal(data.toString());
+            expect(stats.consumed).to.equal(data.lastIndexOf("\n") + 1);
+            expect(stats.incompleteBytes).to.equal("line 3".length);
+        }
+    });
+});
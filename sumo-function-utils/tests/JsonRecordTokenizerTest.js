@@ -0,0 +1,52 @@
+/**
+ * Tests for the byte level JSON record tokenizer
+ */
+
+var JsonRecordTokenizer = require('../lib/jsonrecordtokenizer').JsonRecordTokenizer;
+var chai = require('chai');
+var expect = chai.expect;
+var mocha = require('mocha');
+chai.should();
+
+function tokenize(data, pieceSize, options) {
+    var records = [];
+    var tokenizer = new JsonRecordTokenizer(options);
+    for (var i = 0; i < data.length; i += pieceSize) {
+        tokenizer.write(data.subarray(i, i + pieceSize), function (text, start, end) {
+            records.push([text, start, end]);
+        });
+    }
+    return [records, tokenizer.end()];
+}
+
+describe('JsonRecordTokenizerTest',function () {
+    var records = [
+        {time: "2024-08-19T18:00:06Z", text: 'braces } { ] [ and "quotes" \\'},
+        {time: "2024-08-19T18:01:06Z", nested: {list: [1, {a: "é✓"}], empty: {}}},
+        {time: "2024-08-19T18:02:06Z"}
+    ];
+    var texts = records.map(function (r) { return JSON.stringify(r, null, 1); });
+
+    it('it should split records whatever the size of the pieces', function () {
+        var data = Buffer.from(',' + texts.join(',\n') + '\n');
+        for (var size = 1; size <= 64; size++) {
+            var [result, stats] = tokenize(data, size);
+            expect(result.map(function (r) { return JSON.parse(r[0]); })).to.deep.equal(records);
+            expect(result[1][1]).to.equal(data.indexOf(texts[1]));
+            expect(result[2][2]).to.equal(data.length - 1);
+            expect(stats).to.deep.equal({numRecords: 3, consumed: data.length, skippedBytes: 0, incompleteBytes: 0});
+        }
+    });
+
+    it('it should skip a truncated record at the start and leave out the one at the end', function () {
+        var truncated = texts[0].substring(20);
+        var data = Buffer.from(truncated + ',' + texts[1] + ',' + texts[2] + ',' + texts[0].substring(0, 30));
+        for (var size = 1; size <= 64; size++) {
+            var [result, stats] = tokenize(data, size, {syncRegex: /{\s*"time":/});
+            expect(result.map(function (r) { return JSON.parse(r[0]); })).to.deep.equal([records[1], records[2]]);
+            expect(stats.skippedBytes).to.equal(Buffer.byteLength(truncated) + 1);
+            expect(stats.incompleteBytes).to.equal(30);
+            expect(stats.consumed).to.equal(data.length - 30);
+        }
+    });
+});
@@ -0,0 +1,41 @@
+/**
+ * Tests for the lru cache with optional ttl
+ */
+
+var lruCache = require('../lib/lrucache');
+var chai = require('chai');
+var expect = chai.expect;
+var mocha = require('mocha');
+chai.should();
+
+describe('LRUCacheTest',function () {
+    it('it should evict the least recently used entry', function () {
+        var cache = new lruCache.LRUCache(2);
+        cache.set('a', 1);
+        cache.set('b', 2);
+        expect(cache.get('a')).to.equal(1);
+        cache.set('c', 3);
+        expect(cache.get('b')).to.equal(undefined);
+        expect(cache.get('a')).to.equal(1);
+        expect(cache.get('c')).to.equal(3);
+        expect(cache.getSize()).to.equal(2);
+        cache.delete('a');
+        expect(cache.get('a')).to.equal(undefined);
+    });
+
+    it('it should expire the entries older than the ttl', function () {
+        var cache = new lruCache.LRUCache(2, 1000);
+        var now = Date.now;
+        var time = now();
+        Date.now = function () { return time; };
+        try {
+            expect(cache.getOrCreate('a', function (key) { return key + 1; })).to.equal('a1');
+            expect(cache.getOrCreate('a', function (key) { return key + 2; })).to.equal('a1');
+            time += 1000;
+            expect(cache.get('a')).to.equal(undefined);
+            expect(cache.getSize()).to.equal(0);
+        } finally {
+            Date.now = now;
+        }
+    });
+});
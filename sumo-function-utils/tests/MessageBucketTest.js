@@ -0,0 +1,68 @@
+/**
+ * Tests for the message bucket queue
+ */
+
+var chai = require('chai');
+var expect = chai.expect;
+var mocha = require('mocha');
+var MessageBucket = require('../lib/messagebucket').MessageBucket;
+chai.should();
+
+describe('MessageBucketTest',function () {
+
+    var bucket;
+
+    beforeEach(function () {
+        bucket = new MessageBucket({'X-Sumo-Name': 'test'});
+    });
+
+    it('it should remove elements in FIFO order', function () {
+        for (let i = 0; i < 5000; i++) {
+            bucket.add(i);
+        }
+        for (let i = 0; i < 5000; i++) {
+            expect(bucket.remove()).to.equal(i);
+            expect(bucket.getSize()).to.equal(5000 - i - 1);
+        }
+        expect(bucket.remove()).to.equal(null);
+    });
+
+    it('it should interleave adds and removes', function () {
+        let expected = 0;
+        for (let i = 0; i < 10000; i++) {
+            bucket.add(i);
+            if (i % 3 === 0) {
+                expect(bucket.remove()).to.equal(expected++);
+            }
+        }
+        expect(bucket.getSize()).to.equal(10000 - expected);
+        let rest = bucket.drain();
+        expect(rest.length).to.equal(10000 - expected);
+        expect(rest[0]).to.equal(expected);
+        expect(rest[rest.length - 1]).to.equal(9999);
+        expect(bucket.getSize()).to.equal(0);
+    });
+
+    it('it should hand over the backing array on drain', function () {
+        let messages = [];
+        for (let i = 0; i < 10; i++) {
+            bucket.add({'value': i});
+        }
+        let backingArray = bucket.queue;
+        messages = bucket.drain();
+        expect(messages).to.equal(backingArray);
+        expect(messages.length).to.equal(10);
+        expect(bucket.drain().length).to.equal(0);
+    });
+
+    it('it should keep track of the byte size', function () {
+        bucket.add('abc');
+        bucket.add('été');
+        bucket.add({'value': 1}, 11);
+        expect(bucket.getBytes()).to.equal(3 + 5 + 11);
+        bucket.remove();
+        expect(bucket.getBytes()).to.equal(5 + 11);
+        bucket.drain();
+        expect(bucket.getBytes()).to.equal(0);
+    });
+});
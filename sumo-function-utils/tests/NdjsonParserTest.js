@@ -0,0 +1,48 @@
+/**
+ * Tests for the newline delimited JSON parser
+ */
+
+var NdjsonParser = require('../lib/ndjsonparser').NdjsonParser;
+var chai = require('chai');
+var expect = chai.expect;
+var mocha = require('mocha');
+chai.should();
+
+function parse(data, pieceSize) {
+    var records = [];
+    var errors = [];
+    var onRecord = function (record) {
+        records.push(record);
+    };
+    var parser = new NdjsonParser({onError: function (error, start, end) {
+        errors.push([start, end]);
+    }});
+    for (var i = 0; i < data.length; i += pieceSize) {
+        parser.write(data.subarray(i, i + pieceSize), onRecord);
+    }
+    return [records, errors, parser.end(onRecord)];
+}
+
+describe('NdjsonParserTest',function () {
+
+    it('it should parse each line and report the malformed ones whatever the size of the pieces', function () {
+        var lines = ['{"a":1,"text":"é✓"}', '\u0000\u0000', '{"a":2', '', '{"a":3}\r', '  {"a":4}'];
+        var data = Buffer.from(lines.join('\n'));
+        var badStart = Buffer.byteLength(lines[0] + '\n' + lines[1] + '\n');
+        for (var size = 1; size <= data.length; size++) {
+            var [records, errors, stats] = parse(data, size);
+            expect(records).to.deep.equal([{a: 1, text: "é✓"}, {a: 3}, {a: 4}]);
+            expect(errors).to.deep.equal([[badStart, badStart + lines[2].length]]);
+            expect(stats).to.deep.equal({numRecords: 3, consumed: data.length, skippedBytes: lines[2].length, incompleteBytes: 0, badLines: 1});
+        }
+    });
+
+    it('it should leave out a last line which is not complete', function () {
+        var data = Buffer.from('{"a":1}\n{"a":');
+        var [records, errors, stats] = parse(data, 3);
+        expect(records).to.deep.equal([{a: 1}]);
+        expect(errors).to.deep.equal([]);
+        expect(stats.consumed).to.equal(8);
+        expect(stats.incompleteBytes).to.equal(5);
+    });
+});
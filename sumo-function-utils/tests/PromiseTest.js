@@ -96,3 +96,76 @@ describe('PromiseTest',function () {
 });
 
 
+
+describe('RetryPolicyTest',function () {
+
+    this.timeout(5000);
+
+    function genFailingTask(errors, counter) {
+        return function () {
+            counter.attempts++;
+            return Promise.reject(errors[Math.min(counter.attempts, errors.length) - 1]);
+        };
+    }
+
+    it('RetryPolicy should retry throttling and server errors', function (done) {
+        var policy = new sumoutils.RetryPolicy({maxAttempts: 4, baseDelay: 10});
+        var counter = {attempts: 0};
+        policy.execute(genFailingTask([{'statusCode': 429}, {'statusCode': 503}, {'error': {'code': 'ECONNRESET'}}, {'statusCode': 500}], counter), []).then(() => {
+            expect(true).to.equal(false);
+        }).catch((err) => {
+            expect(counter.attempts).to.equal(4);
+            expect(err.statusCode).to.equal(500);
+        }).then(done, done);
+    });
+
+    it('RetryPolicy should fail fast on client errors', function (done) {
+        var policy = new sumoutils.RetryPolicy({maxAttempts: 5, baseDelay: 10});
+        var counter = {attempts: 0};
+        policy.execute(genFailingTask([{'statusCode': 400}], counter), []).catch((err) => {
+            expect(counter.attempts).to.equal(1);
+            expect(err.statusCode).to.equal(400);
+        }).then(done, done);
+    });
+
+    it('RetryPolicy should retry additional status codes', function (done) {
+        var policy = new sumoutils.RetryPolicy({maxAttempts: 3, baseDelay: 10, retryableStatusCodes: [412]});
+        var counter = {attempts: 0};
+        policy.execute(function () {
+            counter.attempts++;
+            return counter.attempts < 3 ? Promise.reject({'statusCode': 412}) : Promise.resolve('updated');
+        }, []).then((result) => {
+            expect(result).to.equal('updated');
+            expect(counter.attempts).to.equal(3);
+        }).then(done, done);
+    });
+
+    it('RetryPolicy should honor Retry-After', function (done) {
+        var policy = new sumoutils.RetryPolicy({maxAttempts: 2, baseDelay: 1});
+        var counter = {attempts: 0};
+        var startTime = Date.now();
+        policy.execute(genFailingTask([{'statusCode': 429, 'retryAfter': '1'}], counter), []).catch(() => {
+            expect(counter.attempts).to.equal(2);
+            expect(Date.now() - startTime).to.at.least(1000);
+        }).then(done, done);
+    });
+
+    it('RetryPolicy should stop once the time budget is exhausted', function (done) {
+        var policy = new sumoutils.RetryPolicy({maxAttempts: 10, baseDelay: 10, timeBudget: 500});
+        var counter = {attempts: 0};
+        var startTime = Date.now();
+        policy.execute(genFailingTask([{'statusCode': 503, 'retryAfter': '5'}], counter), []).catch(() => {
+            expect(counter.attempts).to.equal(1);
+            expect(Date.now() - startTime).to.lessThan(500);
+        }).then(done, done);
+    });
+
+    it('RetryPolicy backoff should stay within the exponential bound', function () {
+        var policy = new sumoutils.RetryPolicy({baseDelay: 100, maxDelay: 1000});
+        for (let attempt = 1; attempt <= 6; attempt++) {
+            let delay = policy.getDelay(attempt, {});
+            expect(delay).to.at.least(0);
+            expect(delay).to.lessThan(Math.min(1000, 100 * Math.pow(2, attempt - 1)));
+        }
+    });
+});
@@ -0,0 +1,74 @@
+/**
+ * Tests for the send scheduler used by SumoClient
+ */
+
+var chai = require('chai');
+var expect = chai.expect;
+var mocha = require('mocha');
+var SendScheduler = require('../lib/sendscheduler').SendScheduler;
+var sumoutils = require('../lib/sumoutils');
+chai.should();
+
+describe('SendSchedulerTest',function () {
+
+    this.timeout(5000);
+
+    function genTask(log, name, running, delay) {
+        return function () {
+            log.push(name);
+            running.count += 1;
+            running.max = Math.max(running.max, running.count);
+            return sumoutils.p_wait(delay).then(() => { running.count -= 1; return name; });
+        };
+    }
+
+    it('it should not run more than maxInFlight tasks at once', function (done) {
+        var scheduler = new SendScheduler(3);
+        var log = [], running = {count: 0, max: 0}, tasks = [];
+        for (let i = 0; i < 10; i++) {
+            tasks.push(scheduler.schedule('bucket', genTask(log, i, running, 20)));
+        }
+        expect(scheduler.getInFlightCount()).to.equal(3);
+        Promise.all(tasks).then((results) => {
+            expect(running.max).to.equal(3);
+            // tasks of the same key are run in FIFO order
+            expect(log).to.deep.equal([0, 1, 2, 3, 4, 5, 6, 7, 8, 9]);
+            expect(results[9]).to.equal(9);
+            expect(scheduler.getQueuedCount()).to.equal(0);
+        }).then(done, done);
+    });
+
+    it('it should alternate between buckets', function (done) {
+        var scheduler = new SendScheduler(1);
+        var log = [], running = {count: 0, max: 0}, tasks = [];
+        for (let i = 0; i < 4; i++) {
+            tasks.push(scheduler.schedule('large', genTask(log, 'large' + i, running, 5)));
+        }
+        tasks.push(scheduler.schedule('small', genTask(log, 'small0', running, 5)));
+        Promise.all(tasks).then(() => {
+            // the small bucket is served right after the first request of the large one
+            expect(log.indexOf('small0')).to.equal(2);
+        }).then(done, done);
+    });
+
+    it('it should release waiters once the queue drains', function (done) {
+        var scheduler = new SendScheduler(2);
+        var log = [], running = {count: 0, max: 0};
+        for (let i = 0; i < 6; i++) {
+            scheduler.schedule('bucket', genTask(log, i, running, 10)).catch(() => {});
+        }
+        scheduler.whenBelow(1).then(() => {
+            expect(scheduler.getQueuedCount()).to.at.most(1);
+        }).then(done, done);
+    });
+
+    it('it should propagate task failures', function (done) {
+        var scheduler = new SendScheduler(1);
+        scheduler.schedule('bucket', () => Promise.reject({'message': 'fail by design'})).then(() => {
+            expect(true).to.equal(false);
+        }).catch((err) => {
+            expect(err.message).to.equal('fail by design');
+            expect(scheduler.getInFlightCount()).to.equal(0);
+        }).then(done, done);
+    });
+});
@@ -223,3 +223,286 @@ describe('SumoClientTest',function () {
 });
 
 
+describe('SumoClientStubEndpointTest',function () {
+    var http = require('node:http');
+    var zlib = require('node:zlib');
+    var crypto = require('node:crypto');
+    var server;
+    var requests;
+    var concurrency;
+    var stubEndpoint;
+    var testMessageCount = 5000;
+    var context = {'log': function () {}};
+    context.log.verbose = context.log.error = context.log;
+    this.timeout(30000);
+
+    // local stub of a Sumo HTTP source which records the decoded body of every request
+    beforeEach(function (done) {
+        requests = [];
+        concurrency = {'current': 0, 'max': 0};
+        server = http.createServer(function (req, res) {
+            let chunks = [];
+            concurrency.current += 1;
+            concurrency.max = Math.max(concurrency.max, concurrency.current);
+            req.on('data', (chunk) => chunks.push(chunk));
+            req.on('end', () => {
+                let body = Buffer.concat(chunks);
+                requests.push({'size': body.length, 'lines': (req.headers['content-encoding'] === 'gzip' ? zlib.gunzipSync(body) : body).toString().split('\n')});
+                setTimeout(() => {
+                    concurrency.current -= 1;
+                    res.statusCode = 200;
+                    res.end();
+                }, 10);
+            });
+        });
+        server.listen(0, '127.0.0.1', function () {
+            stubEndpoint = 'http://127.0.0.1:' + server.address().port + '/receiver/v1/http/stub';
+            done();
+        });
+    });
+
+    afterEach(function (done) {
+        server.close(done);
+    });
+
+    function generateMessages() {
+        let messages = [];
+        for (let i = 0; i < testMessageCount; i++) {
+            // random padding so that the payload does not compress too well
+            messages.push({'value': i, 'padding': crypto.randomBytes(50).toString('hex')});
+        }
+        return messages;
+    }
+
+    it('it should cut a bucket into size bounded requests', function (done) {
+        var options = {'urlString': stubEndpoint, 'metadata': {}, 'MaxAttempts': 1, 'RetryInterval': 100, 'compress_data': true,
+            'streaming_flush': true, 'max_payload_bytes': 64 * 1024, 'max_pipelined_requests': 2};
+        var sumoClient = new sumoFnUtils.SumoClient(options, context, sumoFnUtils.FlushFailureHandler, validate);
+        sumoClient.addData(generateMessages());
+        sumoClient.flushAll();
+
+        function validate() {
+            if (sumoClient.messagesAttempted === testMessageCount) {
+                expect(sumoClient.messagesFailed).to.equal(0);
+                expect(requests.length).to.greaterThan(1);
+                let values = [];
+                requests.forEach(function (request) {
+                    // a request is cut right after it crosses the cap so it can exceed it by at most one message
+                    expect(request.lines.join('\n').length).to.lessThan(64 * 1024 + 200);
+                    request.lines.forEach((line) => values.push(JSON.parse(line).value));
+                });
+                values.sort((a, b) => a - b);
+                expect(values.length).to.equal(testMessageCount);
+                expect(values[testMessageCount - 1]).to.equal(testMessageCount - 1);
+                done();
+            }
+        }
+    });
+
+    it('it should cut requests on the compressed size cap', function (done) {
+        var options = {'urlString': stubEndpoint, 'metadata': {}, 'MaxAttempts': 1, 'RetryInterval': 100, 'compress_data': true,
+            'streaming_flush': true, 'max_compressed_payload_bytes': 16 * 1024};
+        var sumoClient = new sumoFnUtils.SumoClient(options, context, sumoFnUtils.FlushFailureHandler, validate);
+        sumoClient.addData(generateMessages());
+        sumoClient.flushAll();
+
+        function validate() {
+            if (sumoClient.messagesAttempted === testMessageCount) {
+                expect(sumoClient.messagesSent).to.equal(testMessageCount);
+                expect(requests.length).to.greaterThan(1);
+                done();
+            }
+        }
+    });
+
+    it('it should limit the number of requests in flight across buckets', function (done) {
+        var options = {'urlString': stubEndpoint, 'metadata': {}, 'MaxAttempts': 1, 'RetryInterval': 100, 'compress_data': false,
+            'max_concurrent_requests': 2};
+        var bucketCount = 10;
+        var sumoClient = new sumoFnUtils.SumoClient(options, context, sumoFnUtils.FlushFailureHandler, validate);
+        for (let i = 0; i < bucketCount; i++) {
+            sumoClient.addData({'_sumo_metadata': {'sourceName': 'source' + i}, 'value': i});
+        }
+        sumoClient.flushAll();
+
+        function validate() {
+            if (sumoClient.messagesAttempted === bucketCount) {
+                expect(requests.length).to.equal(bucketCount);
+                expect(concurrency.max).to.equal(2);
+                done();
+            }
+        }
+    });
+
+    it('flushAll should resolve with the delivery stats of each bucket', function () {
+        var options = {'urlString': stubEndpoint, 'metadata': {}, 'MaxAttempts': 1, 'RetryInterval': 100, 'compress_data': true};
+        var sumoClient = new sumoFnUtils.SumoClient(options, context);
+        for (let i = 0; i < 30; i++) {
+            sumoClient.addData({'_sumo_metadata': {'sourceName': 'source' + (i % 3)}, 'value': i});
+        }
+        return sumoClient.flushAll().then(function (stats) {
+            expect(stats.messagesSent).to.equal(30);
+            expect(stats.messagesFailed).to.equal(0);
+            expect(stats.buckets.length).to.equal(3);
+            stats.buckets.forEach((bucketStats) => expect(bucketStats.messagesSent).to.equal(10));
+            // the client can be reused for the next batch
+            sumoClient.addData({'value': 30});
+            return sumoClient.close();
+        }).then(function (stats) {
+            expect(stats.messagesSent).to.equal(31);
+            expect(stats.buckets.length).to.equal(4);
+            expect(requests.length).to.equal(4);
+        });
+    });
+
+    it('flushAll should wait for the flushes started by the bucket thresholds', function () {
+        var options = {'urlString': stubEndpoint, 'metadata': {}, 'MaxAttempts': 1, 'RetryInterval': 100, 'compress_data': false,
+            'streaming_flush': true, 'max_bucket_messages': 100};
+        var sumoClient = new sumoFnUtils.SumoClient(options, context);
+        sumoClient.addData(generateMessages().slice(0, 1050));
+        return sumoClient.flushAll().then(function (stats) {
+            expect(stats.messagesSent).to.equal(1050);
+            expect(stats.messagesAttempted).to.equal(1050);
+        });
+    });
+
+    it('send should resolve with the delivery status of the request', function () {
+        var options = {'urlString': stubEndpoint, 'metadata': {}, 'MaxAttempts': 1, 'RetryInterval': 100, 'compress_data': true};
+        var sumoClient = new sumoFnUtils.SumoClient(options, context);
+        var badClient = new sumoFnUtils.SumoClient({'urlString': 'http://127.0.0.1:1/receiver/v1/http/stub', 'metadata': {}, 'MaxAttempts': 1}, context, function () {});
+        return Promise.all([sumoClient.send('line1\nline2'), sumoClient.send([{'value': 1}, {'value': 2}]), badClient.send('line')]).then(function (results) {
+            expect(results).to.deep.equal([true, true, false]);
+            expect(requests.length).to.equal(2);
+            expect(sumoClient.messagesSent).to.equal(3);
+            expect(badClient.messagesFailed).to.equal(1);
+        });
+    });
+
+    it('getStats should count the responses by status code', function () {
+        var throttled = http.createServer(function (req, res) {
+            req.resume();
+            req.on('end', () => {
+                res.statusCode = 429;
+                res.end();
+            });
+        });
+        return new Promise((resolve) => throttled.listen(0, '127.0.0.1', resolve)).then(function () {
+            var options = {'urlString': 'http://127.0.0.1:' + throttled.address().port + '/receiver/v1/http/stub', 'metadata': {}, 'MaxAttempts': 2, 'RetryInterval': 10, 'compress_data': true};
+            var sumoClient = new sumoFnUtils.SumoClient(options, context, function () {});
+            return sumoClient.send('line').then((success) => [success, sumoClient.getStats()]);
+        }).then(function ([success, stats]) {
+            expect(success).to.equal(false);
+            // one throttled response per attempt
+            expect(stats.failedStatusCodes[429]).to.equal(2);
+            expect(stats.messagesFailed).to.equal(1);
+        }).finally(function () {
+            throttled.close();
+        }).then(function () {
+            // the stub endpoint answers 200
+            var sumoClient = new sumoFnUtils.SumoClient({'urlString': stubEndpoint, 'metadata': {}, 'MaxAttempts': 1}, context);
+            return sumoClient.send('line').then(() => sumoClient.getStats());
+        }).then(function (stats) {
+            expect(stats.failedStatusCodes).to.deep.equal({});
+        });
+    });
+
+    it('flushAll should report the failed messages', function () {
+        var options = {'urlString': 'http://127.0.0.1:1/receiver/v1/http/stub', 'metadata': {}, 'MaxAttempts': 1, 'RetryInterval': 10, 'compress_data': true};
+        var failed = [];
+        var sumoClient = new sumoFnUtils.SumoClient(options, context, (msgArray) => failed.push(...msgArray));
+        sumoClient.addData([{'value': 1}, {'value': 2}]);
+        return sumoClient.flushAll().then(function (stats) {
+            expect(stats.messagesFailed).to.equal(2);
+            expect(stats.buckets[0].messagesFailed).to.equal(2);
+            expect(failed.length).to.equal(2);
+        });
+    });
+});
+
+describe('SumoClientBucketKeyTest',function () {
+    var context = {'log': function () {}};
+    context.log.verbose = context.log.error = context.log;
+    var options = {'urlString': 'http://127.0.0.1/receiver/v1/http/stub', 'metadata': {'sourceCategory': 'default_category'}, 'MaxAttempts': 1};
+
+    it('it should group messages in the same buckets as generateLogBucketKey', function () {
+        var sumoClient = new sumoFnUtils.SumoClient(options, context, sumoFnUtils.FlushFailureHandler, function () {});
+        var messages = [];
+        for (let i = 0; i < 100; i++) {
+            if (i % 3 === 0) {
+                messages.push({'value': i});
+            } else {
+                messages.push({'_sumo_metadata': {'category': 'category' + (i % 3), 'sourceName': 'name'}, 'value': i});
+            }
+        }
+        var expectedKeys = new Set(messages.map((message) => sumoClient.generateLogBucketKey(message)));
+        sumoClient.addData(messages);
+        expect(sumoClient.dataMap.size).to.equal(3);
+        expect(Array.from(sumoClient.dataMap.keys()).sort()).to.deep.equal(Array.from(expectedKeys).sort());
+        sumoClient.dataMap.forEach(function (bucket, key) {
+            expect(JSON.stringify(bucket.getHeadersObject())).to.equal(key);
+        });
+        expect(sumoClient.getBucketKey({'value': 0}).headers['X-Sumo-Category']).to.equal('default_category');
+    });
+
+    it('it should not depend on the order of the metadata properties', function () {
+        var sumoClient = new sumoFnUtils.SumoClient(options, context, sumoFnUtils.FlushFailureHandler, function () {});
+        sumoClient.addData([{'_sumo_metadata': {'category': 'c', 'sourceName': 'n'}, 'value': 1},
+            {'_sumo_metadata': {'sourceName': 'n', 'category': 'c'}, 'value': 2}]);
+        expect(sumoClient.dataMap.size).to.equal(1);
+        expect(sumoClient.dataMap.values().next().value.getSize()).to.equal(2);
+    });
+});
+
+describe('SumoClientAutoFlushTest',function () {
+    var context = {'log': function () {}};
+    context.log.verbose = context.log.error = context.log;
+    this.timeout(5000);
+
+    function createClient(options, flushed) {
+        options.urlString = 'http://127.0.0.1/receiver/v1/http/stub';
+        options.metadata = {};
+        var sumoClient = new sumoFnUtils.SumoClient(options, context, function () {}, function () {});
+        // record the flushed buckets instead of sending them
+        sumoClient.flushBucketToSumo = function (metaKey) {
+            this.clearBucketTimer(metaKey);
+            flushed.push(this.dataMap.get(metaKey).drain());
+        };
+        return sumoClient;
+    }
+
+    it('it should flush a bucket once it reaches max_bucket_messages', function () {
+        var flushed = [];
+        var sumoClient = createClient({'max_bucket_messages': 10}, flushed);
+        for (let i = 0; i < 25; i++) {
+            sumoClient.addData({'value': i});
+        }
+        expect(flushed.length).to.equal(2);
+        expect(flushed[0].length).to.equal(10);
+        expect(sumoClient.dataMap.values().next().value.getSize()).to.equal(5);
+    });
+
+    it('it should flush a bucket once it reaches max_bucket_bytes', function () {
+        var flushed = [];
+        var sumoClient = createClient({'max_bucket_bytes': 100}, flushed);
+        for (let i = 0; i < 20; i++) {
+            sumoClient.addData({'value': 'abcdefghij'});
+        }
+        // each serialized message is 22 bytes long
+        expect(flushed.length).to.equal(4);
+        expect(flushed[0].length).to.equal(5);
+        expect(flushed[0][0]).to.equal('{"value":"abcdefghij"}');
+    });
+
+    it('it should flush a bucket max_bucket_age_ms after its first message', function (done) {
+        var flushed = [];
+        var sumoClient = createClient({'max_bucket_age_ms': 50}, flushed);
+        sumoClient.addData({'value': 1});
+        setTimeout(() => sumoClient.addData({'value': 2}), 20);
+        setTimeout(function () {
+            expect(flushed.length).to.equal(1);
+            expect(flushed[0].length).to.equal(2);
+            expect(sumoClient._bucketTimers.size).to.equal(0);
+            done();
+        }, 100);
+    });
+});